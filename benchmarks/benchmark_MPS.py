@@ -0,0 +1,212 @@
+'''Command latency benchmark of the pyB12MPS package
+
+Measures the round trip latency, throughput and jitter of every public MPS method and of the example workflows. The benchmark runs against an MPS connected to a serial port or against the simulated MPS. The results are saved as JSON to compare releases.
+
+Usage::
+
+    python benchmark_MPS.py                                # simulated MPS, 2 ms latency per command
+    python benchmark_MPS.py --pty                          # simulated MPS served on a pseudo terminal
+    python benchmark_MPS.py --port auto                    # MPS hardware, detect serial port
+    python benchmark_MPS.py --port COM3 --output new.json --compare old.json
+
+'''
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+import pyB12MPS
+
+# Methods which are not benchmarked as a command: connection handling and host-only functions
+excluded_methods = ('init', 'close', 'detectMPSSerialPort', 'listPorts', 'sampler', 'stream', 'record', 'autotune', 'tracker', 'drifttracker', 'powercalibration', 'calibratedpower', 'batch', 'cache', 'invalidate', 'instrument',
+        'submit', 'priority', 'foreground_busy')
+
+# Setters are benchmarked by setting the current value of the parameter. Set commands have no reply, so each set is
+# followed by an id? query inside the timing, which measures the time until the MPS has processed the command.
+setter_methods = ('ampgain', 'ampstatus', 'debug', 'freq', 'lockdelay', 'lockstatus', 'lockstep', 'power', 'rfstatus',
+        'rfsweepdwelltime', 'rfsweepinitialdwelltime', 'rfsweeppower', 'rfsweepnpts', 'rfsweepsw', 'screen', 'triglength', 'wgstatus')
+
+def statistics(durations):
+    '''Return latency statistics in ms and throughput in calls/s of a list of durations in s'''
+    durations = np.asarray(durations) * 1.e3
+    return {
+        'n' : len(durations),
+        'mean_ms' : float(np.mean(durations)),
+        'median_ms' : float(np.median(durations)),
+        'std_ms' : float(np.std(durations)),
+        'min_ms' : float(np.min(durations)),
+        'p90_ms' : float(np.percentile(durations, 90)),
+        'p99_ms' : float(np.percentile(durations, 99)),
+        'max_ms' : float(np.max(durations)),
+        'calls_per_s' : float(1.e3 / np.mean(durations)),
+        }
+
+def measure(function, repeat, mps):
+    '''Call function repeat times and return the statistics of the durations'''
+    function() # warm up
+    durations = []
+    for ix in range(repeat):
+        startTime = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - startTime)
+    mps.id() # wait until the MPS has processed all set commands
+    return statistics(durations)
+
+def method_cases(mps):
+    '''Return dict of method name to function calling the method'''
+    cases = {}
+    for name in dir(pyB12MPS.MPS):
+        if name.startswith('_') or name in excluded_methods or not callable(getattr(pyB12MPS.MPS, name)):
+            continue
+        method = getattr(mps, name)
+        if name in setter_methods:
+            value = method()
+            cases[name + ' (query)'] = method
+            cases[name + ' (set + id?)'] = lambda method = method, value = value: (method(value), mps.id())
+        elif name == 'query_many':
+            cases['query_many (4 queries)'] = lambda: mps.query_many(['freq', 'power', 'rxpowermv', 'txpowermv'])
+        elif name == 'send_command':
+            cases['send_command (id?)'] = lambda: mps.send_command('id?', recv = True)
+        elif name == 'send_commands':
+            cases['send_commands (4 queries)'] = lambda: mps.send_commands(['freq?', 'power?', 'rxpowermv?', 'txpowermv?'], recv = True)
+        elif name == 'sweep':
+            freqs = np.linspace(mps.freq() - 0.005, mps.freq() + 0.005, 10)
+            cases['sweep (10 points)'] = lambda: mps.sweep(freqs, settle = 0.)
+        elif name == 'rxsettle':
+            cases['rxsettle'] = lambda: mps.rxsettle(maxWait = 0.05)
+        elif name == 'rfsweepdosweep':
+            cases['rfsweepdosweep (+ id?)'] = lambda: (mps.rfsweepdosweep(), mps.id())
+        elif name == 'rfsweepdata':
+            cases['rfsweepdata'] = method
+            cases['rfsweepdata (freqAxis)'] = lambda: mps.rfsweepdata(freqAxis = True)
+        else:
+            cases[name] = method
+    return cases
+
+def scenario_cases(mps):
+    '''Return dict of end-to-end workflows of the examples'''
+
+    # Set commands have no reply, the workflows end with an id? query to include the time until the MPS processed them
+    def set_output(): # example_MPS_enable_output.py without the delay, RF output stays off
+        mps.power(0)
+        mps.freq(9.5)
+        mps.wgstatus(0)
+        mps.rfstatus(0)
+
+    def enable_output():
+        set_output()
+        mps.id()
+
+    def enable_output_batch():
+        with mps.batch():
+            set_output()
+        mps.id()
+
+    def rx_monitor(): # example_MPS_rx_monitor.py, 100 points
+        for ix in range(100):
+            mps.rxpowermv()
+
+    def tune_curve(): # example_MPS_tune_curve_manual.py without settle time
+        mps.sweep(np.linspace(9.4, 9.6, 100), settle = 0., power = 0)
+
+    def tune_curve_manual(): # the original loop of example_MPS_tune_curve_manual.py without settle time
+        for freq in np.linspace(9.4, 9.6, 100):
+            mps.freq(freq)
+            mps.rxpowermv()
+
+    return {
+        'enable_output' : enable_output,
+        'enable_output (batch)' : enable_output_batch,
+        'rx_monitor (100 points)' : rx_monitor,
+        'tune_curve (sweep, 100 points)' : tune_curve,
+        'tune_curve (manual loop, 100 points)' : tune_curve_manual,
+        }
+
+def connect(args):
+    '''Connect to the MPS selected by the command line arguments'''
+    if args.port == 'auto':
+        return pyB12MPS.MPS(fastConnect = args.fast_connect), None
+    if args.port is not None:
+        return pyB12MPS.MPS(port = args.port, fastConnect = args.fast_connect), None
+
+    simulator = pyB12MPS.SimulatedMPS(latency = args.latency / 1.e3, seed = 0)
+    if args.pty:
+        return pyB12MPS.MPS(port = simulator.open_pty(), fastConnect = True), simulator
+    return pyB12MPS.MPS(ser = simulator, fastConnect = True), simulator
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark the command latency of the MPS')
+    parser.add_argument('--port', default = None, help = "serial port of the MPS, 'auto' to detect. By default a simulated MPS is used.")
+    parser.add_argument('--fast-connect', action = 'store_true', help = 'connect to the MPS hardware with fastConnect')
+    parser.add_argument('--latency', type = float, default = 2., help = 'latency of the simulated MPS per command in ms')
+    parser.add_argument('--pty', action = 'store_true', help = 'serve the simulated MPS on a pseudo terminal')
+    parser.add_argument('--repeat', type = int, default = 50, help = 'number of calls per method')
+    parser.add_argument('--connect-repeat', type = int, default = 3, help = 'number of connections to measure')
+    parser.add_argument('--output', default = 'benchmark_results.json', help = 'JSON file for the results')
+    parser.add_argument('--compare', default = None, help = 'JSON file of previous results to compare the median latency')
+    args = parser.parse_args()
+
+    results = {
+        'metadata' : {
+            'pyB12MPS' : pyB12MPS.__version__,
+            'python' : sys.version.split()[0],
+            'platform' : platform.platform(),
+            'transport' : args.port if args.port is not None else ('simulated pty' if args.pty else 'simulated'),
+            'simulated_latency_ms' : args.latency if args.port is None else None,
+            'repeat' : args.repeat,
+            'date' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+            },
+        'connect' : {},
+        'methods' : {},
+        'scenarios' : {},
+        }
+
+    # MPS.__init__ including opening the serial port
+    durations = []
+    for ix in range(args.connect_repeat):
+        startTime = time.perf_counter()
+        mps, simulator = connect(args)
+        durations.append(time.perf_counter() - startTime)
+        mps.close()
+        if simulator is not None:
+            simulator.close()
+    results['connect']['MPS.__init__'] = statistics(durations)
+
+    mps, simulator = connect(args)
+    mps.wgstatus(0) # keep the RF output off during the benchmark
+    mps.rfstatus(0)
+    mps.rfsweepdosweep() # data for rfsweepdata
+    time.sleep(1)
+    try:
+        for name, function in method_cases(mps).items():
+            results['methods'][name] = measure(function, args.repeat, mps)
+            print('%-40s %8.3f ms median %8.3f ms p99 %9.1f calls/s'%(name, results['methods'][name]['median_ms'],
+                results['methods'][name]['p99_ms'], results['methods'][name]['calls_per_s']))
+
+        for name, function in scenario_cases(mps).items():
+            results['scenarios'][name] = measure(function, max(args.repeat // 10, 3), mps)
+            print('%-40s %8.3f ms median'%(name, results['scenarios'][name]['median_ms']))
+    finally:
+        mps.close()
+        if simulator is not None:
+            simulator.close()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent = 2)
+    print('Results saved to %s'%args.output)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            previous = json.load(f)
+        print('%-40s %10s %10s %8s'%('', 'previous', 'current', 'ratio'))
+        for section in ('connect', 'methods', 'scenarios'):
+            for name, stats in results[section].items():
+                if name in previous.get(section, {}):
+                    previousMedian = previous[section][name]['median_ms']
+                    print('%-40s %7.3f ms %7.3f ms %8.2f'%(name, previousMedian, stats['median_ms'], stats['median_ms'] / previousMedian))
+
+if __name__ == '__main__':
+    main()
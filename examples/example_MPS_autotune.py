@@ -0,0 +1,16 @@
+import pyB12MPS
+
+mps = pyB12MPS.MPS() # initialize MPS class
+
+mps.wgstatus(1) # Enable WG status
+
+# Find the cavity resonance with RF sweeps of 250, 100, 50 and 10 MHz width
+result = mps.autotune()
+
+for center, width in zip(result['centers'], result['widths']):
+    print('%5.0f MHz sweep: dip at %0.6f GHz'%(width, center))
+print('Tuned to %0.6f GHz in %0.2f s'%(result['freq'], result['time']))
+
+mps.wgstatus(0)
+
+mps.close() # close serial connection
@@ -3,10 +3,11 @@ import time
 
 mps = pyB12MPS.MPS() # Initialize MPS class
 
-mps.power(0) # Set Power to 0 dBm
-mps.freq(9.5) # Set Frequency to 9.5 GHz
-mps.wgstatus(1) # Enable WG Switch for DNP Mode
-mps.rfstatus(1) # Enable RF Output
+with mps.batch(): # Send the following commands in a single write
+    mps.power(0) # Set Power to 0 dBm
+    mps.freq(9.5) # Set Frequency to 9.5 GHz
+    mps.wgstatus(1) # Enable WG Switch for DNP Mode
+    mps.rfstatus(1) # Enable RF Output
 
 time.sleep(3) # Delay 3 seconds
 
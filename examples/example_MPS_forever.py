@@ -2,8 +2,10 @@ import pyB12MPS
 
 mps = pyB12MPS.MPS()
 
-ix = 0
-while True:
-    rx = mps.rxpowermv()
-    print(ix, rx, 'mV')
-    ix += 1
+# Read the Rx diode continuously in chunks of 10 samples
+with mps.stream(channels = ('rxpowermv',), chunk = 10) as stream:
+    ix = 0
+    for data in stream:
+        for rx in data['rxpowermv']:
+            print(ix, rx, 'mV')
+            ix += 1
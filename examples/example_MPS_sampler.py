@@ -0,0 +1,20 @@
+import pyB12MPS
+import time
+
+mps = pyB12MPS.MPS() # initialize MPS class
+
+# Sample Rx diode voltage and amplifier temperature at 20 Hz in the background
+sampler = mps.sampler(channels = ('rxpowermv', 'amptemp'), rate = 20, size = 100000)
+
+lastTime = 0.
+for ix in range(10):
+    time.sleep(1) # the sampler keeps acquiring while the script does other work
+    data = sampler.since(lastTime) # samples acquired since the last read
+    if not len(data):
+        continue
+    lastTime = data['time'][-1]
+    print(len(data), 'samples, mean Rx: %0.1f mV'%data['rxpowermv'].mean(), 'amp temp: %0.1f C'%data['amptemp'][-1])
+
+sampler.stop() # stop sampling
+
+mps.close() # close MPS connection
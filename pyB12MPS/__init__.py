@@ -1,2 +1,13 @@
 from .mps import *
+from .asyncmps import AsyncMPS
+from .sampler import Sampler, SampleReader, Stream
+from .simulator import SimulatedMPS
+from .instrumentation import CommandStats
+from .status import SystemStatus, systemStatusDtype, parseSystemStatus
+from .recorder import Recorder, Recording
+from .transcript import RecordingSerial, ReplaySerial
+from .analysis import dipCenter, fitDips, dipFitDtype
+from .calibration import PowerCalibration, defaultCalibrationDirectory
+from .tracking import FrequencyTracker, DriftTracker, driftHistoryDtype
+from .server import MPSServer, MPSClient
 from .version import __version__
@@ -0,0 +1,181 @@
+import numpy as np
+
+# Results of fitDips, one row per tuning curve
+dipFitDtype = np.dtype([
+    ('center', '<f8'), # GHz
+    ('depth', '<f4'), # relative depth of the dip between 0 and 1
+    ('fwhm', '<f4'), # MHz
+    ('q', '<f4'),
+    ('baseline', '<f4'), # off-resonance level in the units of the tuning curves
+    ])
+
+
+def _smooth(curves):
+    '''Three point moving average along the last axis, the end points are kept
+    '''
+    smoothed = curves.astype(float)
+    if curves.shape[-1] >= 3:
+        smoothed[..., 1:-1] = (curves[..., :-2] + curves[..., 1:-1] + curves[..., 2:]) / 3.
+    return smoothed
+
+
+def _prepare(freqs, curves):
+    '''Return the tuning curves as 2-D array, the frequency axis broadcast to it and True if a single curve was given
+    '''
+    curves = np.asarray(curves, dtype = float)
+    single = curves.ndim == 1
+    curves = np.atleast_2d(curves)
+    freqs = np.broadcast_to(np.asarray(freqs, dtype = float), curves.shape)
+    if curves.shape[-1] < 3:
+        raise ValueError('Tuning curves must have at least 3 points')
+    return freqs, curves, single
+
+
+def _fitVertex(freqs, curves, window):
+    '''Least squares parabola around the minimum of each curve
+
+    Returns:
+        tuple: center frequencies, values at the vertex and index of the point closest to the minimum
+    '''
+    npts = curves.shape[-1]
+    window = max(1, min(int(window), (npts - 1) // 2))
+
+    minimum = np.argmin(_smooth(curves), axis = -1)
+    start = np.clip(minimum - window, 0, npts - 2 * window - 1)
+    offsets = np.arange(-window, window + 1)
+    points = np.take_along_axis(curves, start[:, None] + window + offsets, axis = -1)
+
+    # least squares parabola a * x**2 + b * x + c with x in units of the point spacing
+    a, b, c = np.linalg.pinv(np.vander(offsets, 3)) @ points.T
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        vertex = np.where(a > 0, -b / (2. * a), minimum - start - window)
+    vertex = np.clip(vertex, -window, window)
+    values = np.where(a > 0, (a * vertex + b) * vertex + c, points.min(axis = -1))
+
+    centerIndex = start + window
+    spacing = freqs[:, 1] - freqs[:, 0]
+    centers = np.take_along_axis(freqs, centerIndex[:, None], axis = -1)[:, 0] + vertex * spacing
+    return centers, values, minimum
+
+
+def dipCenter(freqs, curves, window = 2):
+    '''Estimate the center frequency of the resonance dip of tuning curves
+
+    A parabola is fitted to the 2 * window + 1 points around the minimum of each (smoothed) tuning curve. All curves are fitted at once with one matrix product, the vertex of the parabola is the center estimate.
+
+    Args:
+        freqs (numpy.ndarray): Frequency axis in GHz, 1-D for all curves or one row per curve. The points must be equally spaced.
+        curves (numpy.ndarray): Tuning curve (1-D) or stack of tuning curves (2-D, one curve per row), e.g. from rfsweepdata()
+        window (int): Number of points on each side of the minimum included in the fit
+
+    Returns:
+        float, numpy.ndarray: Center frequency in GHz of each curve
+
+    Example::
+
+        freqs, data = mps.rfsweepdata(freqAxis = True)
+        center = pyB12MPS.dipCenter(freqs, data)
+
+    '''
+    freqs, curves, single = _prepare(freqs, curves)
+    centers = _fitVertex(freqs, curves, window)[0]
+    if single:
+        return float(centers[0])
+    return centers
+
+
+def _crossings(freqs, curves, level, minimum):
+    '''Frequencies where the curves cross level on the low and high frequency side of the minimum, nan if a curve does not cross
+    '''
+    rows, npts = curves.shape
+    columns = np.arange(npts)
+    above = curves >= level[:, None]
+
+    # last point above the level below the minimum and first point above the level after the minimum
+    left = np.where(above & (columns < minimum[:, None]), columns, -1).max(axis = -1)
+    right = np.where(above & (columns > minimum[:, None]), columns, npts).min(axis = -1)
+
+    crossings = []
+    for outer, found in ((left, left >= 0), (right, right < npts)):
+        outer = np.where(found, outer, minimum)
+        inner = outer + np.where(outer < minimum, 1, -1)
+        inner = np.clip(inner, 0, npts - 1)
+        yOuter = np.take_along_axis(curves, outer[:, None], axis = -1)[:, 0]
+        yInner = np.take_along_axis(curves, inner[:, None], axis = -1)[:, 0]
+        fOuter = np.take_along_axis(freqs, outer[:, None], axis = -1)[:, 0]
+        fInner = np.take_along_axis(freqs, inner[:, None], axis = -1)[:, 0]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            fraction = (yOuter - level) / (yOuter - yInner)
+        crossings.append(np.where(found, fOuter + fraction * (fInner - fOuter), np.nan))
+    return crossings
+
+
+def _fitDips(freqs, curves, window, edge):
+    npts = curves.shape[-1]
+    results = np.zeros(len(curves), dtype = dipFitDtype)
+    if not len(curves):
+        return results
+
+    centers, values, minimum = _fitVertex(freqs, curves, window)
+    edgePoints = max(1, int(edge * npts))
+    baseline = np.median(np.concatenate((curves[:, :edgePoints], curves[:, -edgePoints:]), axis = -1), axis = -1)
+    low, high = _crossings(freqs, curves, (baseline + values) / 2., minimum)
+    fwhm = (high - low) * 1.e3 # MHz
+
+    results['center'] = centers
+    results['baseline'] = baseline
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        results['depth'] = (baseline - values) / baseline
+        results['q'] = centers * 1.e3 / fwhm
+    results['fwhm'] = fwhm
+    return results
+
+
+def _fitDipsChunk(arguments):
+    return _fitDips(*arguments)
+
+
+def fitDips(freqs, curves, window = 2, edge = 0.1, processes = None, chunk = 10000):
+    '''Fit the resonance dip of a stack of tuning curves
+
+    The center is the vertex of a parabola fitted around the minimum of each curve (see dipCenter), the baseline is the median of the points at both ends of the curve and the depth is relative to the baseline. The FWHM is the width at half depth, linearly interpolated between the points, and Q is the center frequency divided by the FWHM. All curves are analyzed together with vectorized NumPy operations.
+
+    For very large archives the curves can be split into chunks which are analyzed in a pool of processes.
+
+    Args:
+        freqs (numpy.ndarray): Frequency axis in GHz, 1-D for all curves or one row per curve. The points must be equally spaced.
+        curves (numpy.ndarray): Tuning curve (1-D) or stack of tuning curves (2-D, one curve per row), e.g. from rfsweepdata()
+        window (int): Number of points on each side of the minimum included in the parabola fit
+        edge (float): Fraction of the points at each end of the curves used for the baseline
+        processes (None, int): Number of worker processes. If None, the curves are analyzed in this process.
+        chunk (int): Number of curves per chunk in the process pool
+
+    Returns:
+        numpy.ndarray: structured array of dipFitDtype with one row per curve. FWHM and Q are nan if a curve does not reach the half depth on both sides of the minimum, e.g. if the dip is not within the sweep.
+
+    Example::
+
+        freqs, data = mps.rfsweepdata(freqAxis = True)
+        archive = np.load('sweeps.npy') # one tuning curve per row
+        results = pyB12MPS.fitDips(freqs, archive)
+        plt.plot(temperatures, results['q'])
+
+    '''
+    freqs, curves, single = _prepare(freqs, curves)
+    if not 0. < edge <= 0.5:
+        raise ValueError('Edge must be greater than 0 and at most 0.5')
+
+    if processes is None or len(curves) <= chunk:
+        return _fitDips(freqs, curves, window, edge)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    sharedAxis = np.ndim(freqs) == 2 and freqs.strides[0] == 0 # 1-D axis broadcast to all curves
+    tasks = []
+    for start in range(0, len(curves), int(chunk)):
+        rows = slice(start, start + int(chunk))
+        chunkFreqs = freqs[0] if sharedAxis else freqs[rows]
+        chunkCurves = curves[rows]
+        tasks.append((np.broadcast_to(chunkFreqs, chunkCurves.shape), chunkCurves, window, edge))
+    with ProcessPoolExecutor(processes) as pool:
+        return np.concatenate(list(pool.map(_fitDipsChunk, tasks)))
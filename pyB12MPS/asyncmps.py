@@ -0,0 +1,365 @@
+import asyncio
+import functools
+import serial
+import time
+
+from .mps import MPS, _queryNames, _convertReply
+
+
+class _ReplyNeeded(Exception):
+    '''Raised by _CommandCapture when an MPS method needs a reply from the MPS
+    '''
+    def __init__(self, command):
+        self.command = command
+
+
+class _MultipleCommands(Exception):
+    '''Raised by _CommandCapture when an MPS method sends several commands
+    '''
+
+
+class _CommandCapture(MPS):
+    '''MPS without a serial port which captures the commands of an MPS method
+
+    Running an MPS method on a _CommandCapture validates the arguments and captures the command string. For queries, the method is run a second time with the reply from the MPS to apply the unit conversion.
+
+    Args:
+        reply (None, str): Reply returned for queries. If None, queries raise _ReplyNeeded.
+    '''
+    def __init__(self, reply = None):
+        self.commands = []
+        self.reply = reply
+
+    def send_command(self, command, recv = False, raw = False):
+        if recv:
+            if self.reply is None:
+                raise _ReplyNeeded(command)
+            if raw:
+                return self.reply.encode('utf-8')
+            return self.reply
+        self.commands.append(command)
+
+    def send_commands(self, commands, recv = False, raw = False):
+        raise _MultipleCommands()
+
+    def __del__(self):
+        pass
+
+
+class _ThreadedCommands(MPS):
+    '''MPS without a serial port which runs the serial communication of an MPS method on the event loop of an AsyncMPS
+
+    Used for MPS methods with several exchanges or waits, e.g. freq(settle = True). The method runs in an executor thread and waits for each exchange, the event loop is not blocked.
+    '''
+    def __init__(self, asyncMPS, loop):
+        self._asyncMPS = asyncMPS
+        self._loop = loop
+
+    def send_command(self, command, recv = False, raw = False):
+        recv_strings = self.send_commands([command], recv = recv, raw = raw)
+        if recv:
+            return recv_strings[0]
+
+    def send_commands(self, commands, recv = False, raw = False):
+        future = asyncio.run_coroutine_threadsafe(self._asyncMPS.send_commands(list(commands), recv = recv), self._loop)
+        recv_strings = future.result()
+        if raw:
+            return [recv_string.encode('utf-8') for recv_string in recv_strings]
+        return recv_strings
+
+    def __del__(self):
+        pass
+
+
+def _asyncCommand(name):
+    '''Return an awaitable version of the MPS method name
+    '''
+    method = getattr(MPS, name)
+
+    @functools.wraps(method)
+    async def asyncMethod(self, *args, **kwargs):
+        return await self._run(method, *args, **kwargs)
+
+    return asyncMethod
+
+
+class AsyncMPS:
+    '''Asyncio version of the MPS class
+
+    All getters and setters of the MPS class are coroutines with the same arguments, validation and unit conversions. The serial port is read without blocking the event loop. Functions which send several commands or wait, e.g. freq(settle = True), rfsweepdata(freqAxis = True) and sweep(), run in an executor thread while their serial communication is done on the event loop.
+
+    Args:
+        port (None, str): Serial port of the MPS. If None, the port is detected automatically.
+        pollInterval (float): Interval in seconds to poll the serial port if it does not provide a file descriptor (e.g. on Windows)
+
+    Example::
+
+        mps = await pyB12MPS.AsyncMPS.connect()
+
+        await mps.freq(9.5) # Set Microwave Frequency to 9.5 GHz
+        freq, rx = await mps.query_many(['freq', 'rxpowermv'])
+
+        mps.close()
+
+    '''
+    def __init__(self, port = None, pollInterval = 0.005):
+        if port == None:
+            port = MPS.detectMPSSerialPort(self)
+        self.port = port
+        self.pollInterval = pollInterval
+        self.ser = None
+        self._fd = None
+        self._buffer = bytearray()
+        self._lock = None
+
+    @classmethod
+    async def connect(cls, port = None, fastConnect = False, ser = None):
+        '''Create an AsyncMPS and connect to the MPS
+
+        Args:
+            port (None, str): Serial port of the MPS. If None, the port is detected automatically.
+            fastConnect (bool): See MPS.init
+            ser (None, serial.Serial): Serial port object to use instead of opening the port, e.g. a SimulatedMPS
+
+        Returns:
+            AsyncMPS: connected MPS
+        '''
+        if ser is not None and port == None:
+            port = ser.port
+        mps = cls(port)
+        await mps.init(fastConnect = fastConnect, ser = ser)
+        return mps
+
+    async def init(self, fastConnect = False, probeTimeout = 0.25, ser = None, bootTimeout = 30.):
+        '''Open the serial port and wait until the MPS is ready
+
+        Args:
+            fastConnect (bool): If True, the MPS is probed with an id query and the connection returns as soon as the MPS answers. The full boot wait is only performed if the MPS does not answer.
+            probeTimeout (float): Time in seconds to wait for the answer to the id query if fastConnect is True. A later answer is confirmed with a second id query, since "Bridge12 MPS" is also the first boot message.
+            ser (None, serial.Serial): Serial port object to use instead of opening the port, e.g. a SimulatedMPS
+            bootTimeout (float): Maximum time in seconds to wait for the MPS to be ready
+
+        Raises:
+            RuntimeError: if the MPS is not ready within bootTimeout
+        '''
+        print('Connecting to MPS using port %s'%self.port)
+        self._lock = asyncio.Lock()
+
+        if ser is None:
+            ser = serial.Serial(None, 115200)
+            ser.port = self.port
+            if fastConnect:
+                ser.dtr = False # do not reset the MPS on open where the platform allows
+            ser.open()
+        self.ser = ser
+        self.ser.timeout = 0 # non-blocking reads
+        try:
+            self._fd = self.ser.fileno()
+        except (AttributeError, serial.SerialException):
+            self._fd = None
+
+        deadline = time.monotonic() + bootTimeout
+        from_mps_string = ''
+        idReplies = 0
+        if fastConnect:
+            # A running MPS answers the id query, a booting MPS does not
+            self.flush()
+            self.ser.write(b'id?\n')
+            from_mps_string = (await self._readline(probeTimeout)).decode('utf-8').rstrip()
+            if from_mps_string:
+                print(from_mps_string)
+            if from_mps_string == 'Bridge12 MPS':
+                self.flush()
+                return
+        else:
+            await asyncio.sleep(3)
+
+        while from_mps_string != 'System Ready':
+            if time.monotonic() > deadline:
+                raise RuntimeError('MPS on port %s not ready after %0.1f s'%(self.port, bootTimeout))
+            from_mps_bytes = await self._readline(probeTimeout if fastConnect else 1.)
+            from_mps_string = from_mps_bytes.decode('utf-8').rstrip()
+            if from_mps_string:
+                print(from_mps_string)
+
+            if fastConnect and from_mps_string == 'Bridge12 MPS':
+                # late answer to the probe or first boot message, a running MPS answers the id query again
+                idReplies += 1
+                if idReplies > 1:
+                    self.flush()
+                    return
+                self.ser.write(b'id?\n')
+
+        # Catch "Synthesizer detected"
+        await asyncio.sleep(1)
+        self.flush()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        '''Close serial port
+        '''
+        self.ser.close()
+
+    def flush(self):
+        '''Flush the MPS Serial Buffer
+        '''
+        self._buffer.clear()
+        self.ser.reset_input_buffer()
+
+    async def _wait_readable(self, timeout):
+        '''Wait until the serial port has data to read or timeout seconds have passed
+        '''
+        if self._fd is None:
+            await asyncio.sleep(min(timeout, self.pollInterval))
+            return
+
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        loop.add_reader(self._fd, lambda: readable.done() or readable.set_result(None))
+        try:
+            await asyncio.wait_for(readable, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            loop.remove_reader(self._fd)
+
+    async def _readline(self, timeout = 1.):
+        '''Read one line from the serial port, the partial line is returned after timeout seconds
+        '''
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            index = self._buffer.find(b'\n')
+            if index >= 0:
+                line = bytes(self._buffer[:index + 1])
+                del self._buffer[:index + 1]
+                return line
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                line = bytes(self._buffer)
+                self._buffer.clear()
+                return line
+
+            if not self.ser.in_waiting:
+                await self._wait_readable(remaining)
+            self._buffer += self.ser.read(self.ser.in_waiting or 1)
+
+    async def send_command(self, command, recv = False):
+        '''Send string command to MPS
+
+        Args:
+            command (str): string command to be sent to MPS
+            recv (bool): True if serial port should be read after writing. False by default.
+
+        Returns:
+            recv_string (str): if recv = True, returns string received from MPS
+        '''
+        recv_strings = await self.send_commands([command], recv = recv)
+
+        if recv == True:
+            return recv_strings[0]
+
+    async def send_commands(self, commands, recv = False):
+        '''Send several string commands to the MPS in a single write
+
+        Args:
+            commands (list): string commands to be sent to MPS
+            recv (bool, list): True if a reply should be read for every command. A list of bools selects which commands return a reply.
+
+        Returns:
+            list: strings received from MPS, one for each command with recv True
+        '''
+        if isinstance(recv, bool):
+            recv = [recv] * len(commands)
+
+        send_bytes = ''.join('%s\n'%command for command in commands).encode('utf-8')
+
+        async with self._lock:
+            self.flush()
+            self.ser.write(send_bytes)
+
+            recv_strings = []
+            for command_recv in recv:
+                if command_recv:
+                    from_mps_bytes = await self._readline()
+                    recv_strings.append(from_mps_bytes.decode('utf-8').rstrip())
+
+        return recv_strings
+
+    async def query_many(self, queries):
+        '''Query several MPS parameters in a single serial round trip, see MPS.query_many
+
+        Args:
+            queries (list): Query names, e.g. 'freq' or 'freq?'. 'systemstatus' and 'rfsweepdata' are also supported.
+
+        Returns:
+            list: Query values in the same order as queries
+        '''
+        names = _queryNames(queries)
+
+        replies = await self.send_commands(['%s?'%name for name in names], recv = True)
+
+        values = [_convertReply(name, reply) for name, reply in zip(names, replies)]
+
+        return values
+
+    async def _run(self, method, *args, **kwargs):
+        '''Run the MPS method with the serial communication done asynchronously
+        '''
+        capture = _CommandCapture()
+        try:
+            result = method(capture, *args, **kwargs)
+        except _ReplyNeeded as query:
+            reply = await self.send_command(query.command, recv = True)
+            try:
+                return method(_CommandCapture(reply), *args, **kwargs)
+            except _MultipleCommands: # the query is repeated in the executor thread
+                pass
+        except _MultipleCommands: # nothing has been sent yet
+            pass
+        else:
+            if capture.commands:
+                await self.send_commands(capture.commands)
+            return result
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(method, _ThreadedCommands(self, loop), *args, **kwargs))
+
+    ampgain = _asyncCommand('ampgain')
+    ampstatus = _asyncCommand('ampstatus')
+    amptemp = _asyncCommand('amptemp')
+    debug = _asyncCommand('debug')
+    firmware = _asyncCommand('firmware')
+    freq = _asyncCommand('freq')
+    id = _asyncCommand('id')
+    lockstatus = _asyncCommand('lockstatus')
+    lockdelay = _asyncCommand('lockdelay')
+    lockstep = _asyncCommand('lockstep')
+    power = _asyncCommand('power')
+    rfstatus = _asyncCommand('rfstatus')
+    rfsweepdata = _asyncCommand('rfsweepdata')
+    rfsweepdosweep = _asyncCommand('rfsweepdosweep')
+    rfsweeppower = _asyncCommand('rfsweeppower')
+    rfsweepnpts = _asyncCommand('rfsweepnpts')
+    rfsweepdwelltime = _asyncCommand('rfsweepdwelltime')
+    rfsweepinitialdwelltime = _asyncCommand('rfsweepinitialdwelltime')
+    rfsweepsw = _asyncCommand('rfsweepsw')
+    rxdiodesn = _asyncCommand('rxdiodesn')
+    rxpowerdbm = _asyncCommand('rxpowerdbm')
+    rxpowermv = _asyncCommand('rxpowermv')
+    rxsettle = _asyncCommand('rxsettle')
+    screen = _asyncCommand('screen')
+    serialNumber = _asyncCommand('serialNumber')
+    sweep = _asyncCommand('sweep')
+    systemstatus = _asyncCommand('systemstatus')
+    triglength = _asyncCommand('triglength')
+    txdiodesn = _asyncCommand('txdiodesn')
+    txpowerdbm = _asyncCommand('txpowerdbm')
+    txpowermv = _asyncCommand('txpowermv')
+    wgstatus = _asyncCommand('wgstatus')
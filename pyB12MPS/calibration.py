@@ -0,0 +1,207 @@
+import functools
+import numpy as np
+import os
+import re
+import time
+
+# Default directory of the calibration files
+defaultCalibrationDirectory = os.path.join(os.path.expanduser('~'), '.pyB12MPS', 'calibration')
+
+
+def _fileName(serial, txdiodesn, ampgain):
+    '''Name of the calibration file of an MPS, Tx diode and amplifier gain
+    '''
+    key = '%s_%s_%+0.1f'%(serial, txdiodesn, ampgain)
+    return 'power_%s.npz'%re.sub(r'[^\w.+-]', '_', key)
+
+
+class PowerCalibration:
+    '''Delivered power (txpowerdbm) of an MPS on a grid of frequencies and set powers
+
+    The power set with MPS.power differs from the delivered power reported by the Tx diode, and the difference depends on the frequency and the amplifier gain. The calibration is measured once on a grid of frequencies and powers (see measure), stored in a file named after the serial number of the MPS, the serial number of the Tx diode and the amplifier gain, and interpolated afterwards, so a target delivered power is set without a set-read-adjust loop.
+
+    The set power for a target delivered power is found by bilinear interpolation: the calibrated curves are interpolated in frequency, then the delivered power is inverted in set power. All arguments can be arrays, which are interpolated together.
+
+    Args:
+        freqs (numpy.ndarray): Frequency axis of the grid in GHz, increasing
+        powers (numpy.ndarray): Set power axis of the grid in dBm, increasing
+        txPower (numpy.ndarray): Delivered power in dBm, one row per frequency and one column per set power
+        serial (str): Serial number of the MPS
+        txdiodesn (str): Serial number of the Tx diode
+        ampgain (float): Amplifier gain of the calibration in dB
+        measureTime (None, float): time.time() of the measurement
+
+    Example::
+
+        calibration = mps.powercalibration(freqs = np.linspace(9.45, 9.65, 21), powers = np.arange(0., 40.5, 1.))
+
+        mps.calibratedpower(30.) # deliver 30 dBm at the current frequency
+        setPowers = calibration.power(30., freqs) # set powers for 30 dBm at freqs
+
+    '''
+    def __init__(self, freqs, powers, txPower, serial = '', txdiodesn = '', ampgain = 0., measureTime = None):
+        self.freqs = np.asarray(freqs, dtype = float)
+        self.powers = np.asarray(powers, dtype = float)
+        self.txPower = np.asarray(txPower, dtype = float)
+        if self.freqs.ndim != 1 or self.powers.ndim != 1 or self.txPower.shape != (len(self.freqs), len(self.powers)):
+            raise ValueError('Delivered power must have one row per frequency and one column per set power')
+        if len(self.powers) < 2 or np.any(np.diff(self.freqs) <= 0) or np.any(np.diff(self.powers) <= 0):
+            raise ValueError('Frequencies and powers must be increasing, with at least 2 powers')
+
+        self.serial = str(serial)
+        self.txdiodesn = str(txdiodesn)
+        self.ampgain = float(ampgain)
+        self.measureTime = measureTime
+
+    @classmethod
+    def measure(cls, mps, freqs, powers, settle = 0.05):
+        '''Measure the delivered power on a grid of frequencies and set powers
+
+        After each power change the Tx diode is read after the settle time. The Tx query of one point and the power of the next point are sent in a single write, so each point takes the settle time and one serial round trip. The RF output must be on. The frequency and power before the measurement are restored afterwards.
+
+        Args:
+            mps (MPS): MPS instance
+            freqs (numpy.ndarray): Frequencies in GHz
+            powers (numpy.ndarray): Set powers in dBm
+            settle (float): Time in s to wait after each power change before reading the Tx diode. If 0, the powers of one frequency are sent in a single write, which is only accurate if the Tx diode settles faster than the MPS processes the commands.
+
+        Returns:
+            PowerCalibration: measured calibration
+        '''
+        freqs = np.sort(np.asarray(freqs, dtype = float))
+        powers = np.sort(np.asarray(powers, dtype = float))
+        convertTx = functools.partial(mps._convert, 'txpowerdbm')
+        serial, txdiodesn, ampgain, startFreq, startPower = mps.query_many(['serial', 'txdiodesn', 'ampgain', 'freq', 'power'])
+
+        txPower = np.zeros((len(freqs), len(powers)))
+        try:
+            for row, freq in enumerate(freqs):
+                if not settle:
+                    commands = ['freq %0.0f'%(freq * 1.e6)]
+                    for power in powers:
+                        commands += ['power %0.0f'%(power * 10.), 'txpowerdbm?']
+                    replies = mps.send_commands(commands, recv = [False] + [False, True] * len(powers))
+                else:
+                    powerCommands = ['power %0.0f'%(power * 10.) for power in powers]
+                    mps.send_commands(['freq %0.0f'%(freq * 1.e6), powerCommands[0]])
+                    replies = []
+                    for column in range(len(powers)):
+                        time.sleep(settle)
+                        # read this point and set the power of the next point
+                        nextCommands = powerCommands[column + 1:column + 2]
+                        reply, = mps.send_commands(['txpowerdbm?'] + nextCommands, recv = [True] + [False] * len(nextCommands))
+                        replies.append(reply)
+                txPower[row] = [convertTx(reply) for reply in replies]
+        finally:
+            mps.send_commands(['power %0.0f'%(startPower * 10.), 'freq %0.0f'%(startFreq * 1.e6)])
+
+        return cls(freqs, powers, txPower, serial = serial, txdiodesn = txdiodesn, ampgain = ampgain, measureTime = time.time())
+
+    @classmethod
+    def load(cls, path):
+        '''Load a calibration file written by save
+
+        Args:
+            path (str): File name of the calibration
+
+        Returns:
+            PowerCalibration: calibration
+        '''
+        with np.load(path) as data:
+            return cls(data['freqs'], data['powers'], data['txPower'], serial = str(data['serial']), txdiodesn = str(data['txdiodesn']),
+                    ampgain = float(data['ampgain']), measureTime = float(data['measureTime']))
+
+    def check(self, serial, txdiodesn, ampgain):
+        '''Raise ValueError if the calibration was not measured with this MPS, Tx diode and amplifier gain
+
+        Args:
+            serial (str): Serial number of the MPS
+            txdiodesn (str): Serial number of the Tx diode
+            ampgain (float): Amplifier gain in dB
+        '''
+        if (str(serial), str(txdiodesn), round(float(ampgain), 1)) != (self.serial, self.txdiodesn, round(self.ampgain, 1)):
+            raise ValueError('Power calibration of MPS %s, Tx diode %s, amplifier gain %0.1f dB does not match MPS %s, Tx diode %s, amplifier gain %0.1f dB'%(
+                self.serial, self.txdiodesn, self.ampgain, serial, txdiodesn, ampgain))
+
+    def fileName(self):
+        '''Returns the file name of the calibration, which is unique for the MPS, Tx diode and amplifier gain
+        '''
+        return _fileName(self.serial, self.txdiodesn, self.ampgain)
+
+    def save(self, path = None):
+        '''Save the calibration
+
+        Args:
+            path (None, str): File name, by default fileName() in defaultCalibrationDirectory
+
+        Returns:
+            str: File name of the calibration
+        '''
+        if path is None:
+            os.makedirs(defaultCalibrationDirectory, exist_ok = True)
+            path = os.path.join(defaultCalibrationDirectory, self.fileName())
+        with open(path, 'wb') as f: # np.savez appends .npz to file names
+            np.savez(f, freqs = self.freqs, powers = self.powers, txPower = self.txPower, serial = self.serial, txdiodesn = self.txdiodesn,
+                    ampgain = self.ampgain, measureTime = np.nan if self.measureTime is None else self.measureTime)
+        return path
+
+    def _curves(self, freq):
+        '''Delivered power over the set power axis at each frequency, linearly interpolated between the calibrated frequencies
+        '''
+        freq = np.asarray(freq, dtype = float)
+        if np.any(freq < self.freqs[0]) or np.any(freq > self.freqs[-1]):
+            raise ValueError('Frequency is outside of the calibrated range %0.6f - %0.6f GHz'%(self.freqs[0], self.freqs[-1]))
+        if len(self.freqs) == 1:
+            return np.broadcast_to(self.txPower[0], freq.shape + self.powers.shape)
+        row = np.clip(np.searchsorted(self.freqs, freq, side = 'right') - 1, 0, len(self.freqs) - 2)
+        weight = ((freq - self.freqs[row]) / (self.freqs[row + 1] - self.freqs[row]))[..., None]
+        return (1. - weight) * self.txPower[row] + weight * self.txPower[row + 1]
+
+    def power(self, txPower, freq):
+        '''Set power for a target delivered power
+
+        Args:
+            txPower (float, numpy.ndarray): Target delivered power in dBm
+            freq (float, numpy.ndarray): Frequency in GHz
+
+        Returns:
+            float, numpy.ndarray: Set power in dBm, broadcast over txPower and freq
+        '''
+        txPower, freq = np.broadcast_arrays(np.asarray(txPower, dtype = float), np.asarray(freq, dtype = float))
+        curves = np.maximum.accumulate(self._curves(freq), axis = -1) # lowest set power if the amplifier saturates
+        if np.any(txPower < curves[..., 0]) or np.any(txPower > curves[..., -1]):
+            raise ValueError('Delivered power is outside of the calibrated range')
+
+        column = np.clip(np.sum(curves < txPower[..., None], axis = -1), 1, len(self.powers) - 1)
+        low = np.take_along_axis(curves, (column - 1)[..., None], axis = -1)[..., 0]
+        high = np.take_along_axis(curves, column[..., None], axis = -1)[..., 0]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            weight = np.where(high > low, (txPower - low) / (high - low), 0.)
+        setPower = self.powers[column - 1] + weight * (self.powers[column] - self.powers[column - 1])
+        if setPower.ndim == 0:
+            return float(setPower)
+        return setPower
+
+    def txpower(self, power, freq):
+        '''Delivered power for a set power
+
+        Args:
+            power (float, numpy.ndarray): Set power in dBm
+            freq (float, numpy.ndarray): Frequency in GHz
+
+        Returns:
+            float, numpy.ndarray: Delivered power in dBm, broadcast over power and freq
+        '''
+        power, freq = np.broadcast_arrays(np.asarray(power, dtype = float), np.asarray(freq, dtype = float))
+        if np.any(power < self.powers[0]) or np.any(power > self.powers[-1]):
+            raise ValueError('Power is outside of the calibrated range %0.1f - %0.1f dBm'%(self.powers[0], self.powers[-1]))
+        curves = self._curves(freq)
+
+        column = np.clip(np.searchsorted(self.powers, power, side = 'right'), 1, len(self.powers) - 1)
+        weight = (power - self.powers[column - 1]) / (self.powers[column] - self.powers[column - 1])
+        low = np.take_along_axis(curves, (column - 1)[..., None], axis = -1)[..., 0]
+        high = np.take_along_axis(curves, column[..., None], axis = -1)[..., 0]
+        txPower = low + weight * (high - low)
+        if txPower.ndim == 0:
+            return float(txPower)
+        return txPower
@@ -0,0 +1,186 @@
+import collections
+import numpy as np
+import time
+
+
+class CommandStats:
+    '''Per-command counters and latency histograms of the serial communication with the MPS
+
+    Every exchange through MPS.send_commands is timed. For each command name (e.g. 'freq?' or 'freq') the number of calls, bytes sent and received, timeouts and replies which cannot be converted to values are counted. Requests of an MPSClient are timed until the reply of the server arrives. Latencies are collected in histograms with logarithmic bins:
+
+    +-----------+------------------------------------------------------------------+
+    |Histogram  |Description                                                       |
+    +===========+==================================================================+
+    |write      |Time to write the command to the serial port                      |
+    +-----------+------------------------------------------------------------------+
+    |firstByte  |Time from the end of the write (or the previous reply) to the     |
+    |           |first byte of the reply                                           |
+    +-----------+------------------------------------------------------------------+
+    |total      |Time from the start of the write to the end of the reply          |
+    +-----------+------------------------------------------------------------------+
+
+    A large firstByte latency points to the MPS firmware or the USB serial link, while a large difference between the total latency and the wall time of an MPS function points to the host.
+
+    Args:
+        bins (None, numpy.ndarray): Edges of the histogram bins in s. By default 60 logarithmic bins from 10 us to 10 s.
+
+    Attributes:
+        preHooks (list): Functions called with the list of commands before each exchange, before waiting for the serial port
+        postHooks (list): Functions called with a dict describing each exchange after it completed and the serial port was released
+
+    Example::
+
+        stats = mps.instrument()
+        stats.postHooks.append(lambda event: print(event['commands'], event['total']))
+
+        mps.freq()
+        print(stats.summary()['freq?'])
+
+    '''
+    histograms = ('write', 'firstByte', 'total')
+
+    def __init__(self, bins = None):
+        if bins is None:
+            bins = np.logspace(-5, 1, 61)
+        self.bins = np.asarray(bins, dtype = float)
+        self.preHooks = []
+        self.postHooks = []
+        self._events = collections.deque() # exchanges waiting for the postHooks
+        self.reset()
+
+    def reset(self):
+        '''Clear all counters and histograms
+        '''
+        self.commands = {}
+
+    def _record(self, name):
+        record = self.commands.get(name)
+        if record is None:
+            record = {'count' : 0, 'bytesOut' : 0, 'bytesIn' : 0, 'timeouts' : 0, 'parseFailures' : 0}
+            for histogram in self.histograms:
+                record[histogram] = np.zeros(len(self.bins) + 1, dtype = np.int64)
+                record[histogram + 'Sum'] = 0.
+            self.commands[name] = record
+        return record
+
+    def _add(self, record, histogram, duration):
+        record[histogram][np.searchsorted(self.bins, duration)] += 1
+        record[histogram + 'Sum'] += duration
+
+    def before(self, commands):
+        '''Call the preHooks, called by MPS.send_commands before waiting for the serial port
+        '''
+        for hook in self.preHooks:
+            hook(commands)
+
+    def after(self):
+        '''Call the postHooks for the completed exchanges, called by MPS.send_commands after releasing the serial port
+        '''
+        while True:
+            try:
+                event = self._events.popleft()
+            except IndexError:
+                return
+            for hook in self.postHooks:
+                hook(event)
+
+    def parseFailure(self, name):
+        '''Count a reply of the command name which cannot be converted
+        '''
+        self._record(name)['parseFailures'] += 1
+
+    def exchange(self, ser, commands, recv, send_bytes):
+        '''Write send_bytes to ser and read one line for each command with recv True, recording the timing
+
+        Called by MPS.send_commands while holding the serial port. The first byte of each reply is read separately to time it, the rest of the reply is read with the remaining serial timeout, so a reply takes at most one timeout like without instrumentation.
+
+        Returns:
+            list: bytes received for each command with recv True
+        '''
+        startTime = time.perf_counter()
+        ser.write(send_bytes)
+        writeEndTime = time.perf_counter()
+
+        timeout = ser.timeout
+        recv_bytes = []
+        firstByte = []
+        total = []
+        previousTime = writeEndTime
+        for command_recv in recv:
+            if command_recv:
+                readTime = time.perf_counter()
+                from_mps_bytes = ser.read(1)
+                firstByteTime = time.perf_counter()
+                if from_mps_bytes and from_mps_bytes != b'\n':
+                    if timeout is not None:
+                        ser.timeout = max(timeout - (firstByteTime - readTime), 0.)
+                    try:
+                        from_mps_bytes += ser.readline()
+                    finally:
+                        if timeout is not None:
+                            ser.timeout = timeout
+                endTime = time.perf_counter()
+                recv_bytes.append(from_mps_bytes)
+                firstByte.append(firstByteTime - previousTime)
+                total.append(endTime - startTime)
+                previousTime = endTime
+
+        replies = iter(zip(recv_bytes, firstByte, total))
+        for command, command_recv in zip(commands, recv):
+            name = command.split(' ')[0]
+            record = self._record(name)
+            record['count'] += 1
+            record['bytesOut'] += len(command) + 1
+            self._add(record, 'write', writeEndTime - startTime)
+            if command_recv:
+                reply, firstByteDuration, totalDuration = next(replies)
+                record['bytesIn'] += len(reply)
+                self._add(record, 'firstByte', firstByteDuration)
+                self._add(record, 'total', totalDuration)
+                if not reply.endswith(b'\n'):
+                    record['timeouts'] += 1
+
+        if self.postHooks:
+            self._events.append({
+                'commands' : list(commands),
+                'recv' : list(recv),
+                'replies' : recv_bytes,
+                'write' : writeEndTime - startTime,
+                'firstByte' : firstByte,
+                'total' : total,
+                })
+
+        return recv_bytes
+
+    def _percentile(self, counts, fraction):
+        '''Upper bin edge below which fraction of the counts fall'''
+        cumulative = np.cumsum(counts)
+        index = np.searchsorted(cumulative, fraction * cumulative[-1])
+        if index >= len(self.bins):
+            return float('inf')
+        return float(self.bins[index])
+
+    def summary(self):
+        '''Return the statistics of each command
+
+        Percentiles are upper bin edges of the histograms.
+
+        Returns:
+            dict: command name to dict with the counters and mean/p50/p90/p99 of each latency histogram in s
+        '''
+        summary = {}
+        for name, record in self.commands.items():
+            commandSummary = {key : record[key] for key in ('count', 'bytesOut', 'bytesIn', 'timeouts', 'parseFailures')}
+            for histogram in self.histograms:
+                counts = record[histogram]
+                n = int(counts.sum())
+                if n == 0:
+                    continue
+                commandSummary[histogram] = {
+                    'mean' : record[histogram + 'Sum'] / n,
+                    'p50' : self._percentile(counts, 0.5),
+                    'p90' : self._percentile(counts, 0.9),
+                    'p99' : self._percentile(counts, 0.99),
+                    }
+            summary[name] = commandSummary
+        return summary
@@ -1,28 +1,167 @@
 import numpy as np
 import serial
 import time
+import contextlib
+import threading
+import queue
+import weakref
+import itertools
+import functools
+import concurrent.futures
 import os
 import sys
 import serial.tools.list_ports
 
+from .status import SystemStatus, parseSystemStatus
+
+# Conversion of query replies to typed values, keyed by query name (without '?')
+_queryConversions = {
+    'ampgain' : lambda s: float(s) / 10., # dBm
+    'ampstatus' : int,
+    'amptemp' : lambda s: float(s) / 10., # degrees C
+    'debug' : int,
+    'firmware' : str,
+    'freq' : lambda s: float(s) / 1.e6, # kHz to GHz
+    'id' : str,
+    'lockdelay' : int,
+    'lockstatus' : int,
+    'lockstep' : int,
+    'power' : lambda s: float(s) / 10., # tenth dBm to dBm
+    'rfstatus' : int,
+    'rfsweepdwelltime' : float,
+    'rfsweepinitialdwelltime' : float,
+    'rfsweepnpts' : int,
+    'rfsweeppower' : lambda s: float(s) / 10., # tenth dBm to dBm
+    'rfsweepsw' : int,
+    'rxdiodesn' : str,
+    'rxpowerdbm' : lambda s: float(s) / 10., # tenth dBm to dBm
+    'rxpowermv' : lambda s: float(s) / 10., # tenth mV to mV
+    'screen' : int,
+    'serial' : str,
+    'triglength' : int,
+    'txdiodesn' : str,
+    'txpowerdbm' : lambda s: float(s) / 10., # tenth dBm to dBm
+    'txpowermv' : lambda s: float(s) / 10., # tenth mV to mV
+    'wgstatus' : int,
+    }
+
+# Queries which are not cached by MPS.cache() since they are measurements
+_uncachedQueries = ('rxpowerdbm', 'rxpowermv', 'txpowerdbm', 'txpowermv')
+
+# Set commands which the MPS may refuse depending on its state, the cache is invalidated instead of updated
+_conditionalSetCommands = ('rfstatus', 'lockstatus')
+
+# Parameters which the MPS changes as a side effect of a command, discarded from the cache when the command is sent
+_cacheSideEffects = {
+    'wgstatus' : ('rfstatus',), # the RF output is disabled when leaving DNP mode
+    'lockstatus' : ('freq',), # the lock moves the frequency
+    'rfsweepdosweep' : ('freq',),
+    }
+
+# Priority classes of commands in thread-safe mode, lower values are sent first
+PRIORITY_SAFETY = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_BACKGROUND = 2
+
+# Set commands which always have safety priority
+_safetyCommands = ('rfstatus 0', 'wgstatus 0', 'lockstatus 0', 'ampstatus 0', 'power -990')
+
+# RF sweep width in MHz for each rfsweepsw value
+_rfSweepWidths = {0 : 250., 1 : 100., 2 : 50., 3 : 10.}
+
 
 class MPS:
-    def __init__(self, port = None):
+    settleTolerance = 0.5 # mV, default tolerance of successive Rx readings for rxsettle
+    settleMaxWait = 0.2 # s, default maximum wait for rxsettle
+    sweepChunk = 20 # default number of points of sweep() sent in a single write if settle is 0
+    _batchState = threading.local() # replaced for each instance, commands queued by batch() in each thread
+    _cache = None # last known values of MPS parameters, None if the cache is disabled
+    cacheStaleness = 1. # s, maximum age of cached values
+    stats = None # CommandStats of instrument(), None if instrumentation is disabled
+    _ioQueue = None # request queue of the I/O worker thread, None if not thread-safe
+    _ioThread = None
+    _priorityState = threading.local() # replaced for each instance, priority() of each thread
+    _foregroundPending = 0 # safety and interactive requests waiting for the I/O worker
+    _lastForegroundTime = 0. # time.monotonic() of the last safety or interactive request
+    calibration = None # PowerCalibration of powercalibration(), used by calibratedpower
+
+    def __init__(self, port = None, fastConnect = False, ser = None, threadSafe = False, bootTimeout = 30.):
+        self._ioLock = threading.RLock() # serializes serial exchanges between threads, e.g. a Sampler
+        self._batchState = threading.local()
+        self._priorityState = threading.local()
+        self._pendingLock = threading.Lock()
+
+        if ser is not None and port == None:
+            port = ser.port
         if port == None:
-            self.port = self.detectMPSSerialPort()
+            port = self.detectMPSSerialPort()
+        self.port = port
+
+        self.init(fastConnect = fastConnect, ser = ser, bootTimeout = bootTimeout)
+
+        if threadSafe:
+            self._start_io_worker()
 
-        self.init()
+    def init(self, fastConnect = False, probeTimeout = 0.25, ser = None, bootTimeout = 30.):
+        '''Open the serial port and wait until the MPS is ready
 
-    def init(self):
+        By default the MPS is assumed to reset when the serial port is opened and the boot messages are read until "System Ready".
+
+        Args:
+            fastConnect (bool): If True, the MPS is probed with an id query and the connection returns as soon as the MPS answers. The full boot wait is only performed if the MPS does not answer, e.g. because opening the port reset the MPS.
+            probeTimeout (float): Time in seconds to wait for the answer to the id query if fastConnect is True. A later answer is confirmed with a second id query, since "Bridge12 MPS" is also the first boot message.
+            ser (None, serial.Serial): Serial port object to use instead of opening the port, e.g. a SimulatedMPS
+            bootTimeout (float): Maximum time in seconds to wait for the MPS to be ready
+
+        Raises:
+            RuntimeError: if the MPS is not ready within bootTimeout
+        '''
         print('Connecting to MPS using port %s'%self.port)
-        self.ser = serial.Serial(self.port, 115200, timeout = 1.)
-        time.sleep(3)
+        if ser is None:
+            ser = serial.Serial(None, 115200, timeout = 1.)
+            ser.port = self.port
+            if fastConnect:
+                ser.dtr = False # do not reset the MPS on open where the platform allows
+            ser.open()
+        self.ser = ser
+        deadline = time.monotonic() + bootTimeout
+
         from_mps_string = ''
-#        while self.ser.in_waiting:
-        while from_mps_string != 'System Ready':
-            from_mps_bytes = self.ser.readline()
-            from_mps_string = from_mps_bytes.decode('utf-8').rstrip()
-            print(from_mps_string)
+        idReplies = 0
+        if fastConnect:
+            # A running MPS answers the id query, a booting MPS does not
+            self.ser.timeout = probeTimeout
+            self.flush()
+            self.ser.write(b'id?\n')
+            from_mps_string = self.ser.readline().decode('utf-8').rstrip()
+            if from_mps_string:
+                print(from_mps_string)
+            if from_mps_string == 'Bridge12 MPS':
+                self.ser.timeout = 1.
+                self.flush()
+                return
+        else:
+            time.sleep(3)
+
+        try:
+#            while self.ser.in_waiting:
+            while from_mps_string != 'System Ready':
+                if time.monotonic() > deadline:
+                    raise RuntimeError('MPS on port %s not ready after %0.1f s'%(self.port, bootTimeout))
+                from_mps_bytes = self.ser.readline()
+                from_mps_string = from_mps_bytes.decode('utf-8').rstrip()
+                if from_mps_string:
+                    print(from_mps_string)
+
+                if fastConnect and from_mps_string == 'Bridge12 MPS':
+                    # late answer to the probe or first boot message, a running MPS answers the id query again
+                    idReplies += 1
+                    if idReplies > 1:
+                        self.flush()
+                        return
+                    self.ser.write(b'id?\n')
+        finally:
+            self.ser.timeout = 1.
 
         # Catch "Synthesizer detected"
         time.sleep(1)
@@ -45,7 +184,7 @@ class MPS:
 
         else:
             gainString = self.send_command('ampgain?', recv = True)
-            gain = float(gainString) / 10.
+            gain = self._convert('ampgain', gainString)
 
             return gain
 
@@ -75,7 +214,7 @@ class MPS:
             self.send_command('ampstatus %s'%ampStateString)
         else:
             ampStateString = self.send_command('ampstatus?',recv = True)
-            ampState = int(ampStateString)
+            ampState = self._convert('ampstatus', ampStateString)
             return ampState
 
 
@@ -87,13 +226,268 @@ class MPS:
         '''
 
         ampTempString = self.send_command('amptemp?',recv = True)
-        ampTemp = float(ampTempString) / 10.
+        ampTemp = self._convert('amptemp', ampTempString)
         return ampTemp
 
 
+    def autotune(self, npts = None, tolerance = 0.1, widths = (0, 1, 2, 3), timeout = 5.):
+        '''Tune the microwave frequency to the cavity resonance with RF sweeps of decreasing width
+
+        The RF sweep of the MPS firmware is run with the widths given by rfsweepsw (250, 100, 50 and 10 MHz by default). After each sweep the center of the resonance dip is estimated with a parabolic fit (see dipCenter) and the frequency is set to it, so that the next, narrower sweep is centered on the dip. Tuning stops as soon as the center moves less than tolerance between two sweeps. The RF sweep width and number of points are restored afterwards.
+
+        The firmware does not report when an RF sweep has finished. Each sweep therefore has a different number of points than the data of the previous sweep (npts or npts + 1), so that the data of the previous sweep is never mistaken for the new data.
+
+        Args:
+            npts (None, int): Number of points of each RF sweep, by default the current rfsweepnpts(). Every other sweep has one point more.
+            tolerance (float): Convergence tolerance of the center frequency in MHz
+            widths (tuple): rfsweepsw values of the sweeps from coarse to fine
+            timeout (float): Maximum time in s to wait for the data of each RF sweep
+
+        Returns:
+            dict: 'freq' (tuned frequency in GHz), 'centers' (GHz) and 'widths' (MHz) of the sweeps, 'converged' (bool) and 'time' (duration in s)
+
+        Example::
+
+            result = mps.autotune()
+            print('Resonance at %0.6f GHz after %i sweeps'%(result['freq'], len(result['centers'])))
+
+        '''
+        from .analysis import dipCenter
+
+        if not len(widths):
+            raise ValueError('At least one sweep width is required')
+        for width in widths:
+            if width not in _rfSweepWidths:
+                raise ValueError('Sweep widths must be rfsweepsw values 0, 1, 2 or 3')
+        startTime = time.monotonic()
+        previousWidth, previousNpts, dwellTime, initialDwellTime = self.query_many(['rfsweepsw', 'rfsweepnpts', 'rfsweepdwelltime', 'rfsweepinitialdwelltime'])
+        if npts is None:
+            npts = previousNpts
+        if not isinstance(npts, int) or npts < 5:
+            raise ValueError('Number of points must be an int of at least 5')
+
+        centers = []
+        sweepWidths = []
+        converged = False
+        previousLength = len(self.rfsweepdata()) # data of the last RF sweep
+        try:
+            for width in widths:
+                sweepNpts = npts + 1 if previousLength == npts else npts
+                sweepTime = initialDwellTime / 1.e3 + sweepNpts * dwellTime / 1.e6 # initial dwell time in ms, dwell time in us
+                self.send_commands(['rfsweepsw %i'%width, 'rfsweepnpts %i'%sweepNpts, 'rfsweepdosweep?'])
+                freqs, data = self._rfsweep_result(sweepTime, timeout)
+                previousLength = len(data)
+                centers.append(dipCenter(freqs, data))
+                sweepWidths.append(_rfSweepWidths[width])
+                self.freq(round(centers[-1], 6)) # frequency is set in kHz
+                if len(centers) > 1 and abs(centers[-1] - centers[-2]) * 1.e3 < tolerance:
+                    converged = True
+                    break
+        finally:
+            self.send_commands(['rfsweepsw %i'%previousWidth, 'rfsweepnpts %i'%previousNpts])
+
+        return {'freq' : round(centers[-1], 6), 'centers' : centers, 'widths' : sweepWidths, 'converged' : converged, 'time' : time.monotonic() - startTime}
+
+    def _rfsweep_result(self, sweepTime, timeout):
+        '''Wait for the RF sweep started last and return its frequency axis and data
+
+        The number of points of the sweep must differ from the data of the previous sweep, the data is polled until it has the number of points of the new sweep.
+        '''
+        time.sleep(sweepTime * 1.1)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self.rfsweepdata(freqAxis = True)
+            except ValueError: # data of the previous sweep, number of points differs
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.01)
+
+    def batch(self, verify = False):
+        '''Context manager to combine set commands into a single write
+
+        Inside the with block set commands are validated as usual and queued. The queued commands are sent to the MPS in a single write when the block exits. Queries inside the block are sent together with any queued commands. If an exception is raised inside the block the queued commands are discarded. Each thread has its own batch.
+
+        Args:
+            verify (bool): If True, query every parameter that was set in the block after sending and compare to the value that was set
+
+        Raises:
+            RuntimeError: If verify is True and a parameter read back from the MPS does not match the value that was set
+
+        Example::
+
+            with mps.batch(verify = True):
+                mps.power(10)
+                mps.freq(9.5)
+                mps.wgstatus(1)
+                mps.rfstatus(1)
+
+        '''
+        return self._batch(verify)
+
+    @contextlib.contextmanager
+    def _batch(self, verify):
+        batchState = self._batchState
+        if getattr(batchState, 'commands', None) is not None: # nested batch joins the outer batch
+            yield self
+            return
+
+        batchState.commands = []
+        batchState.sent = []
+        try:
+            yield self
+            commands = batchState.commands
+            sentCommands = batchState.sent
+        finally:
+            batchState.commands = None
+            batchState.sent = []
+
+        if commands:
+            self.send_commands(commands)
+
+        if verify:
+            self._verify_commands(sentCommands)
+
+    def _verify_commands(self, commands):
+        '''Read back the parameters set by commands and raise RuntimeError on mismatch
+        '''
+        setValues = {} # last value set for each parameter
+        for command in commands:
+            if ' ' in command:
+                name, value = command.split(' ', 1)
+                setValues[name] = value
+
+        names = list(setValues)
+        replies = self.send_commands(['%s?'%name for name in names], recv = True)
+
+        mismatches = []
+        for name, reply in zip(names, replies):
+            try:
+                match = float(reply) == float(setValues[name])
+            except ValueError:
+                match = False
+            if not match:
+                mismatches.append('%s set to %s, read %s'%(name, setValues[name], reply))
+
+        if mismatches:
+            raise RuntimeError('MPS read back does not match: ' + '; '.join(mismatches))
+
+    def cache(self, enable = True, staleness = 1.):
+        '''Enable/disable the write-through cache of MPS parameters
+
+        When the cache is enabled, queries are answered from the last known value if it is not older than staleness seconds, and set commands with the value the MPS already has are skipped. Set commands and query replies update the cache, systemstatus() refreshes all parameters it contains in one round trip. Parameters which a command changes as a side effect are discarded, e.g. rfstatus when setting wgstatus and freq when setting lockstatus or starting an RF sweep. Rx and Tx diode readings are never cached.
+
+        Args:
+            enable (bool): True to enable the cache, False to disable and clear it
+            staleness (float): Maximum age of cached values in s
+
+        Warning:
+            The MPS changes some parameters by itself, e.g. the frequency while the frequency lock is enabled and the amplifier temperature. Use invalidate() to discard these values or choose a short staleness.
+
+        Example::
+
+            mps.cache(staleness = 5.) # Enable the cache
+            mps.systemstatus() # Refresh all parameters
+            mps.freq(9.5) # Skipped if the frequency is already 9.5 GHz
+            mps.invalidate('freq', 'amptemp')
+
+        '''
+        if enable:
+            self._cache = {}
+            self.cacheStaleness = float(staleness)
+        else:
+            self._cache = None
+
+    def instrument(self, enable = True, stats = None):
+        '''Enable/disable timing and counters of the serial communication
+
+        Args:
+            enable (bool): True to enable the instrumentation, False to disable it
+            stats (None, CommandStats): Statistics to record to. If None, a new CommandStats is created.
+
+        Returns:
+            CommandStats: statistics of the commands sent, see CommandStats class
+
+        Example::
+
+            stats = mps.instrument()
+            mps.systemstatus()
+            print(stats.summary())
+
+            mps.instrument(False)
+
+        '''
+        from .instrumentation import CommandStats
+
+        if not enable:
+            stats, self.stats = self.stats, None
+            return stats
+        if stats is None:
+            stats = CommandStats()
+        self.stats = stats
+        return stats
+
+    def invalidate(self, *names):
+        '''Discard values from the cache
+
+        Args:
+            names (str): Names of the parameters to discard, e.g. 'freq'. If no names are given, the cache is cleared.
+        '''
+        if self._cache is None:
+            return
+        if not names:
+            self._cache.clear()
+        for name in names:
+            self._cache.pop(name.rstrip('?'), None)
+
+    def _cached_reply(self, command, recv):
+        '''Returns (True, reply) if command can be answered from the cache, otherwise (False, None)
+        '''
+        name, _, value = command.partition(' ')
+        name = name.rstrip('?')
+        entry = self._cache.get(name)
+        if entry is None or time.monotonic() - entry[1] > self.cacheStaleness:
+            return False, None
+        if recv and not value:
+            return True, entry[0]
+        if not recv and value == entry[0]: # value already set
+            return True, None
+        return False, None
+
+    def _update_cache(self, commands, recv, recv_strings):
+        '''Update the cache with the commands sent and the replies received
+        '''
+        now = time.monotonic()
+        replies = iter(recv_strings)
+        for command, command_recv in zip(commands, recv):
+            name, _, value = command.partition(' ')
+            name = name.rstrip('?')
+            if command_recv:
+                reply = next(replies)
+                if isinstance(reply, bytes):
+                    reply = reply.decode('utf-8')
+                if not reply: # no reply received
+                    continue
+                if name == 'systemstatus':
+                    for statusInfo in reply.split(','):
+                        key, _, statusValue = statusInfo.partition(':')
+                        if key in _queryConversions and key not in _uncachedQueries:
+                            self._cache[key] = (statusValue, now)
+                elif name in _queryConversions and name not in _uncachedQueries:
+                    self._cache[name] = (reply, now)
+            elif value and name in _queryConversions:
+                if name in _conditionalSetCommands:
+                    self._cache.pop(name, None)
+                else:
+                    self._cache[name] = (value, now)
+            if not command_recv and (value or name not in _queryConversions): # set command or action
+                for dependent in _cacheSideEffects.get(name, ()):
+                    self._cache.pop(dependent, None)
+
     def close(self):
         '''Close serial port
         '''
+        self._stop_io_worker()
         self.ser.close()
 
     def debug(self, debugMode = None):
@@ -113,7 +507,7 @@ class MPS:
                 raise ValueError('Debug mode must be 0 or 1')
         else:
             debugModeString = self.send_command('debug?', recv = True)
-            debugMode = int(debugModeString)
+            debugMode = self._convert('debug', debugModeString)
             return debugMode
 
     def detectMPSSerialPort(self):
@@ -139,6 +533,28 @@ class MPS:
             serialPort = None
         return serialPort
 
+    def drifttracker(self, span = 1., points = 5, period = 10., maxDutyCycle = 0.01, budget = 0.05, driftRate = 0.01, follow = True):
+        '''Start periodic mini-sweeps which follow the drift of the cavity resonance during long runs
+
+        See DriftTracker for the arguments.
+
+        Returns:
+            DriftTracker: running drift tracker
+
+        Example::
+
+            drift = mps.drifttracker(span = 1., points = 5, period = 5.)
+            # ...
+            print(drift.center, drift.q)
+            drift.stop()
+
+        '''
+        from .tracking import DriftTracker
+
+        drift = DriftTracker(self, span = span, points = points, period = period, maxDutyCycle = maxDutyCycle, budget = budget, driftRate = driftRate, follow = follow)
+        drift.start()
+        return drift
+
     def firmware(self):
         '''Query the MPS firmware version
 
@@ -153,20 +569,22 @@ class MPS:
         '''
         self.ser.reset_input_buffer() # reset and flush buffer
 
-    def freq(self, freqValue = None):
+    def freq(self, freqValue = None, settle = False):
         ''' Set/Query Microwave Frequency
 
         Args:
             freqValue (int, float): Set Frequency in GHz, by default this parameter is None and the frequency is queried
+            settle (bool): If True, wait until the Rx diode reading has settled after setting the frequency, see rxsettle()
 
         Returns:
-            frequency in GHz
+            frequency in GHz. If settle is True, the settle time in s.
 
         Example::
 
             microwaveFrequency = freq() # Query Microwave Frequency
 
             freq(9.4) # Set Microwave Frequency to 9.4 GHz
+            settleTime = freq(9.4, settle = True) # Set Microwave Frequency and wait for Rx diode to settle
 
         '''
         max_freq = 100.
@@ -178,12 +596,16 @@ class MPS:
             freqValue = float(freqValue)
             kHz_freq = freqValue * 1.e6
             str_freq = '%0.0f'%kHz_freq
-            
+
+            if settle:
+                rxVoltage, settleTime = self._settle(['freq %s'%str_freq])
+                return settleTime
+
             self.send_command('freq %s'%str_freq)
 
         else: # Query the frequency
             return_kHz_freq = self.send_command('freq?',recv = True)
-            return_freq = float(return_kHz_freq) / 1.e6 # convert to GHz
+            return_freq = self._convert('freq', return_kHz_freq) # convert to GHz
             return return_freq
 
     def id(self):
@@ -251,7 +673,7 @@ class MPS:
                 raise ValueError('Lock State Not Valid')
         else:
             lockStateString = self.send_command('lockstatus?', recv = True)
-            lockState = int(lockStateString)
+            lockState = self._convert('lockstatus', lockStateString)
             return lockState
 
 
@@ -285,7 +707,7 @@ class MPS:
                 raise ValueError('Lock delay must be int or float')
         else:
             lockReadingString = self.send_command('lockdelay?',recv = True)
-            lockReading = int(lockReadingString)
+            lockReading = self._convert('lockdelay', lockReadingString)
             return lockReading
 
     def lockstep(self, step = None):
@@ -317,24 +739,26 @@ class MPS:
                 raise ValueError('Frequency step must be float or integer')
         else:
             stepReadingString = self.send_command('lockstep?',recv = True)
-            stepReading = int(stepReadingString)
+            stepReading = self._convert('lockstep', stepReadingString)
 
             return stepReading
 
-    def power(self, powerValue = None):
+    def power(self, powerValue = None, settle = False):
         '''Set/Query Microwave Power
 
         Args:
             powerValue (None, int, float): Set Power in dBm, by default this parameter is None and the power is queried
+            settle (bool): If True, wait until the Rx diode reading has settled after setting the power, see rxsettle()
 
         Returns:
-            powerValue (float): Microwave power in dBm 
+            powerValue (float): Microwave power in dBm. If settle is True, the settle time in s.
 
         Example::
 
             powerValue = power() # Query Microwave Power
 
             power(10) # Set microwave power to 10 dBm
+            settleTime = power(10, settle = True) # Set microwave power and wait for Rx diode to settle
 
         '''
         if powerValue is not None:
@@ -343,14 +767,127 @@ class MPS:
             powerValue = float(powerValue)
             tenth_dB_power = powerValue * 10.
             str_power = '%0.0f'%tenth_dB_power
-            
+
+            if settle:
+                rxVoltage, settleTime = self._settle(['power %s'%str_power])
+                return settleTime
+
             self.send_command('power %s'%str_power)
 
         else: # Query the power
             return_tenth_dB_power = self.send_command('power?',recv = True)
-            return_power = float(return_tenth_dB_power) / 10. # convert to dBm
+            return_power = self._convert('power', return_tenth_dB_power) # convert to dBm
             return return_power
 
+    def powercalibration(self, freqs = None, powers = None, settle = 0.05, directory = None, remeasure = False):
+        '''Load or measure the calibration of the delivered power, see PowerCalibration
+
+        The calibration of this MPS, Tx diode and amplifier gain is loaded from directory. It is measured and saved if there is no calibration, if freqs and powers differ from the calibrated grid or if remeasure is True. The RF output must be on for the measurement. The calibration is used by calibratedpower().
+
+        Args:
+            freqs (None, numpy.ndarray): Frequencies of the calibration grid in GHz, required for a measurement
+            powers (None, numpy.ndarray): Set powers of the calibration grid in dBm, required for a measurement
+            settle (float): Time in s to wait after each power change of the measurement
+            directory (None, str): Directory of the calibration files, by default defaultCalibrationDirectory
+            remeasure (bool): If True, measure the calibration even if it was saved before
+
+        Returns:
+            PowerCalibration: calibration
+
+        Example::
+
+            mps.rfstatus(1)
+            calibration = mps.powercalibration(freqs = np.linspace(9.45, 9.65, 21), powers = np.arange(0., 40.5, 1.)) # measured once
+            calibration = mps.powercalibration() # loaded afterwards
+
+        '''
+        from .calibration import PowerCalibration, defaultCalibrationDirectory, _fileName
+
+        if directory is None:
+            directory = defaultCalibrationDirectory
+        mpsSerial, txdiodesn, ampgain = self.query_many(['serial', 'txdiodesn', 'ampgain'])
+        path = os.path.join(directory, _fileName(mpsSerial, txdiodesn, ampgain))
+
+        calibration = None
+        if not remeasure and os.path.exists(path):
+            calibration = PowerCalibration.load(path)
+            if freqs is not None and not np.array_equal(calibration.freqs, np.sort(freqs)):
+                calibration = None
+            elif powers is not None and not np.array_equal(calibration.powers, np.sort(powers)):
+                calibration = None
+
+        if calibration is None:
+            if freqs is None or powers is None:
+                raise ValueError('No power calibration of %s in %s, freqs and powers are required for a measurement'%(mpsSerial, directory))
+            calibration = PowerCalibration.measure(self, freqs, powers, settle = settle)
+            os.makedirs(directory, exist_ok = True)
+            calibration.save(path)
+
+        self.calibration = calibration
+        return calibration
+
+    def calibratedpower(self, txPower = None):
+        '''Set/Query the delivered power with the power calibration
+
+        The power for the target delivered power at the current frequency is interpolated from the calibration of powercalibration(), without reading the Tx diode. The serial numbers of the MPS and the Tx diode and the amplifier gain are queried together with the frequency and must match the calibration.
+
+        Args:
+            txPower (None, float): Target delivered power in dBm, by default this parameter is None and the calibrated delivered power is queried
+
+        Returns:
+            float: Set power in dBm. If txPower is None, the delivered power in dBm expected from the calibration at the current power and frequency.
+
+        Raises:
+            ValueError: if there is no calibration or the calibration was measured with another MPS, Tx diode or amplifier gain
+
+        Example::
+
+            mps.powercalibration()
+            setPower = mps.calibratedpower(30.) # deliver 30 dBm
+
+        '''
+        if self.calibration is None:
+            raise ValueError('No power calibration, call powercalibration() first')
+
+        freq, power, mpsSerial, txdiodesn, ampgain = self.query_many(['freq', 'power', 'serial', 'txdiodesn', 'ampgain'])
+        self.calibration.check(mpsSerial, txdiodesn, ampgain)
+
+        if txPower is not None:
+            setPower = round(self.calibration.power(txPower, freq), 1)
+            self.power(setPower)
+            return setPower
+
+        return self.calibration.txpower(power, freq)
+
+    def query_many(self, queries):
+        '''Query several MPS parameters in a single serial round trip
+
+        All queries are written to the MPS at once, then the replies are read back in order and converted to the same units as the corresponding query functions (e.g. freq in GHz, power in dBm).
+
+        Args:
+            queries (list): Query names, e.g. 'freq' or 'freq?'. 'systemstatus' and 'rfsweepdata' are also supported.
+
+        Returns:
+            list: Query values in the same order as queries
+
+        Example::
+
+            freq, power, rx, tx = mps.query_many(['freq', 'power', 'rxpowermv', 'txpowermv'])
+
+        '''
+        names = _queryNames(queries)
+
+        replies = self.send_commands(['%s?'%name for name in names], recv = True)
+
+        values = [self._convert(name, reply) for name, reply in zip(names, replies)]
+
+        return values
+
+    def _convert(self, name, reply):
+        '''Convert the reply of the query name, see _convertReply
+        '''
+        return _convertReply(name, reply, self.stats)
+
     def rfstatus(self, rfState = None):
         ''' Set/Query the RF status
 
@@ -390,25 +927,41 @@ class MPS:
                 raise ValueError('RF Status Not Valid')
         else:
             rfStateReadingString = self.send_command('rfstatus?',recv = True)
-            rfStateReading = int(rfStateReadingString)
+            rfStateReading = self._convert('rfstatus', rfStateReadingString)
             return rfStateReading
 
-    def rfsweepdata(self):
+    def rfsweepdata(self, freqAxis = False):
         '''Get data from RF sweep
 
+        Args:
+            freqAxis (bool): If True, also return the frequency axis of the sweep in GHz. The axis is centered on the current frequency with the width given by rfsweepsw() and rfsweepnpts() points.
+
         Returns:
-            numpy.array: Tuning curve from previous rf sweep
+            numpy.array: Tuning curve from previous rf sweep. If freqAxis is True, a tuple of the frequency axis and the tuning curve.
 
         Example::
 
             data = mps.rfsweepdata()
 
+            freqs, data = mps.rfsweepdata(freqAxis = True)
+
         '''
 
-        returnDataRfSweep = self.send_command('rfsweepdata?',recv = True)
-        returnDataRfSweep = returnDataRfSweep.rstrip()
-        returnDataRfSweep = np.fromstring(returnDataRfSweep,sep=',')
-        returnValues = returnDataRfSweep.astype(int)
+        if freqAxis:
+            replies = self.send_commands(['rfsweepdata?', 'rfsweepsw?', 'rfsweepnpts?', 'freq?'], recv = True, raw = True)
+            returnValues = self._convert('rfsweepdata', replies[0])
+
+            sweepWidth = _rfSweepWidths[self._convert('rfsweepsw', replies[1])] / 1.e3 # GHz
+            npts = self._convert('rfsweepnpts', replies[2])
+            centerFreq = self._convert('freq', replies[3]) # GHz
+            if len(returnValues) != npts:
+                raise ValueError('RF sweep data has %i points, expected %i points'%(len(returnValues), npts))
+            freqs = np.linspace(centerFreq - sweepWidth / 2., centerFreq + sweepWidth / 2., npts)
+
+            return freqs, returnValues
+
+        returnDataRfSweep = self.send_command('rfsweepdata?', recv = True, raw = True)
+        returnValues = self._convert('rfsweepdata', returnDataRfSweep)
 
         return returnValues
 
@@ -447,7 +1000,7 @@ class MPS:
             self.send_command('rfsweeppower %s'%tunePowerString)
         else:
             tunePowerString = self.send_command('rfsweeppower?', recv = True)
-            tunePower = float(tunePowerString) / 10.
+            tunePower = self._convert('rfsweeppower', tunePowerString)
 
             return tunePower
 
@@ -472,7 +1025,7 @@ class MPS:
             self.send_command('rfsweepnpts %s'%rfSweepNptsValue)
         else: # Query
             returnRfSweepNpts = self.send_command('rfsweepnpts?',recv = True)
-            returnRfSweepNpts = int(returnRfSweepNpts)
+            returnRfSweepNpts = self._convert('rfsweepnpts', returnRfSweepNpts)
             return returnRfSweepNpts
 
     def rfsweepdwelltime(self, dwellTime = None):
@@ -498,7 +1051,7 @@ class MPS:
             self.send_command('rfsweepdwelltime %s'%dwellTimeString)
         else:
             dwellTimeString = self.send_command('rfsweepdwelltime?', recv = True)
-            dwellTime = float(dwellTimeString)
+            dwellTime = self._convert('rfsweepdwelltime', dwellTimeString)
 
             return dwellTime
 
@@ -525,7 +1078,7 @@ class MPS:
             self.send_command('rfsweepinitialdwelltime %s'%dwellTimeString)
         else:
             dwellTimeString = self.send_command('rfsweepinitialdwelltime?', recv = True)
-            dwellTime = float(dwellTimeString)
+            dwellTime = self._convert('rfsweepinitialdwelltime', dwellTimeString)
 
             return dwellTime
 
@@ -563,7 +1116,7 @@ class MPS:
             self.send_command('rfsweepsw %s'%rfSweepSwValue)
         else: # Query
             returnRfSweepSw = self.send_command('rfsweepsw?',recv = True)
-            returnRfSweepSw = int(returnRfSweepSw)
+            returnRfSweepSw = self._convert('rfsweepsw', returnRfSweepSw)
             return returnRfSweepSw
 
     def rxdiodesn(self):
@@ -587,7 +1140,7 @@ class MPS:
 
         '''
         return_tenth_rx_dbm = self.send_command('rxpowerdbm?',recv = True)
-        rxPower = float(return_tenth_rx_dbm) / 10. # convert to dBm
+        rxPower = self._convert('rxpowerdbm', return_tenth_rx_dbm) # convert to dBm
         return rxPower
 
     def rxpowermv(self):
@@ -602,9 +1155,120 @@ class MPS:
 
         '''
         return_tenth_rx_mv = self.send_command('rxpowermv?',recv = True)
-        rxVoltage = float(return_tenth_rx_mv) / 10. # convert to mV
+        rxVoltage = self._convert('rxpowermv', return_tenth_rx_mv) # convert to mV
         return rxVoltage
 
+    def sampler(self, channels = ('rxpowermv',), rate = 10., size = 100000, shared = None):
+        '''Start a background thread which samples MPS channels into a ring buffer
+
+        Args:
+            channels (tuple): Query names of the channels, e.g. 'rxpowermv', 'txpowermv', 'amptemp', 'power', 'freq'
+            rate (float): Target sample rate in Hz
+            size (int): Number of samples kept in the ring buffer
+            shared (None, bool, str): If True or a name, publish the samples in shared memory for other processes, see SampleReader
+
+        Returns:
+            Sampler: running sampler, see Sampler class
+
+        Example::
+
+            sampler = mps.sampler(channels = ('rxpowermv', 'amptemp'), rate = 20) # Sample Rx diode and amplifier temperature at 20 Hz
+            data = sampler.snapshot()
+            sampler.stop()
+
+        '''
+        from .sampler import Sampler
+
+        sampler = Sampler(self, channels = channels, rate = rate, size = size, shared = shared)
+        sampler.start()
+        return sampler
+
+    def stream(self, channels = ('rxpowermv',), rate = None, chunk = 100, maxChunks = 4):
+        '''Acquire MPS channels continuously and iterate over timestamped chunks
+
+        Args:
+            channels (tuple): Query names of the channels, e.g. 'rxpowermv', 'txpowermv', 'amptemp', 'power', 'freq', 'systemstatus'
+            rate (None, float): Target sample rate in Hz. If None, sample as fast as possible.
+            chunk (int): Number of samples in each chunk
+            maxChunks (int): Number of chunks queued before the acquisition waits for the consumer
+
+        Returns:
+            Stream: iterator of structured arrays with a "time" field and one field for each channel, see Stream class
+
+        Example::
+
+            with mps.stream(channels = ('rxpowermv',), rate = 100, chunk = 50) as stream:
+                for data in stream:
+                    print(data['rxpowermv'].mean()) # mean Rx diode voltage of every 0.5 s
+
+        '''
+        from .sampler import Stream
+
+        return Stream(self, channels = channels, rate = rate, chunk = chunk, maxChunks = maxChunks)
+
+    def record(self, path, channels = ('rxpowermv', 'txpowermv'), rate = 10., chunk = None):
+        '''Record MPS channels to a binary file in the background
+
+        Args:
+            path (str): File name of the recording, appended to if it exists
+            channels (tuple): Query names of the channels, e.g. 'rxpowermv', 'txpowermv', 'amptemp' or 'systemstatus'
+            rate (float): Target sample rate in Hz
+            chunk (None, int): Number of samples written at once, by default one second of samples
+
+        Returns:
+            Recorder: running recorder, see Recorder class. Read the file with Recording.
+
+        Example::
+
+            recorder = mps.record('run42.b12', channels = ('systemstatus',), rate = 10)
+            # ...
+            recorder.stop()
+
+        '''
+        from .recorder import Recorder
+
+        return Recorder(self, path, channels = channels, rate = rate, chunk = chunk)
+
+    def rxsettle(self, tolerance = None, maxWait = None):
+        '''Poll the Rx diode until successive readings agree within tolerance
+
+        Use after changing the frequency or power instead of a fixed delay.
+
+        Args:
+            tolerance (None, float): Maximum difference of successive Rx readings in mV. If None, settleTolerance is used.
+            maxWait (None, float): Maximum time to wait in s. If None, settleMaxWait is used.
+
+        Returns:
+            tuple: Settled Rx diode voltage in mV and the settle time in s
+
+        Example::
+
+            mps.freq(9.5)
+            rxVoltage, settleTime = mps.rxsettle(tolerance = 0.5, maxWait = 0.1)
+
+        '''
+        return self._settle([], tolerance, maxWait)
+
+    def _settle(self, commands, tolerance = None, maxWait = None):
+        '''Send set commands together with the first Rx query, then poll the Rx diode until it settles
+        '''
+        if tolerance is None:
+            tolerance = self.settleTolerance
+        if maxWait is None:
+            maxWait = self.settleMaxWait
+        convertRx = functools.partial(self._convert, 'rxpowermv')
+
+        startTime = time.monotonic()
+        reply, = self.send_commands(list(commands) + ['rxpowermv?'], recv = [False] * len(commands) + [True])
+        rxVoltage = convertRx(reply)
+        while time.monotonic() - startTime < maxWait:
+            previousRxVoltage = rxVoltage
+            rxVoltage = convertRx(self.send_command('rxpowermv?', recv = True))
+            if abs(rxVoltage - previousRxVoltage) <= tolerance:
+                break
+
+        return rxVoltage, time.monotonic() - startTime
+
     def screen(self, screenState = None):
         '''Set/Query Screen Status
 
@@ -644,15 +1308,16 @@ class MPS:
                 raise ValueError('Screen Status is not Valid')
         else:
             screenStateReadingString = self.send_command('screen?',recv = True)
-            screenStateReading = int(screenStateReadingString)
+            screenStateReading = self._convert('screen', screenStateReadingString)
             return screenStateReading
 
-    def send_command(self, command, recv = False):
+    def send_command(self, command, recv = False, raw = False):
         '''Send string command to python MPS server
 
         Args:
             command (str): string command to be sent to MPS Server
             recv (bool): True if serial port should be read after writing. False by default.
+            raw (bool): If True, the received bytes are returned without decoding. False by default.
 
         Returns:
             recv_string (str): if recv = True, returns string received from MPS Server
@@ -668,22 +1333,241 @@ class MPS:
 
         '''
 
-        self.ser.reset_input_buffer() # reset and flush buffer
+        if self._cache is not None:
+            cached, reply = self._cached_reply(command, recv)
+            if cached:
+                if recv and raw:
+                    return reply.encode('utf-8')
+                return reply
+
+        recv_strings = self.send_commands([command], recv = recv, raw = raw)
+
+        if recv == True:
+            return recv_strings[0]
+
+    def send_commands(self, commands, recv = False, raw = False):
+        '''Send several string commands to the MPS in a single write
+
+        The replies are read back in the order the commands were sent. Set commands do not return a reply from the MPS.
+
+        Args:
+            commands (list): string commands to be sent to MPS
+            recv (bool, list): True if a reply should be read for every command. A list of bools selects which commands return a reply.
+            raw (bool): If True, the received bytes are returned without decoding. False by default.
+
+        Returns:
+            list: strings received from MPS, one for each command with recv True
+
+        Example::
+
+            send_commands(['freq 9300000', 'rxpowermv?'], recv = [False, True]) # Set frequency and read Rx diode in one round trip
+
+        '''
+
+        if isinstance(recv, bool):
+            recv = [recv] * len(commands)
+
+        batchCommands = getattr(self._batchState, 'commands', None)
+        if batchCommands is not None:
+            self._batchState.sent.extend(command for command, command_recv in zip(commands, recv) if not command_recv)
+            if not any(recv): # queue set commands until the batch exits
+                batchCommands.extend(commands)
+                return []
+            # send queued commands together with this query
+            recv = [False] * len(batchCommands) + list(recv)
+            commands = batchCommands + list(commands)
+            self._batchState.commands = []
+
+        stats = self.stats
+        if stats is not None:
+            stats.before(commands)
+
+        ioQueue = self._ioQueue
+        if ioQueue is not None and threading.current_thread() is not self._ioThread:
+            recv_bytes = self._submit(commands, recv).result()
+        else:
+            if self._command_priority(commands) != PRIORITY_BACKGROUND:
+                self._lastForegroundTime = time.monotonic()
+            with self._ioLock:
+                recv_bytes = self._exchange(commands, recv)
+
+        if stats is not None:
+            stats.after()
+
+        recv_strings = _decodeReplies(recv_bytes, raw)
+
+        if self._cache is not None:
+            self._update_cache(commands, recv, recv_strings)
 
-        send_string = '%s\n'%command
+        return recv_strings
+
+    def _exchange(self, commands, recv):
+        '''Write commands to the serial port and read one line for each command with recv True
+
+        Returns:
+            list: bytes received
+        '''
+        send_string = ''.join('%s\n'%command for command in commands)
 
         # specify string as utf-8
         send_bytes = send_string.encode('utf-8')
 
+        self.ser.reset_input_buffer() # reset and flush buffer
+
+        if self.stats is not None:
+            return self.stats.exchange(self.ser, commands, recv, send_bytes)
+
         # send bytes to MPS
         self.ser.write(send_bytes)
 
-        # read bytes from MPS
-        if recv == True:
-            from_mps_bytes = self.ser.readline()
-            from_mps_string = from_mps_bytes.decode('utf-8').rstrip()
+        # read bytes from MPS, one line for each reply
+        return [self.ser.readline() for command_recv in recv if command_recv]
+
+    def _start_io_worker(self):
+        '''Start the thread which performs all serial exchanges in thread-safe mode
+        '''
+        if self._ioQueue is not None:
+            return
+        self._ioQueue = queue.PriorityQueue()
+        self._ioSequence = itertools.count() # keeps requests of the same priority in order
+        # the worker only holds a weak reference, so the MPS can still be deleted
+        self._ioThread = threading.Thread(target = _io_worker, args = (weakref.ref(self), self._ioQueue), name = 'MPS I/O', daemon = True)
+        self._ioThread.start()
+
+    def _stop_io_worker(self):
+        ioQueue, ioThread = self._ioQueue, self._ioThread
+        if ioQueue is None:
+            return
+        self._ioQueue = None
+        self._ioThread = None
+        ioQueue.put((PRIORITY_BACKGROUND + 1, next(self._ioSequence), None)) # after all queued requests
+        if threading.current_thread() is not ioThread:
+            ioThread.join()
+
+    def _command_priority(self, commands):
+        '''Priority class of a request, the priority of the thread unless it contains a safety command
+        '''
+        for command in commands:
+            if command in _safetyCommands:
+                return PRIORITY_SAFETY
+        return getattr(self._priorityState, 'priority', PRIORITY_INTERACTIVE)
+
+    def _submit(self, commands, recv):
+        priority = self._command_priority(commands)
+        future = concurrent.futures.Future()
+        if priority != PRIORITY_BACKGROUND:
+            with self._pendingLock:
+                self._foregroundPending += 1
+            self._lastForegroundTime = time.monotonic()
+        self._ioQueue.put((priority, next(self._ioSequence), (commands, recv, future, priority)))
+        return future
+
+    def _request_done(self, priority):
+        if priority != PRIORITY_BACKGROUND:
+            with self._pendingLock:
+                self._foregroundPending -= 1
+
+    def priority(self, priorityClass):
+        '''Context manager to set the priority class of the commands sent by the current thread
+
+        In thread-safe mode, requests are sent in the order of their priority class, so commands of higher priority only wait for the exchange in progress. Set commands which turn the MPS off (rfstatus 0, wgstatus 0, lockstatus 0, ampstatus 0, power -99) always have safety priority. Commands have interactive priority by default.
+
+        +---------------------+---------------------------------------+
+        |priorityClass        |Description                            |
+        +=====================+=======================================+
+        |PRIORITY_SAFETY      |Shutdown and watchdog commands         |
+        +---------------------+---------------------------------------+
+        |PRIORITY_INTERACTIVE |Commands of the operator (default)     |
+        +---------------------+---------------------------------------+
+        |PRIORITY_BACKGROUND  |Telemetry polling, e.g. Sampler        |
+        +---------------------+---------------------------------------+
+
+        Args:
+            priorityClass (int): PRIORITY_SAFETY, PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND
+
+        Example::
+
+            with mps.priority(pyB12MPS.PRIORITY_SAFETY):
+                if mps.amptemp() > 50.:
+                    mps.rfstatus(0)
+
+        '''
+        if priorityClass not in (PRIORITY_SAFETY, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND):
+            raise ValueError('Priority class must be PRIORITY_SAFETY, PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND')
+        return self._priority(priorityClass)
+
+    @contextlib.contextmanager
+    def _priority(self, priorityClass):
+        previous = getattr(self._priorityState, 'priority', PRIORITY_INTERACTIVE)
+        self._priorityState.priority = priorityClass
+        try:
+            yield self
+        finally:
+            self._priorityState.priority = previous
+
+    def foreground_busy(self, window = 0.):
+        '''Returns True if safety or interactive requests are waiting or were sent within window seconds
+
+        Background pollers use this to back off while the serial link is needed for other commands.
+
+        Args:
+            window (float): Time in s
+        '''
+        return self._foregroundPending > 0 or time.monotonic() - self._lastForegroundTime < window
+
+    def submit(self, commands, recv = False, raw = False):
+        '''Send commands without waiting for the replies
+
+        In thread-safe mode the commands are queued for the I/O thread, otherwise they are sent immediately and the returned future is already done. Batches and the cache are not applied: the commands are sent even inside a batch() block and replies are neither taken from nor stored in the cache. Call invalidate() after submitting set commands while the cache is enabled.
 
-            return from_mps_string
+        Args:
+            commands (list): string commands to be sent to MPS
+            recv (bool, list): True if a reply should be read for every command. A list of bools selects which commands return a reply.
+            raw (bool): If True, the received bytes are returned without decoding. False by default.
+
+        Returns:
+            concurrent.futures.Future: Future of the list of strings received from MPS
+
+        Example::
+
+            future = mps.submit(['freq?', 'rxpowermv?'], recv = True)
+            # ...
+            freqString, rxString = future.result()
+
+        '''
+        if isinstance(recv, bool):
+            recv = [recv] * len(commands)
+
+        stats = self.stats
+        if stats is not None:
+            stats.before(commands)
+
+        if self._ioQueue is None:
+            if self._command_priority(commands) != PRIORITY_BACKGROUND:
+                self._lastForegroundTime = time.monotonic()
+            future = concurrent.futures.Future()
+            try:
+                with self._ioLock:
+                    recv_bytes = self._exchange(list(commands), recv)
+                future.set_result(_decodeReplies(recv_bytes, raw))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                if stats is not None:
+                    stats.after()
+            return future
+
+        future = concurrent.futures.Future()
+        def decode(ioFuture):
+            if stats is not None:
+                stats.after()
+            try:
+                future.set_result(_decodeReplies(ioFuture.result(), raw))
+            except Exception as e:
+                future.set_exception(e)
+
+        self._submit(list(commands), recv).add_done_callback(decode)
+        return future
 
     def serialNumber(self):
         '''Query serial number of MPS
@@ -694,7 +1578,90 @@ class MPS:
         serialNumberString = self.send_command('serial?',recv = True)
         return serialNumberString
 
-    def systemstatus(self):
+    def sweep(self, freqs, settle = 0.05, power = None, chunk = None, tolerance = None, maxWait = None):
+        '''Host-side frequency sweep of the Rx diode voltage
+
+        For each point the microwave frequency is set, the settle time is waited and the Rx diode is read. The Rx query of one point and the frequency of the next point are sent in a single write, so each point takes one serial round trip. The RF output is enabled during the sweep. The frequency, power and RF status before the sweep are restored afterwards.
+
+        Args:
+            freqs (numpy.ndarray): Frequencies of the sweep in GHz
+            settle (float, str): Time in seconds to wait after setting the frequency before reading the Rx diode. If 'auto', the Rx diode is polled at each point until it settles, see rxsettle().
+            power (None, float, int): If not None, microwave power in dBm during the sweep
+            chunk (None, int): Number of points sent in a single write if settle is 0, by default sweepChunk
+            tolerance (None, float): Rx tolerance in mV if settle is 'auto', see rxsettle()
+            maxWait (None, float): Maximum settle time in s if settle is 'auto', see rxsettle()
+
+        Returns:
+            dict: 'freq' (GHz), 'rxpowermv' (mV), 'time' (time.monotonic() of each Rx reading in s) and 'settle' (settle time of each point in s) arrays. If settle is 0, the times of the readings of one write are spread evenly over its round trip, since the MPS processes the commands one after another.
+
+        Warning:
+            The microwave output can only be enabled if the waveguide switch is set to DNP mode (wgstatus() returns 1).
+
+        Example::
+
+            result = mps.sweep(np.linspace(9.4, 9.6, 100), settle = 0.05, power = 0)
+            plt.plot(result['freq'], result['rxpowermv'])
+
+        '''
+        if settle != 'auto' and not isinstance(settle,(float,int)):
+            raise ValueError('Settle must be a time in s or \'auto\'')
+        freqs = np.array(freqs, dtype = float, ndmin = 1)
+        if freqs.ndim != 1 or len(freqs) == 0:
+            raise ValueError('Frequencies must be a 1D array with at least one point')
+        if np.any(freqs > 100.):
+            raise ValueError('Frequency value must be in units of GHz')
+        if chunk is None:
+            chunk = self.sweepChunk
+        if not isinstance(chunk, (int, np.integer)) or chunk < 1:
+            raise ValueError('Chunk must be an integer number of at least 1 point')
+        chunk = int(chunk)
+        setupCommands = ['rfstatus 1']
+        if power is not None:
+            if not isinstance(power,(float,int)):
+                raise ValueError('Power value must be an float or int')
+            setupCommands.insert(0, 'power %0.0f'%(power * 10.))
+
+        freqCommands = ['freq %0.0f'%kHz_freq for kHz_freq in freqs * 1.e6]
+        rxVoltage = np.zeros(len(freqs))
+        timestamps = np.zeros(len(freqs))
+        settleTimes = np.zeros(len(freqs))
+        convertRx = functools.partial(self._convert, 'rxpowermv')
+
+        previousState = self.send_commands(['freq?', 'power?', 'rfstatus?'], recv = True)
+        try:
+            if settle == 'auto':
+                self.send_commands(setupCommands)
+                for ix in range(len(freqs)):
+                    rxVoltage[ix], settleTimes[ix] = self._settle(freqCommands[ix:ix + 1], tolerance, maxWait)
+                    timestamps[ix] = time.monotonic()
+            elif settle > 0:
+                settleTimes[:] = settle
+                self.send_commands(setupCommands + freqCommands[:1])
+                for ix in range(len(freqs)):
+                    time.sleep(settle)
+                    # read this point and set the frequency of the next point
+                    nextCommands = freqCommands[ix + 1:ix + 2]
+                    reply, = self.send_commands(['rxpowermv?'] + nextCommands, recv = [True] + [False] * len(nextCommands))
+                    timestamps[ix] = time.monotonic()
+                    rxVoltage[ix] = convertRx(reply)
+            else:
+                self.send_commands(setupCommands)
+                for start in range(0, len(freqs), chunk):
+                    commands = []
+                    for freqCommand in freqCommands[start:start + chunk]:
+                        commands += [freqCommand, 'rxpowermv?']
+                    points = len(commands) // 2
+                    writeTime = time.monotonic()
+                    replies = self.send_commands(commands, recv = [False, True] * points)
+                    endTime = time.monotonic()
+                    timestamps[start:start + points] = writeTime + (endTime - writeTime) * np.arange(1, points + 1) / points
+                    rxVoltage[start:start + points] = [convertRx(reply) for reply in replies]
+        finally:
+            self.send_commands(['rfstatus %s'%previousState[2], 'power %s'%previousState[1], 'freq %s'%previousState[0]])
+
+        return {'freq' : freqs, 'rxpowermv' : rxVoltage, 'time' : timestamps, 'settle' : settleTimes}
+
+    def systemstatus(self, record = False, out = None, index = 0):
         '''Returns dictionary of MPS status
 
         +--------------------------------------+
@@ -721,32 +1688,57 @@ class MPS:
         |screen                                |
         +--------------------------------------+
 
+        Args:
+            record (bool): If True, return a SystemStatus record instead of a dictionary
+            out (None, numpy.ndarray): Structured array with the fields of systemStatusDtype. If given, the status is written to row index of out.
+            index (int): Row of out
 
         Returns:
-            dict: dictionary of system status variables
+            dict: dictionary of system status variables. SystemStatus if record is True, row of out if out is given.
+
+        Example::
+
+            status = systemstatus() # dictionary
+            status = systemstatus(record = True) # compact SystemStatus record
+
+            log = np.zeros(1000, dtype = pyB12MPS.systemStatusDtype)
+            for ix in range(len(log)):
+                systemstatus(out = log, index = ix)
+
         '''
         systemStatusString = self.send_command('systemstatus?',recv = True)
 
-        systemStatusList = systemStatusString.rstrip().split(',')
+        if out is not None:
+            return parseSystemStatus([systemStatusString], out = out, start = index)[0]
+
+        if record:
+            return SystemStatus.parse(systemStatusString)
 
-        systemStatusDict = {}
+        systemStatusDict = self._convert('systemstatus', systemStatusString)
 
-        for statusInfo in systemStatusList:
-            key, value = tuple(statusInfo.split(':'))
+        return systemStatusDict
 
-            systemStatusDict[key] = value
+    def tracker(self, dither = 0.5, minDither = 0.05, maxDither = 2., gain = 0.7, maxStep = 1., settle = 0., interval = 0.):
+        '''Start a host-side frequency tracker which keeps the microwave frequency on the cavity resonance
 
-        systemStatusDict['freq'] = float(systemStatusDict['freq']) / 1.e6
-        systemStatusDict['power'] = float(systemStatusDict['power']) / 10.
-        systemStatusDict['rxpowermv'] = float(systemStatusDict['rxpowermv']) / 10.
-        systemStatusDict['txpowermv'] = float(systemStatusDict['txpowermv']) / 10.
-        systemStatusDict['rfstatus'] = int(systemStatusDict['rfstatus'])
-        systemStatusDict['wgstatus'] = int(systemStatusDict['wgstatus'])
-        systemStatusDict['ampstatus'] = int(systemStatusDict['ampstatus'])
-        systemStatusDict['amptemp'] = float(systemStatusDict['amptemp']) / 10.
-        systemStatusDict['screen'] = int(systemStatusDict['screen'])
+        The tracker dithers the frequency around the resonance and reacts within a few serial round trips, faster than the firmware lock (lockstatus). See FrequencyTracker for the arguments.
 
-        return systemStatusDict
+        Returns:
+            FrequencyTracker: running tracker
+
+        Example::
+
+            tracker = mps.tracker()
+            # ... heating
+            print('Lock error: %0.3f MHz at %0.0f updates/s'%(tracker.lockErrorRms(), tracker.updateRate))
+            tracker.stop()
+
+        '''
+        from .tracking import FrequencyTracker
+
+        tracker = FrequencyTracker(self, dither = dither, minDither = minDither, maxDither = maxDither, gain = gain, maxStep = maxStep, settle = settle, interval = interval)
+        tracker.start()
+        return tracker
 
     def triglength(self, length = None):
         '''Set/Query trigger pulse length in us
@@ -765,7 +1757,7 @@ class MPS:
         '''
         if length is None:
             length = self.send_command('triglength?', recv = True)
-            length = int(length)
+            length = self._convert('triglength', length)
             return length
         else:
             if (length > 0) and (length <= 10000000):
@@ -794,7 +1786,7 @@ class MPS:
 
         '''
         return_tenth_tx_dbm = self.send_command('txpowerdbm?',recv = True)
-        txPower = float(return_tenth_tx_dbm) / 10. # convert to dBm
+        txPower = self._convert('txpowerdbm', return_tenth_tx_dbm) # convert to dBm
         return txPower
 
     def txpowermv(self):
@@ -809,7 +1801,7 @@ class MPS:
 
         '''
         return_tenth_tx_mv = self.send_command('txpowermv?',recv = True)
-        txVoltage = float(return_tenth_tx_mv) / 10. # convert to mV
+        txVoltage = self._convert('txpowermv', return_tenth_tx_mv) # convert to mV
         return txVoltage
 
     def wgstatus(self, wgStatus = None):
@@ -844,11 +1836,12 @@ class MPS:
                 raise ValueError('WG Status Not Valid')
         else:
             wgStatusReadingString = self.send_command('wgstatus?',recv = True)
-            wgStatusReading = int(wgStatusReadingString)
+            wgStatusReading = self._convert('wgstatus', wgStatusReadingString)
             return wgStatusReading
        
     def __del__(self):                   # If mps object is deleted
-    
+
+        self._stop_io_worker()           # Send the commands below directly
         if self.ser.is_open:             # In case mps object is deleted but was not closed beforehand 
             
             #Turn everything off and close the connection (does NOT replace properly closing everything in your script)
@@ -863,5 +1856,75 @@ class MPS:
             self.close()                 # Closes the serial port
         
 
+def _io_worker(mpsRef, ioQueue):
+    '''Perform the serial exchanges requested through ioQueue in priority order until a None request is received
+    '''
+    while True:
+        priority, sequence, request = ioQueue.get()
+        if request is None:
+            return
+        commands, recv, future, priority = request
+        mps = mpsRef()
+        if mps is None:
+            future.set_exception(RuntimeError('MPS was deleted'))
+            return
+        mps._request_done(priority)
+        if future.set_running_or_notify_cancel():
+            try:
+                with mps._ioLock:
+                    recv_bytes = mps._exchange(commands, recv)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(recv_bytes) # callbacks run after the serial port is released
+        del mps
+
+def _decodeReplies(recv_bytes, raw = False):
+    '''Strip the line endings of the received bytes and decode them unless raw is True
+    '''
+    if raw:
+        return [from_mps_bytes.rstrip() for from_mps_bytes in recv_bytes]
+    return [from_mps_bytes.decode('utf-8').rstrip() for from_mps_bytes in recv_bytes]
+
+def _queryNames(queries):
+    '''Return the query names without '?', raise ValueError for unknown queries
+    '''
+    names = [query.rstrip('?') for query in queries]
+    for name in names:
+        if (name not in _queryConversions) and (name not in ('systemstatus', 'rfsweepdata')):
+            raise ValueError('Unknown query: %s'%name)
+    return names
+
+def _convertReply(name, reply, stats = None):
+    '''Convert the reply string of the query name to a typed value
+
+    Replies which cannot be converted raise ValueError and are counted in stats (CommandStats) if given.
+    '''
+    try:
+        if name == 'systemstatus':
+            return SystemStatus.parse(reply).asdict()
+        if name == 'rfsweepdata':
+            return _parseRfSweepData(reply)
+        return _queryConversions[name](reply)
+    except ValueError:
+        if stats is not None:
+            stats.parseFailure(name + '?')
+        raise
+
+def _parseRfSweepData(rfSweepBytes):
+    '''Convert the reply of the rfsweepdata? query to an integer array
+
+    The comma separated values are parsed directly from the received bytes into an int array.
+
+    Args:
+        rfSweepBytes (bytes, str): reply of the MPS, e.g. b"1023,1010,..."
+
+    Returns:
+        numpy.array: Tuning curve values
+    '''
+    if isinstance(rfSweepBytes, str):
+        rfSweepBytes = rfSweepBytes.encode('utf-8')
+    return np.fromstring(rfSweepBytes.rstrip().rstrip(b','), dtype = np.int64, sep = ',')
+
 if __name__ == '__main__':
     pass
@@ -0,0 +1,239 @@
+import json
+import numpy as np
+import os
+import struct
+import threading
+import time
+
+_recordingMagic = b'B12MPSR\x01'
+_headerAlignment = 64 # records start at a multiple of this offset
+
+# Units of the recorded fields
+_units = {
+    'time' : 's',
+    'ampgain' : 'dB',
+    'amptemp' : 'degC',
+    'freq' : 'GHz',
+    'power' : 'dBm',
+    'rfsweeppower' : 'dBm',
+    'rxpowerdbm' : 'dBm',
+    'rxpowermv' : 'mV',
+    'txpowerdbm' : 'dBm',
+    'txpowermv' : 'mV',
+    'triglength' : 'us',
+    }
+
+
+def _readHeader(path):
+    '''Return the header dict and the offset of the first record of a recording
+    '''
+    with open(path, 'rb') as f:
+        prefix = f.read(len(_recordingMagic) + 4)
+        if len(prefix) < len(_recordingMagic) + 4 or prefix[:len(_recordingMagic)] != _recordingMagic:
+            raise ValueError('%s is not a pyB12MPS recording'%path)
+        offset, = struct.unpack('<I', prefix[len(_recordingMagic):])
+        header = json.loads(f.read(offset - len(prefix)).decode('utf-8'))
+    header['dtype'] = np.dtype([tuple(field) for field in header['dtype']])
+    return header, offset
+
+
+class Recorder:
+    '''Record MPS channels to a binary file of fixed-size records
+
+    The file starts with a JSON header which describes the record dtype, the units of the fields and the MPS (serial number and firmware), followed by one record per sample. The "time" field of each record is time.time() in seconds. The channels are acquired with MPS.stream and written in chunks, so recording costs one write per chunk.
+
+    Recording to an existing file appends to it if the fields match. Use Recording to read the file.
+
+    Args:
+        mps (MPS): MPS instance to record
+        path (str): File name of the recording
+        channels (tuple): Query names of the channels, e.g. 'rxpowermv', 'txpowermv', 'amptemp' or 'systemstatus'
+        rate (float): Target sample rate in Hz
+        chunk (None, int): Number of samples written at once, by default one second of samples
+
+    Example::
+
+        recorder = mps.record('run42.b12', channels = ('systemstatus', 'amptemp'), rate = 10)
+        # ... DNP experiment
+        recorder.stop()
+
+        recording = pyB12MPS.Recording('run42.b12')
+        print(recording.serial, recording['rxpowermv'].mean())
+
+    '''
+    def __init__(self, mps, path, channels = ('rxpowermv', 'txpowermv'), rate = 10., chunk = None):
+        from .sampler import Stream
+
+        if rate is None or rate <= 0:
+            raise ValueError('Sample rate must be greater than 0 Hz')
+        if chunk is None:
+            chunk = max(int(rate), 1)
+
+        self.mps = mps
+        self.path = path
+        self.count = 0 # number of records written by this recorder
+        self._stream = Stream(mps, channels = channels, rate = rate, chunk = chunk)
+        self.dtype = self._stream.dtype
+        try:
+            self._open(path, rate)
+        except BaseException:
+            self._stream.close()
+            raise
+
+        self._clockOffset = time.time() - time.monotonic()
+        self._thread = threading.Thread(target = self._run, name = 'MPS Recorder', daemon = True)
+        self._thread.start()
+
+    def _open(self, path, rate):
+        '''Open the recording for appending or write the header of a new recording
+        '''
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            header, offset = _readHeader(path)
+            if header['dtype'] != self.dtype:
+                raise ValueError('Fields of %s do not match the recorded channels'%path)
+            self._file = open(path, 'r+b')
+            recordBytes = os.path.getsize(path) - offset
+            self._file.seek(offset + recordBytes - recordBytes % self.dtype.itemsize) # drop a partial record
+            self._file.truncate()
+        else:
+            header = {
+                'dtype' : self.dtype.descr,
+                'units' : {name : _units.get(name, '') for name in self.dtype.names},
+                'channels' : list(self._stream.channels),
+                'rate' : float(rate),
+                'serial' : self.mps.serialNumber(),
+                'firmware' : self.mps.firmware(),
+                'startTime' : time.time(),
+                }
+            headerBytes = json.dumps(header).encode('utf-8')
+            offset = len(_recordingMagic) + 4 + len(headerBytes)
+            offset += -offset % _headerAlignment
+            headerBytes = headerBytes.ljust(offset - len(_recordingMagic) - 4)
+            self._file = open(path, 'wb')
+            self._file.write(_recordingMagic + struct.pack('<I', offset) + headerBytes)
+            self._file.flush()
+
+    def _run(self):
+        try:
+            for data in self._stream:
+                data['time'] += self._clockOffset
+                self._file.write(data.tobytes())
+                self._file.flush()
+                self.count += len(data)
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def running(self):
+        '''Returns True if the recorder is running
+        '''
+        return self._thread.is_alive()
+
+    def stop(self):
+        '''Stop recording, the samples acquired so far are written and the file is closed
+        '''
+        self._stream.stop()
+        self._thread.join()
+
+
+class Recording:
+    '''Memory-mapped reader of a file written by Recorder
+
+    Opening a recording only reads the header, the records are mapped into memory and read from disk when they are accessed. Fields, slices and time ranges are returned as NumPy views of the memory map. Time ranges are found with a sparse index of every indexStride-th timestamp, so only a few pages of a large file are read.
+
+    Args:
+        path (str): File name of the recording
+        indexStride (int): Number of records between entries of the sparse time index
+
+    Attributes:
+        data (numpy.memmap): All complete records
+        dtype (numpy.dtype): Record dtype
+        units (dict): Unit of each field
+        serial (str): Serial number of the MPS
+        firmware (str): Firmware version of the MPS
+
+    Example::
+
+        recording = pyB12MPS.Recording('run42.b12')
+
+        rx = recording['rxpowermv'] # view of all Rx diode readings
+        lastMinute = recording.timeRange(recording.endTime - 60.) # view of the records of the last minute
+
+    '''
+    def __init__(self, path, indexStride = 4096):
+        self.path = path
+        self.header, self._offset = _readHeader(path)
+        self.dtype = self.header['dtype']
+        self.units = self.header['units']
+        self.channels = tuple(self.header['channels'])
+        self.rate = self.header['rate']
+        self.serial = self.header['serial']
+        self.firmware = self.header['firmware']
+        self.startTime = self.header['startTime']
+        self.indexStride = int(indexStride)
+        self.refresh()
+
+    def refresh(self):
+        '''Map the records which were appended since the recording was opened
+        '''
+        count = (os.path.getsize(self.path) - self._offset) // self.dtype.itemsize
+        if count:
+            self.data = np.memmap(self.path, dtype = self.dtype, mode = 'r', offset = self._offset, shape = (count,))
+        else:
+            self.data = np.zeros(0, dtype = self.dtype)
+        self._index = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    @property
+    def endTime(self):
+        '''Time of the last record, startTime if there are no records
+        '''
+        if not len(self.data):
+            return self.startTime
+        return float(self.data['time'][-1])
+
+    @property
+    def index(self):
+        '''Sparse time index, the time of every indexStride-th record
+        '''
+        if self._index is None:
+            self._index = np.array(self.data['time'][::self.indexStride])
+        return self._index
+
+    def _search(self, timestamp):
+        '''Index of the first record at or after timestamp
+        '''
+        block = np.searchsorted(self.index, timestamp, side = 'left')
+        start = max(block - 1, 0) * self.indexStride
+        stop = min(block * self.indexStride + 1, len(self.data))
+        return start + int(np.searchsorted(self.data['time'][start:stop], timestamp, side = 'left'))
+
+    def timeRange(self, start = None, stop = None):
+        '''Return the records with start <= time < stop as a view
+
+        Args:
+            start (None, float): time.time() value, by default the first record
+            stop (None, float): time.time() value, by default after the last record
+
+        Returns:
+            numpy.ndarray: view of the records
+        '''
+        first = 0 if start is None else self._search(start)
+        last = len(self.data) if stop is None else self._search(stop)
+        return self.data[first:max(first, last)]
+
+    def close(self):
+        '''Release the memory map, views returned before keep it open until they are deleted
+        '''
+        self.data = np.zeros(0, dtype = self.dtype)
+        self._index = None
@@ -0,0 +1,583 @@
+import json
+import numpy as np
+import queue
+import sys
+import threading
+import time
+import uuid
+
+from .mps import PRIORITY_BACKGROUND, _queryNames
+from .status import SystemStatus, systemStatusDtype
+
+# Header of the shared memory ring buffer, followed by the JSON descriptor of the sample dtype
+_sharedMagic = b'B12MPSSB'
+_sharedHeaderDtype = np.dtype([
+    ('magic', 'S8'),
+    ('sequence', '<u8'), # incremented before and after each sample is written, odd while writing
+    ('count', '<u8'), # total number of samples written
+    ('size', '<u8'), # number of samples in the ring buffer
+    ('startTime', '<f8'), # time.time() when the buffer was created
+    ('clockOffset', '<f8'), # time.time() - time.monotonic() of the writer
+    ('lastTime', '<f8'), # time of the latest sample
+    ('descriptorLength', '<u8'),
+    ])
+_sharedHeaderSize = 4096 # samples start at this offset
+_createdSharedNames = set() # shared memory blocks created by samplers of this process
+
+
+def _ringSegments(buffer, count):
+    '''Return the valid part of a ring buffer with count samples written as two views in chronological order
+    '''
+    size = len(buffer)
+    index = count % size
+    if count < size:
+        return buffer[:count], buffer[:0]
+    return buffer[index:], buffer[:index]
+
+
+def _attachSharedMemory(name):
+    '''Attach to an existing shared memory block without unlinking it when this process exits
+    '''
+    from multiprocessing import shared_memory
+
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name = name, track = False)
+    sharedMemory = shared_memory.SharedMemory(name = name)
+    if name in _createdSharedNames:
+        return sharedMemory
+    try: # the resource tracker would remove the block of the writer when this process exits
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(sharedMemory._name, 'shared_memory')
+    except (ImportError, AttributeError, KeyError):
+        pass
+    return sharedMemory
+
+
+class Sampler:
+    '''Background thread which polls MPS channels into a ring buffer
+
+    The samples are stored in a preallocated NumPy structured array with a "time" field (time.monotonic() in seconds) and one field for each channel. When the ring buffer is full the oldest samples are overwritten, so the memory used is constant.
+
+    If shared is given, the ring buffer is placed in a multiprocessing.shared_memory block, so that other processes can read the samples with SampleReader without serial access and without copies.
+
+    The sampler polls with background priority, see MPS.priority. While other commands are sent, the poll period is doubled up to maxBackoffPeriod and returns to the nominal period once the serial link is free.
+
+    Invalid replies are counted in errors. Any other exception, e.g. a serial port error, stops the sampler thread and is kept in error, the samples acquired before are kept.
+
+    Args:
+        mps (MPS): MPS instance to poll
+        channels (tuple): Query names of the channels, e.g. 'rxpowermv', 'txpowermv', 'amptemp', 'power', 'freq'
+        rate (float): Target sample rate in Hz
+        size (int): Number of samples kept in the ring buffer
+        shared (None, bool, str): If True or the name of a shared memory block, publish the samples in shared memory, see sharedName
+
+    Example::
+
+        sampler = mps.sampler(channels = ('rxpowermv', 'txpowermv'), rate = 20)
+
+        time.sleep(10)
+        data = sampler.snapshot()
+        print(data['time'], data['rxpowermv'])
+
+        sampler.stop()
+
+    '''
+    maxBackoffPeriod = 1. # longest poll period in s while backing off
+
+    def __init__(self, mps, channels = ('rxpowermv',), rate = 10., size = 100000, shared = None):
+        channels = tuple(_queryNames(channels))
+        for channel in ('systemstatus', 'rfsweepdata'):
+            if channel in channels:
+                raise ValueError('%s cannot be sampled as a channel'%channel)
+        if rate <= 0:
+            raise ValueError('Sample rate must be greater than 0 Hz')
+
+        self.mps = mps
+        self.channels = channels
+        self.rate = float(rate)
+        self.size = int(size)
+        self.dtype = np.dtype([('time', float)] + [(channel, float) for channel in channels])
+        self.sharedName = None # name of the shared memory block for SampleReader, None if not shared
+        self._sharedMemory = None
+        self._header = None
+        if shared:
+            self._create_shared(None if shared is True else shared)
+        else:
+            self.buffer = np.zeros(self.size, dtype = self.dtype)
+        self.count = 0 # total number of samples acquired
+        self.errors = 0 # number of polls with invalid replies
+        self.backoffs = 0 # number of times the poll period was increased for other commands
+        self.error = None # exception which stopped the sampler thread, e.g. a serial port error
+
+        self._lock = threading.Lock()
+        self._stopEvent = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def start(self):
+        '''Start the sampler thread
+        '''
+        if self.running():
+            return
+        self._stopEvent.clear()
+        self.error = None
+        self._thread = threading.Thread(target = self._run, name = 'MPS Sampler', daemon = True)
+        self._thread.start()
+
+    def stop(self):
+        '''Stop the sampler thread, the samples in the ring buffer are kept
+        '''
+        self._stopEvent.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _create_shared(self, name):
+        from multiprocessing import shared_memory
+
+        if name is None:
+            name = 'pyB12MPS_%s'%uuid.uuid4().hex[:12]
+        descriptor = json.dumps({'dtype' : self.dtype.descr, 'rate' : self.rate}).encode('utf-8')
+        if _sharedHeaderDtype.itemsize + len(descriptor) > _sharedHeaderSize:
+            raise ValueError('Too many channels for the shared memory header')
+
+        self._sharedMemory = shared_memory.SharedMemory(name = name, create = True, size = _sharedHeaderSize + self.size * self.dtype.itemsize)
+        self.sharedName = self._sharedMemory.name
+        _createdSharedNames.add(self.sharedName)
+        self._header = np.ndarray((), dtype = _sharedHeaderDtype, buffer = self._sharedMemory.buf)
+        self._sharedMemory.buf[_sharedHeaderDtype.itemsize:_sharedHeaderDtype.itemsize + len(descriptor)] = descriptor
+        self.buffer = np.ndarray(self.size, dtype = self.dtype, buffer = self._sharedMemory.buf, offset = _sharedHeaderSize)
+        self.buffer[...] = 0
+
+        now = time.time()
+        self._header[()] = (_sharedMagic, 0, 0, self.size, now, now - time.monotonic(), 0., len(descriptor))
+
+    def close(self):
+        '''Stop the sampler and remove the shared memory block, the samples are kept in a private copy
+        '''
+        self.stop()
+        if self._sharedMemory is not None:
+            with self._lock:
+                self.buffer = self.buffer.copy()
+                self._header = None
+            self._sharedMemory.close()
+            self._sharedMemory.unlink()
+            _createdSharedNames.discard(self.sharedName)
+            self._sharedMemory = None
+
+    def running(self):
+        '''Returns True if the sampler thread is running
+        '''
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        nominalPeriod = 1. / self.rate
+        period = nominalPeriod
+        nextTime = time.monotonic()
+        while not self._stopEvent.is_set():
+            try:
+                with self.mps.priority(PRIORITY_BACKGROUND):
+                    values = self.mps.query_many(self.channels)
+            except ValueError: # reply missing or not a number
+                self.errors += 1
+            except Exception as e: # serial port failed or MPS closed, stop polling
+                self.error = e
+                return
+            else:
+                self._append(time.monotonic(), values)
+
+            # slow down while other commands need the serial link
+            if self.mps.foreground_busy(period):
+                period = min(2. * period, max(nominalPeriod, self.maxBackoffPeriod))
+                self.backoffs += 1
+            else:
+                period = max(period / 2., nominalPeriod)
+
+            nextTime += period
+            wait = nextTime - time.monotonic()
+            if wait > 0:
+                self._stopEvent.wait(wait)
+            else: # sampler fell behind, do not try to catch up
+                nextTime = time.monotonic()
+
+    def _append(self, timestamp, values):
+        with self._lock:
+            header = self._header
+            if header is not None:
+                header['sequence'] += 1
+            self.buffer[self.count % self.size] = (timestamp,) + tuple(values)
+            self.count += 1
+            if header is not None:
+                header['count'] = self.count
+                header['lastTime'] = timestamp
+                header['sequence'] += 1
+
+    def _segments(self):
+        '''Return the valid part of the ring buffer as two views in chronological order
+        '''
+        return _ringSegments(self.buffer, self.count)
+
+    def snapshot(self):
+        '''Return a copy of all samples in the ring buffer
+
+        Returns:
+            numpy.ndarray: structured array of samples in chronological order
+        '''
+        with self._lock:
+            return np.concatenate(self._segments())
+
+    def latest(self, n = 1):
+        '''Return a copy of the latest n samples
+
+        Args:
+            n (int): number of samples
+
+        Returns:
+            numpy.ndarray: structured array of samples in chronological order
+        '''
+        with self._lock:
+            older, newer = self._segments()
+            if n <= len(newer):
+                return newer[len(newer) - n:].copy()
+            return np.concatenate((older[max(len(older) + len(newer) - n, 0):], newer))
+
+    def since(self, timestamp):
+        '''Return a copy of the samples acquired after timestamp
+
+        Only the samples after timestamp are copied, which makes this function suitable for reading new samples periodically.
+
+        Args:
+            timestamp (float): time.monotonic() value, e.g. the time of the last sample read previously
+
+        Returns:
+            numpy.ndarray: structured array of samples in chronological order
+
+        Example::
+
+            data = sampler.since(0)
+            # ...
+            newData = sampler.since(data['time'][-1])
+
+        '''
+        with self._lock:
+            older, newer = self._segments()
+            olderStart = np.searchsorted(older['time'], timestamp, side = 'right')
+            newerStart = np.searchsorted(newer['time'], timestamp, side = 'right')
+            if olderStart == len(older):
+                return newer[newerStart:].copy()
+            return np.concatenate((older[olderStart:], newer))
+
+
+class Stream:
+    '''Iterator over timestamped chunks of MPS channels acquired in a background thread
+
+    Each chunk is a NumPy structured array with a "time" field (time.monotonic() in seconds) and one field for each channel, like the samples of a Sampler. The channel 'systemstatus' adds the fields of systemStatusDtype. The next chunk is acquired while the consumer processes the previous one. In thread-safe mode one query is kept in flight, so the conversion of a reply overlaps the serial round trip of the next query.
+
+    At most maxChunks chunks are queued. If the consumer is slower than the acquisition, polling pauses until a chunk is consumed (counted in stalls), so the memory used is bounded and no samples are dropped between chunks except for the pause.
+
+    Args:
+        mps (MPS): MPS instance to poll
+        channels (tuple): Query names of the channels, e.g. 'rxpowermv', 'txpowermv', 'amptemp', 'power', 'freq', 'systemstatus'
+        rate (None, float): Target sample rate in Hz. If None, sample as fast as possible.
+        chunk (int): Number of samples in each chunk
+        maxChunks (int): Number of chunks queued for the consumer
+
+    Example::
+
+        with mps.stream(channels = ('rxpowermv', 'txpowermv'), rate = 50, chunk = 100) as stream:
+            for data in stream:
+                print(data['time'][-1], data['rxpowermv'].mean())
+
+    '''
+    def __init__(self, mps, channels = ('rxpowermv',), rate = None, chunk = 100, maxChunks = 4):
+        names = _queryNames(channels)
+        if 'rfsweepdata' in names:
+            raise ValueError('rfsweepdata cannot be streamed as a channel')
+        if rate is not None and rate <= 0:
+            raise ValueError('Sample rate must be greater than 0 Hz')
+        if chunk < 1:
+            raise ValueError('Chunk must contain at least 1 sample')
+
+        fields = [('time', float)]
+        for channel in names:
+            if channel == 'systemstatus':
+                fields += [(name, systemStatusDtype.fields[name][0]) for name in systemStatusDtype.names]
+            else:
+                fields.append((channel, float))
+        fieldNames = [name for name, fieldType in fields]
+        for name in fieldNames:
+            if fieldNames.count(name) > 1:
+                raise ValueError('Channel %s is given twice or is part of systemstatus'%name)
+
+        self.mps = mps
+        self.channels = tuple(names)
+        self.rate = None if rate is None else float(rate)
+        self.chunk = int(chunk)
+        self.dtype = np.dtype(fields)
+        self.count = 0 # number of samples acquired
+        self.errors = 0 # number of polls with invalid replies
+        self.stalls = 0 # number of times polling paused for the consumer
+
+        self._queue = queue.Queue(maxsize = maxChunks)
+        self._stopEvent = threading.Event() # end of the acquisition
+        self._closed = False # queued chunks are discarded
+        self._ended = False
+        self._thread = threading.Thread(target = self._run, name = 'MPS Stream', daemon = True)
+        self._thread.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not (self._closed or self._ended):
+            try:
+                item = self._queue.get(timeout = 0.1)
+            except queue.Empty:
+                if not self._thread.is_alive() and self._queue.empty():
+                    break
+                continue
+            if item is None: # end of the acquisition
+                break
+            if isinstance(item, Exception):
+                self.close()
+                raise item
+            return item
+        self._ended = True
+        raise StopIteration
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stop(self):
+        '''Stop the acquisition, the iteration continues with the queued chunks and the last partial chunk
+        '''
+        self._stopEvent.set()
+
+    def close(self):
+        '''Stop the acquisition, chunks which were not consumed are discarded
+        '''
+        self._closed = True
+        self._stopEvent.set()
+        while self._thread.is_alive():
+            try: # unblock the acquisition thread if it waits for the consumer
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._thread.join(0.01)
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+    def _put(self, item):
+        '''Queue item for the consumer, return False if the stream was closed meanwhile
+        '''
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.stalls += 1
+        while not self._closed:
+            try:
+                self._queue.put(item, timeout = 0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _replies(self, commands):
+        '''Generate the replies of successive polls, keeping one poll in flight in thread-safe mode
+        '''
+        with self.mps.priority(PRIORITY_BACKGROUND):
+            pipelined = self.rate is None and self.mps._ioQueue is not None
+            future = self.mps.submit(commands, recv = True) if pipelined else None
+            while not self._stopEvent.is_set():
+                if future is None:
+                    yield self.mps.send_commands(commands, recv = True)
+                    continue
+                nextFuture = self.mps.submit(commands, recv = True)
+                yield future.result()
+                future = nextFuture
+
+    def _convert(self, replies):
+        '''Return the values of one sample from the replies
+        '''
+        values = ()
+        for channel, reply in zip(self.channels, replies):
+            if channel == 'systemstatus':
+                values += SystemStatus.parse(reply).astuple()
+            else:
+                values += (self.mps._convert(channel, reply),)
+        if len(values) != len(self.dtype.names) - 1:
+            raise ValueError('Reply missing')
+        return values
+
+    def _run(self):
+        commands = ['%s?'%channel for channel in self.channels]
+        period = 0. if self.rate is None else 1. / self.rate
+        data = np.zeros(self.chunk, dtype = self.dtype)
+        index = 0
+        nextTime = time.monotonic()
+        try:
+            for replies in self._replies(commands):
+                timestamp = time.monotonic()
+                try:
+                    values = self._convert(replies)
+                except ValueError: # reply missing or not a number
+                    self.errors += 1
+                else:
+                    data[index] = (timestamp,) + values
+                    index += 1
+                    self.count += 1
+                    if index == self.chunk:
+                        if not self._put(data):
+                            return
+                        data = np.zeros(self.chunk, dtype = self.dtype)
+                        index = 0
+                        nextTime = max(nextTime, time.monotonic() - period) # do not catch up after a stall
+
+                if period:
+                    nextTime += period
+                    wait = nextTime - time.monotonic()
+                    if wait > 0:
+                        self._stopEvent.wait(wait)
+                    else:
+                        nextTime = time.monotonic()
+        except Exception as e:
+            self._put(e)
+            return
+
+        if index and not self._put(data[:index]):
+            return
+        self._put(None)
+
+
+class SampleReader:
+    '''Read the samples of a Sampler in shared memory from another process
+
+    The reader maps the ring buffer of the Sampler and does not access the MPS. segments() returns NumPy views of the samples without copying. latest() and since() return copies which are consistent with the writer.
+
+    Args:
+        name (str): Shared memory name of the sampler, see Sampler.sharedName
+
+    Attributes:
+        buffer (numpy.ndarray): View of the complete ring buffer
+        clockOffset (float): Add to the sample times to get time.time() values
+
+    Example::
+
+        # acquisition process
+        sampler = mps.sampler(channels = ('rxpowermv', 'txpowermv', 'amptemp'), rate = 20, shared = 'mps_telemetry')
+
+        # other processes
+        reader = pyB12MPS.SampleReader('mps_telemetry')
+        sequence = reader.wait()
+        print(reader.latest()['rxpowermv'])
+
+    '''
+    def __init__(self, name):
+        self._sharedMemory = _attachSharedMemory(name)
+        self._header = np.ndarray((), dtype = _sharedHeaderDtype, buffer = self._sharedMemory.buf)
+        if self._header['magic'] != _sharedMagic:
+            self.close()
+            raise ValueError('%s is not a pyB12MPS sample buffer'%name)
+        descriptorStart = _sharedHeaderDtype.itemsize
+        descriptor = json.loads(bytes(self._sharedMemory.buf[descriptorStart:descriptorStart + int(self._header['descriptorLength'])]).decode('utf-8'))
+
+        self.name = name
+        self.dtype = np.dtype([tuple(field) for field in descriptor['dtype']])
+        self.channels = self.dtype.names[1:]
+        self.rate = descriptor['rate']
+        self.size = int(self._header['size'])
+        self.startTime = float(self._header['startTime'])
+        self.clockOffset = float(self._header['clockOffset'])
+        self.buffer = np.ndarray(self.size, dtype = self.dtype, buffer = self._sharedMemory.buf, offset = _sharedHeaderSize)
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    @property
+    def count(self):
+        '''Total number of samples written by the sampler
+        '''
+        return int(self._header['count'])
+
+    @property
+    def sequence(self):
+        '''Sequence number of the buffer, changes with every sample and is odd while a sample is written
+        '''
+        return int(self._header['sequence'])
+
+    def wait(self, sequence = None, timeout = None, pollInterval = 0.001):
+        '''Wait until a new sample is written
+
+        Args:
+            sequence (None, int): Wait until the sequence number differs from this value, by default the current sequence number
+            timeout (None, float): Maximum time to wait in s
+            pollInterval (float): Interval in s to check the sequence number
+
+        Returns:
+            int: sequence number after the new sample or the last sequence number on timeout
+        '''
+        if sequence is None:
+            sequence = self.sequence
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = self.sequence
+            if current != sequence and current % 2 == 0:
+                return current
+            if deadline is not None and time.monotonic() >= deadline:
+                return current
+            time.sleep(pollInterval)
+
+    def segments(self):
+        '''Return the valid samples as two views of the ring buffer in chronological order without copying
+
+        Samples in the views are overwritten when the sampler wraps around the ring buffer. Compare the sequence number before and after processing the views, or use latest() and since() for consistent copies.
+
+        Returns:
+            tuple: older and newer numpy.ndarray views
+        '''
+        return _ringSegments(self.buffer, self.count)
+
+    def _consistent(self, function):
+        '''Run function on the segments until no sample was written meanwhile
+        '''
+        while True:
+            sequence = self.sequence
+            if sequence % 2:
+                time.sleep(0)
+                continue
+            result = function(*self.segments())
+            if self.sequence == sequence:
+                return result
+
+    def latest(self, n = 1):
+        '''Return a copy of the latest n samples, see Sampler.latest
+        '''
+        def copy(older, newer):
+            if n <= len(newer):
+                return newer[len(newer) - n:].copy()
+            return np.concatenate((older[max(len(older) + len(newer) - n, 0):], newer))
+        return self._consistent(copy)
+
+    def since(self, timestamp):
+        '''Return a copy of the samples acquired after timestamp, see Sampler.since
+        '''
+        def copy(older, newer):
+            olderStart = np.searchsorted(older['time'], timestamp, side = 'right')
+            newerStart = np.searchsorted(newer['time'], timestamp, side = 'right')
+            if olderStart == len(older):
+                return newer[newerStart:].copy()
+            return np.concatenate((older[olderStart:], newer))
+        return self._consistent(copy)
+
+    def close(self):
+        '''Unmap the shared memory, views returned by segments() must be deleted before
+        '''
+        self.buffer = None
+        self._header = None
+        self._sharedMemory.close()
@@ -0,0 +1,408 @@
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+import time
+
+from .mps import MPS, PRIORITY_SAFETY, PRIORITY_BACKGROUND
+
+defaultAddress = ('localhost', 5212)
+
+
+def _encodeLine(message):
+    return (json.dumps(message) + '\n').encode('utf-8')
+
+
+def _removeSocket(path):
+    '''Remove a stale Unix socket, raise FileExistsError if path is another kind of file
+    '''
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError('%s exists and is not a socket'%path)
+    os.remove(path)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    '''Serve the requests of one client connection, see MPSServer for the protocol
+    '''
+    def handle(self):
+        server = self.server.mpsServer
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                self.wfile.write(_encodeLine({'error' : 'Invalid request'}))
+                continue
+
+            if request.get('subscribe'):
+                server._subscribe(self.connection)
+                try:
+                    while self.rfile.readline(): # wait until the client closes the connection
+                        pass
+                finally:
+                    server._unsubscribe(self.connection)
+                return
+
+            commands = request.get('commands', [])
+            recv = request.get('recv', [False] * len(commands))
+            if commands == ['_stop_']:
+                self.wfile.write(_encodeLine({'replies' : []}))
+                threading.Thread(target = server.shutdown, daemon = True).start()
+                return
+
+            try:
+                replies = server.request(commands, recv, request.get('priority'))
+            except Exception as e:
+                reply = {'error' : '%s: %s'%(type(e).__name__, e)}
+            else:
+                reply = {'replies' : [reply.decode('latin-1') for reply in replies]}
+            self.wfile.write(_encodeLine(reply))
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+class MPSServer:
+    '''Local server which shares one MPS connection among many client processes
+
+    The server owns the MPS and accepts any number of MPSClient connections over TCP on localhost or a Unix socket. Requests of all clients are sent to the MPS one after another. Identical queries which are in flight at the same time, e.g. several clients polling systemstatus, are sent to the MPS once and all clients receive the same reply.
+
+    Telemetry channels are sampled once by the server with background priority and broadcast to all subscribed clients, see MPSClient.subscribe. Sampling stops while no client is subscribed.
+
+    Each client request is one line of JSON, {"commands" : [...], "recv" : [...], "priority" : 1}, answered by one line {"replies" : [...]} or {"error" : "..."}. The request {"subscribe" : true} turns the connection into a telemetry stream of one JSON line per sample. The command '_stop_' stops the server.
+
+    Args:
+        mps (MPS): Connected MPS, e.g. MPS(threadSafe = True) to serve safety commands first
+        address (tuple, str): (host, port) to listen on TCP, or the path of a Unix socket. Port 0 selects a free port. A stale socket at the path is replaced, any other file raises FileExistsError.
+        channels (tuple): Query names of the telemetry channels
+        rate (float): Telemetry sample rate in Hz
+
+    Example::
+
+        mps = pyB12MPS.MPS(threadSafe = True)
+        server = pyB12MPS.MPSServer(mps)
+        server.serve_forever() # until a client sends '_stop_'
+
+        # other processes
+        mps = pyB12MPS.MPSClient()
+        mps.freq(9.5)
+
+    The server can also be started from a terminal::
+
+        python -m pyB12MPS.server --port COM3
+
+    '''
+    def __init__(self, mps, address = defaultAddress, channels = ('rxpowermv', 'txpowermv', 'amptemp'), rate = 10.):
+        self.mps = mps
+        self.channels = tuple(channels)
+        self.rate = float(rate)
+        self.requests = 0 # number of client requests
+        self.coalesced = 0 # number of requests answered by the reply to an identical request in flight
+
+        if isinstance(address, str):
+            _removeSocket(address)
+            self._server = _UnixServer(address, _RequestHandler)
+        else:
+            self._server = _TCPServer(tuple(address), _RequestHandler)
+        self._server.mpsServer = self
+        self.address = self._server.server_address
+
+        self._lock = threading.Lock()
+        self._inFlight = {} # commands to Future of the reply
+        self._subscribers = []
+        self._broadcastThread = None
+        self._stopEvent = threading.Event()
+        self._thread = None
+
+    def serve_forever(self):
+        '''Serve clients until shutdown() is called or a client sends '_stop_'
+        '''
+        try:
+            self._server.serve_forever()
+        finally:
+            self._close()
+
+    def start(self):
+        '''Serve clients in a background thread
+
+        Returns:
+            tuple, str: address the server listens on
+        '''
+        self._thread = threading.Thread(target = self.serve_forever, name = 'MPS Server', daemon = True)
+        self._thread.start()
+        return self.address
+
+    def shutdown(self):
+        '''Stop the server, the MPS connection is not closed
+        '''
+        self._server.shutdown()
+        if self._thread is not None and threading.current_thread() is not self._thread:
+            self._thread.join()
+
+    def _close(self):
+        self._stopEvent.set()
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+            broadcastThread = self._broadcastThread
+        if broadcastThread is not None:
+            broadcastThread.join()
+        for connection in subscribers:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.close()
+        self._server.server_close()
+        if isinstance(self.address, str):
+            _removeSocket(self.address)
+
+    def request(self, commands, recv, priority = None):
+        '''Send commands of a client to the MPS
+
+        Requests of queries only are coalesced with an identical request in flight.
+
+        Args:
+            commands (list): string commands
+            recv (list): True for each command with a reply
+            priority (None, int): Priority class of the client, see MPS.priority
+
+        Returns:
+            list: bytes received, one for each command with recv True
+        '''
+        with self._lock:
+            self.requests += 1
+        if not commands or not all(recv):
+            return self._send(commands, recv, priority)
+
+        key = tuple(commands)
+        with self._lock:
+            future = self._inFlight.get(key)
+            sending = future is None
+            if sending:
+                future = concurrent.futures.Future()
+                self._inFlight[key] = future
+            else:
+                self.coalesced += 1
+        if sending:
+            try:
+                future.set_result(self._send(commands, recv, priority))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._inFlight[key]
+        return future.result()
+
+    def _send(self, commands, recv, priority):
+        if priority not in (PRIORITY_SAFETY, PRIORITY_BACKGROUND):
+            return self.mps.send_commands(commands, recv = recv, raw = True)
+        with self.mps.priority(priority):
+            return self.mps.send_commands(commands, recv = recv, raw = True)
+
+    def _subscribe(self, connection):
+        connection.settimeout(1.) # a stalled subscriber is dropped instead of blocking the others
+        with self._lock:
+            self._subscribers.append(connection)
+            if self._broadcastThread is None:
+                sampler = self.mps.sampler(channels = self.channels, rate = self.rate, size = max(int(10 * self.rate), 100))
+                self._broadcastThread = threading.Thread(target = self._broadcast, args = (sampler,), name = 'MPS Telemetry', daemon = True)
+                self._broadcastThread.start()
+
+    def _unsubscribe(self, connection):
+        with self._lock:
+            if connection in self._subscribers:
+                self._subscribers.remove(connection)
+
+    def _broadcast(self, sampler):
+        '''Send the new samples of the telemetry sampler to all subscribers
+
+        The sampler is stopped when the last subscriber disconnects, the next subscriber starts a new one.
+        '''
+        try:
+            lastTime = time.monotonic()
+            while not self._stopEvent.wait(1. / self.rate):
+                with self._lock:
+                    subscribers = list(self._subscribers)
+                    if not subscribers:
+                        self._broadcastThread = None
+                        return
+                data = sampler.since(lastTime)
+                if not len(data):
+                    continue
+                lastTime = data['time'][-1]
+                lines = b''.join(_encodeLine({name : float(sample[name]) for name in data.dtype.names}) for sample in data)
+                for connection in subscribers:
+                    try:
+                        connection.sendall(lines)
+                    except OSError:
+                        self._unsubscribe(connection)
+        finally:
+            sampler.stop()
+
+
+class _RequestPort:
+    '''Serial port interface of one request of an MPSClient, so that CommandStats times requests through the server like serial exchanges
+
+    The first read waits for the reply of the server, which contains the replies of all commands. The server strips the line endings, they are restored for non-empty replies, so empty replies count as timeouts.
+    '''
+    def __init__(self, client):
+        self.timeout = client.timeout
+        self._client = client
+        self._replies = None
+        self._reply = b''
+
+    def write(self, data):
+        self._client._write(data)
+
+    def read(self, size = 1):
+        if self._replies is None:
+            self._replies = collections.deque(reply + b'\n' if reply else reply for reply in self._client._replies())
+        if not self._reply and self._replies:
+            self._reply = self._replies.popleft()
+        data, self._reply = self._reply[:size], self._reply[size:]
+        return data
+
+    def readline(self):
+        data, self._reply = self._reply, b''
+        return data
+
+
+class MPSClient(MPS):
+    '''MPS connected through an MPSServer instead of a serial port
+
+    The client has the same methods as the MPS class, so scripts only need to replace MPS() with MPSClient(). Deleting the client does not turn off the MPS, which is shared with other clients.
+
+    Args:
+        address (tuple, str): (host, port) or Unix socket path of the MPSServer
+        timeout (float): Time in s to wait for the reply of the server
+
+    Example::
+
+        mps = pyB12MPS.MPSClient()
+
+        mps.freq(9.5)
+        print(mps.systemstatus())
+
+        for sample in mps.subscribe():
+            print(sample['time'], sample['rxpowermv'])
+
+    '''
+    _socket = None
+
+    def __init__(self, address = defaultAddress, timeout = 10.):
+        self.timeout = timeout
+        MPS.__init__(self, port = address)
+
+    def init(self, fastConnect = False, probeTimeout = 0.25, ser = None, bootTimeout = 30.):
+        '''Connect to the MPSServer
+        '''
+        print('Connecting to MPS server at %s'%(self.port,))
+        self.ser = None
+        self._socket = self._connect()
+        self._file = self._socket.makefile('rwb')
+
+    def _connect(self):
+        address = self.port
+        if isinstance(address, str):
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            address = tuple(address)
+            connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection.settimeout(self.timeout)
+        connection.connect(address)
+        return connection
+
+    def _exchange(self, commands, recv):
+        '''Send commands to the server and return the bytes received from the MPS
+        '''
+        request = {'commands' : list(commands), 'recv' : list(recv), 'priority' : self._command_priority(commands)}
+        if self.stats is not None:
+            return self.stats.exchange(_RequestPort(self), commands, recv, _encodeLine(request))
+        self._write(_encodeLine(request))
+        return self._replies()
+
+    def _write(self, line):
+        self._file.write(line)
+        self._file.flush()
+
+    def _replies(self):
+        '''Read the reply of the server to the last request
+        '''
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError('MPS server closed the connection')
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise RuntimeError('MPS server: %s'%reply['error'])
+        return [reply.encode('latin-1') for reply in reply['replies']]
+
+    def subscribe(self):
+        '''Receive the telemetry samples broadcast by the server
+
+        Returns:
+            generator: dict for each sample with 'time' (time.monotonic() of the server) and one value for each channel
+        '''
+        connection = self._connect()
+        try:
+            connection.settimeout(None)
+            connection.sendall(_encodeLine({'subscribe' : True}))
+            for line in connection.makefile('rb'):
+                yield json.loads(line)
+        finally:
+            connection.close()
+
+    def flush(self):
+        '''Nothing to flush, the server flushes the serial buffer before each request
+        '''
+        pass
+
+    def close(self):
+        '''Close the connection to the server
+        '''
+        if self._socket is not None:
+            self._file.close()
+            self._socket.close()
+            self._socket = None
+
+    def __del__(self):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Share one MPS among many client processes')
+    parser.add_argument('--port', default = None, help = 'serial port of the MPS, detected by default')
+    parser.add_argument('--fast-connect', action = 'store_true', help = 'do not wait for the MPS to boot if it is running')
+    parser.add_argument('--host', default = defaultAddress[0], help = 'host to listen on')
+    parser.add_argument('--server-port', type = int, default = defaultAddress[1], help = 'TCP port to listen on')
+    parser.add_argument('--unix', default = None, help = 'listen on this Unix socket path instead of TCP')
+    parser.add_argument('--rate', type = float, default = 10., help = 'telemetry sample rate in Hz')
+    args = parser.parse_args()
+
+    mps = MPS(port = args.port, fastConnect = args.fast_connect, threadSafe = True)
+    server = MPSServer(mps, address = args.unix or (args.host, args.server_port), rate = args.rate)
+    print('MPS server listening on %s'%(server.address,))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mps.close()
+
+if __name__ == '__main__':
+    main()
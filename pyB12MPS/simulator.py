@@ -0,0 +1,339 @@
+import numpy as np
+import os
+import threading
+import time
+
+
+class SimulatedMPS:
+    '''Simulated MPS which speaks the serial protocol of the MPS
+
+    The simulator behaves like a pySerial port and can be passed to the MPS class with the ser argument. On POSIX systems it can also be served on a pseudo terminal with open_pty(), so that any program can connect to it like to a real MPS.
+
+    The Rx diode voltage follows a Lorentzian resonance dip of the microwave cavity. Replies become available after the latency of the command, commands are processed one after another like by the MPS firmware.
+
+    Args:
+        latency (float, dict): Time in s for the MPS to process a command. A dict maps command names (e.g. 'systemstatus') to latencies, the key 'default' is used for all other commands.
+        booted (bool): If False, the simulator prints the boot messages after bootTime and ignores commands until "System Ready"
+        bootTime (float): Boot time in s if booted is False
+        resonance (float): Center frequency of the cavity resonance in GHz
+        q (float): Quality factor of the cavity resonance
+        dipDepth (float): Relative depth of the resonance dip between 0 and 1
+        rxBaseline (float): Rx diode voltage off resonance at 0 dBm in mV
+        noise (float): Standard deviation of the noise of the Rx and Tx diode readings in mV
+        seed (None, int): Seed of the noise
+
+    Example::
+
+        mps = pyB12MPS.MPS(ser = pyB12MPS.SimulatedMPS(), fastConnect = True)
+
+        simulator = pyB12MPS.SimulatedMPS(latency = {'default' : 0.002, 'systemstatus' : 0.01})
+        port = simulator.open_pty() # e.g. '/dev/pts/3'
+        mps = pyB12MPS.MPS(port = port, fastConnect = True)
+
+    '''
+    def __init__(self, latency = 0., booted = True, bootTime = 1., resonance = 9.55, q = 2000., dipDepth = 0.9, rxBaseline = 500., noise = 0., seed = None):
+        if not isinstance(latency, dict):
+            latency = {'default' : latency}
+        self.latency = latency
+        self.resonance = resonance
+        self.q = q
+        self.dipDepth = dipDepth
+        self.rxBaseline = rxBaseline
+        self.noise = noise
+        self._rng = np.random.default_rng(seed)
+
+        # pySerial attributes
+        self.port = 'simulated'
+        self.baudrate = 115200
+        self.timeout = 1.
+        self.dtr = True
+        self.is_open = True
+
+        # Parameters in the units of the serial protocol (kHz, tenth dBm, ...)
+        self.state = {
+            'ampgain' : 0,
+            'ampstatus' : 1,
+            'amptemp' : 250,
+            'debug' : 0,
+            'freq' : 9500000,
+            'lockdelay' : 100,
+            'lockstatus' : 0,
+            'lockstep' : 20,
+            'power' : 0,
+            'rfstatus' : 0,
+            'rfsweepdwelltime' : 50,
+            'rfsweepinitialdwelltime' : 100,
+            'rfsweepnpts' : 100,
+            'rfsweeppower' : 100,
+            'rfsweepsw' : 1,
+            'screen' : 0,
+            'triglength' : 100,
+            'wgstatus' : 0,
+            }
+        self.info = {
+            'firmware' : '1.0 (simulated)',
+            'id' : 'Bridge12 MPS',
+            'rxdiodesn' : 'SIMRX0001',
+            'serial' : 'SIM0001',
+            'txdiodesn' : 'SIMTX0001',
+            }
+        self.rfSweepData = np.zeros(0, dtype = int)
+
+        self._input = b''
+        self._output = [] # list of [time available, bytes]
+        self._busyUntil = time.monotonic()
+        self._lock = threading.Condition()
+        self._ptyThread = None
+        self._ptyMaster = None
+        self._ptySlave = None
+
+        if booted:
+            self._readyTime = time.monotonic()
+        else:
+            self._readyTime = time.monotonic() + bootTime
+            for line in ('Bridge12 MPS', 'Synthesizer detected', 'System Ready'):
+                self._output.append([self._readyTime, (line + '\r\n').encode('utf-8')])
+
+    # ------------------------------------------------------------------
+    # Model of the MPS
+
+    def rx(self, freq = None, power = None):
+        '''Rx diode voltage in mV of the resonance model
+
+        Args:
+            freq (None, float, numpy.ndarray): Frequency in GHz, by default the current frequency
+            power (None, float): Power in dBm, by default the current power
+
+        Returns:
+            float, numpy.ndarray: Rx diode voltage in mV
+        '''
+        if freq is None:
+            freq = self.state['freq'] / 1.e6
+        if power is None:
+            power = self.state['power'] / 10.
+        halfWidth = self.resonance / (2. * self.q)
+        reflection = 1. - self.dipDepth / (1. + ((np.asarray(freq) - self.resonance) / halfWidth)**2)
+        return self.rxBaseline * 10**(power / 10.) * reflection
+
+    def _rx_reading(self):
+        rxVoltage = 0.
+        if self.state['rfstatus'] == 1:
+            rxVoltage = self.rx()
+        return max(rxVoltage + self._rng.normal(0., self.noise) if self.noise else rxVoltage, 0.)
+
+    def _tx_reading(self):
+        txVoltage = 0.
+        if self.state['rfstatus'] == 1:
+            txVoltage = self.rxBaseline * 10**(self._tx_dbm() / 10.)
+        return max(txVoltage + self._rng.normal(0., self.noise) if self.noise else txVoltage, 0.)
+
+    def _tx_dbm(self):
+        '''Delivered power in dBm, differs from the set power by the amplifier gain and a frequency slope'''
+        return self.state['power'] / 10. + self.state['ampgain'] / 10. - 2. * (self.state['freq'] / 1.e6 - 9.5)
+
+    def _do_sweep(self):
+        width = {0 : 250., 1 : 100., 2 : 50., 3 : 10.}[self.state['rfsweepsw']] / 1.e3
+        center = self.state['freq'] / 1.e6
+        freqs = np.linspace(center - width / 2., center + width / 2., self.state['rfsweepnpts'])
+        rxVoltage = self.rx(freqs, self.state['rfsweeppower'] / 10.)
+        if self.noise:
+            rxVoltage = rxVoltage + self._rng.normal(0., self.noise, len(freqs))
+        self.rfSweepData = np.clip(rxVoltage, 0, None).astype(int)
+
+    def _tenth(self, value):
+        return '%i'%int(round(value * 10.))
+
+    def process(self, command):
+        '''Process one command line and return the reply, None if the command has no reply
+
+        Args:
+            command (str): command without line ending, e.g. 'freq?'
+
+        Returns:
+            None, str: reply without line ending
+        '''
+        name, _, value = command.strip().partition(' ')
+        if name.endswith('?'):
+            name = name[:-1]
+            if name in self.state:
+                return '%i'%self.state[name]
+            if name in self.info:
+                return self.info[name]
+            if name == 'rxpowermv':
+                return self._tenth(self._rx_reading())
+            if name == 'txpowermv':
+                return self._tenth(self._tx_reading())
+            if name == 'rxpowerdbm':
+                return self._tenth(10. * np.log10(max(self._rx_reading(), 1.e-3) / self.rxBaseline))
+            if name == 'txpowerdbm':
+                return self._tenth(10. * np.log10(max(self._tx_reading(), 1.e-3) / self.rxBaseline))
+            if name == 'systemstatus':
+                status = [('freq', self.state['freq']), ('power', self.state['power']),
+                        ('rxpowermv', self._tenth(self._rx_reading())), ('txpowermv', self._tenth(self._tx_reading()))]
+                status += [(key, self.state[key]) for key in ('rfstatus', 'wgstatus', 'ampstatus', 'amptemp', 'lockstatus', 'screen')]
+                return ','.join('%s:%s'%item for item in status)
+            if name == 'rfsweepdata':
+                return ','.join('%i'%value for value in self.rfSweepData)
+            if name == 'rfsweepdosweep':
+                self._do_sweep()
+            return None
+
+        if name in self.state and value:
+            try:
+                value = int(round(float(value)))
+            except ValueError:
+                return None
+            if name == 'rfstatus' and value == 1 and self.state['wgstatus'] != 1:
+                return None # RF output requires DNP mode
+            if name == 'lockstatus' and value == 1 and self.state['screen'] != 1:
+                return None # lock requires operate screen
+            if name == 'wgstatus' and value == 0:
+                self.state['rfstatus'] = 0
+            self.state[name] = value
+        return None
+
+    # ------------------------------------------------------------------
+    # pySerial interface
+
+    def _command_latency(self, command):
+        name = command.strip().split(' ')[0].rstrip('?')
+        return self.latency.get(name, self.latency.get('default', 0.))
+
+    def write(self, data):
+        '''Write bytes to the simulated MPS'''
+        with self._lock:
+            self._input += bytes(data)
+            now = time.monotonic()
+            while b'\n' in self._input:
+                line, self._input = self._input.split(b'\n', 1)
+                command = line.decode('utf-8', 'replace').strip()
+                if now < self._readyTime or not command: # still booting
+                    continue
+                self._busyUntil = max(self._busyUntil, now) + self._command_latency(command)
+                reply = self.process(command)
+                if reply is not None:
+                    self._output.append([self._busyUntil, (reply + '\r\n').encode('utf-8')])
+            self._lock.notify_all()
+        return len(data)
+
+    def _available(self):
+        '''Return the bytes available now'''
+        now = time.monotonic()
+        data = b''
+        while self._output and self._output[0][0] <= now:
+            data += self._output.pop(0)[1]
+        if data:
+            self._output.insert(0, [now, data])
+        return data
+
+    def _next_time(self):
+        return self._output[0][0] if self._output else None
+
+    @property
+    def in_waiting(self):
+        with self._lock:
+            return len(self._available())
+
+    def _read(self, size = None, terminator = None):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        data = b''
+        with self._lock:
+            while True:
+                available = self._available()
+                if available:
+                    self._output.pop(0)
+                    end = len(available)
+                    if terminator is not None and terminator in available:
+                        end = available.index(terminator) + len(terminator)
+                    if size is not None:
+                        end = min(end, size - len(data))
+                    data += available[:end]
+                    if available[end:]:
+                        self._output.insert(0, [time.monotonic(), available[end:]])
+                    if (size is not None and len(data) >= size) or (terminator is not None and data.endswith(terminator)):
+                        return data
+
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    return data
+                wait = None if deadline is None else deadline - now
+                nextTime = self._next_time()
+                if nextTime is not None:
+                    wait = max(nextTime - now, 0.) if wait is None else min(wait, max(nextTime - now, 0.))
+                self._lock.wait(wait)
+
+    def read(self, size = 1):
+        '''Read size bytes, returns fewer bytes on timeout'''
+        return self._read(size = size)
+
+    def readline(self):
+        '''Read one line, returns the partial line on timeout'''
+        return self._read(terminator = b'\n')
+
+    def reset_input_buffer(self):
+        '''Discard the bytes which are available to read'''
+        with self._lock:
+            self._available()
+            if self._output and self._output[0][0] <= time.monotonic():
+                self._output.pop(0)
+
+    def flush(self):
+        pass
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        '''Close the simulated port and stop serving the pseudo terminal'''
+        self.is_open = False
+        if self._ptyMaster is not None:
+            master, self._ptyMaster = self._ptyMaster, None
+            self._ptyThread.join()
+            os.close(master)
+        if self._ptySlave is not None:
+            slave, self._ptySlave = self._ptySlave, None
+            os.close(slave)
+
+    # ------------------------------------------------------------------
+    # Pseudo terminal
+
+    def open_pty(self):
+        '''Serve the simulated MPS on a pseudo terminal (POSIX only)
+
+        Returns:
+            str: device path of the pseudo terminal, use as port of the MPS class
+        '''
+        import pty
+        import tty
+
+        master, slave = pty.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        self._ptyMaster = master
+        self._ptySlave = slave
+        self._ptyThread = threading.Thread(target = self._serve_pty, name = 'Simulated MPS', daemon = True)
+        self._ptyThread.start()
+        return os.ttyname(slave)
+
+    def _serve_pty(self):
+        import select
+
+        master = self._ptyMaster
+        while self._ptyMaster is not None:
+            with self._lock:
+                data = self._available()
+                if data:
+                    self._output.pop(0)
+                nextTime = self._next_time()
+            if data:
+                os.write(master, data)
+
+            wait = 0.05
+            if nextTime is not None:
+                wait = min(wait, max(nextTime - time.monotonic(), 0.))
+            readable, _, _ = select.select([master], [], [], wait)
+            if readable:
+                try:
+                    self.write(os.read(master, 4096))
+                except OSError:
+                    break
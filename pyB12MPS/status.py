@@ -0,0 +1,133 @@
+import numpy as np
+import re
+
+# Fields of the systemstatus? reply in the order sent by the MPS
+systemStatusFields = ('freq', 'power', 'rxpowermv', 'txpowermv', 'rfstatus', 'wgstatus', 'ampstatus', 'amptemp', 'lockstatus', 'screen')
+
+# One system status as a row of a NumPy structured array, 29 bytes (packed, no padding)
+systemStatusDtype = np.dtype([
+    ('freq', '<f8'), # GHz
+    ('power', '<f4'), # dBm
+    ('rxpowermv', '<f4'), # mV
+    ('txpowermv', '<f4'), # mV
+    ('rfstatus', 'u1'),
+    ('wgstatus', 'u1'),
+    ('ampstatus', 'u1'),
+    ('amptemp', '<f4'), # degrees C
+    ('lockstatus', 'u1'),
+    ('screen', 'u1'),
+    ])
+
+# Factors from the units of the serial protocol (kHz, tenth dBm, tenth mV, tenth degrees C)
+_statusScales = np.array([1.e-6, 0.1, 0.1, 0.1, 1., 1., 1., 0.1, 1., 1.])
+
+_statusPattern = re.compile(','.join(r'%s:(-?\d+(?:\.\d*)?)'%name for name in systemStatusFields))
+
+
+def _statusValues(reply):
+    '''Return the 10 values of a systemstatus reply as strings in the order of systemStatusFields
+    '''
+    match = _statusPattern.fullmatch(reply.strip())
+    if match is not None:
+        return match.groups()
+
+    # fields in a different order or additional fields
+    items = dict(item.partition(':')[::2] for item in reply.strip().split(','))
+    try:
+        return tuple(items[name] for name in systemStatusFields)
+    except KeyError as e:
+        raise ValueError('System status reply is missing %s'%e) from None
+
+
+class SystemStatus:
+    '''Compact record of the MPS system status
+
+    The fields are attributes in the units of the MPS class: freq in GHz, power in dBm, rxpowermv and txpowermv in mV, amptemp in degrees C and the status flags as int.
+
+    Example::
+
+        status = mps.systemstatus(record = True)
+        print(status.freq, status.rxpowermv)
+
+        status = pyB12MPS.SystemStatus.parse('freq:9500000,power:100,rxpowermv:3501,txpowermv:2543,rfstatus:1,wgstatus:1,ampstatus:1,amptemp:253,lockstatus:0,screen:1')
+
+    '''
+    __slots__ = systemStatusFields
+
+    def __init__(self, freq, power, rxpowermv, txpowermv, rfstatus, wgstatus, ampstatus, amptemp, lockstatus, screen):
+        self.freq = freq
+        self.power = power
+        self.rxpowermv = rxpowermv
+        self.txpowermv = txpowermv
+        self.rfstatus = rfstatus
+        self.wgstatus = wgstatus
+        self.ampstatus = ampstatus
+        self.amptemp = amptemp
+        self.lockstatus = lockstatus
+        self.screen = screen
+
+    @classmethod
+    def parse(cls, reply):
+        '''Convert the reply of the systemstatus? query
+
+        Args:
+            reply (str): reply string of the MPS, e.g. "freq:9500000,power:100,..."
+
+        Returns:
+            SystemStatus: system status
+        '''
+        freq, power, rxpowermv, txpowermv, rfstatus, wgstatus, ampstatus, amptemp, lockstatus, screen = _statusValues(reply)
+        return cls(float(freq) / 1.e6, float(power) / 10., float(rxpowermv) / 10., float(txpowermv) / 10.,
+                int(rfstatus), int(wgstatus), int(ampstatus), float(amptemp) / 10., int(lockstatus), int(screen))
+
+    def asdict(self):
+        '''Returns dictionary of the system status
+        '''
+        return {name : getattr(self, name) for name in systemStatusFields}
+
+    def astuple(self):
+        '''Returns the fields as a tuple in the order of systemStatusDtype, e.g. to fill a structured array
+        '''
+        return tuple(getattr(self, name) for name in systemStatusFields)
+
+    def __eq__(self, other):
+        if not isinstance(other, SystemStatus):
+            return NotImplemented
+        return self.astuple() == other.astuple()
+
+    def __repr__(self):
+        return 'SystemStatus(%s)'%', '.join('%s=%r'%(name, getattr(self, name)) for name in systemStatusFields)
+
+
+def parseSystemStatus(replies, out = None, start = 0):
+    '''Convert many systemstatus? replies into a structured array
+
+    The values of all replies are converted together with vectorized NumPy operations.
+
+    Args:
+        replies (list): reply strings of the MPS
+        out (None, numpy.ndarray): Preallocated structured array with the fields of systemStatusDtype. Additional fields, e.g. a time field, are not changed.
+        start (int): Index of out of the first reply
+
+    Returns:
+        numpy.ndarray: rows of out (or a new array of systemStatusDtype) with the converted replies
+
+    Example::
+
+        log = np.zeros(10000, dtype = pyB12MPS.systemStatusDtype)
+        rows = pyB12MPS.parseSystemStatus(replies, out = log, start = count)
+        count += len(rows)
+
+    '''
+    if out is None:
+        out = np.zeros(len(replies), dtype = systemStatusDtype)
+    rows = out[start:start + len(replies)]
+    if len(rows) != len(replies):
+        raise ValueError('Structured array has %i rows after index %i, %i replies given'%(len(rows), start, len(replies)))
+    if not len(replies):
+        return rows
+
+    values = np.array([_statusValues(reply) for reply in replies], dtype = float) * _statusScales
+    for column, name in enumerate(systemStatusFields):
+        rows[name] = values[:, column]
+    return rows
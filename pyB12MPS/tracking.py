@@ -0,0 +1,361 @@
+import collections
+import functools
+import numpy as np
+import threading
+import time
+
+
+class FrequencyTracker:
+    '''Host-side loop which keeps the microwave frequency on the cavity resonance
+
+    Each update reads the Rx diode at the frequencies f - dither, f + dither and f, sent to the MPS in a single write. The vertex of the parabola through the three readings is the lock error, the frequency is moved by gain times the lock error. The dither is increased while the lock error is larger than the dither and decreased while it is much smaller, so the tracker follows fast drifts and keeps the modulation small when locked.
+
+    The firmware lock (lockstatus) is turned off when the tracker starts. The RF output must be on.
+
+    Args:
+        mps (MPS): MPS instance
+        dither (float): Initial dither in MHz
+        minDither (float): Minimum dither in MHz
+        maxDither (float): Maximum dither in MHz
+        gain (float): Fraction of the lock error corrected in each update
+        maxStep (float): Maximum frequency step of one update in MHz
+        settle (float): Time in s to wait after each frequency change before reading the Rx diode. If 0, the three readings of an update are sent in a single write.
+        interval (float): Time in s between updates
+
+    Attributes:
+        freq (float): Current center frequency in GHz
+        lockError (float): Lock error of the last update in MHz
+        updateRate (float): Updates per second
+        updates (int): Number of updates
+        errors (int): Number of updates with invalid replies
+
+    Example::
+
+        tracker = mps.tracker(dither = 0.5)
+
+        time.sleep(60)
+        print(tracker.freq, tracker.lockError, tracker.lockErrorRms(), tracker.updateRate)
+
+        tracker.stop()
+
+    '''
+    def __init__(self, mps, dither = 0.5, minDither = 0.05, maxDither = 2., gain = 0.7, maxStep = 1., settle = 0., interval = 0., history = 100):
+        if not 0. < minDither <= dither <= maxDither:
+            raise ValueError('Dither must be between minDither and maxDither and greater than 0')
+        if not 0. < gain <= 1.:
+            raise ValueError('Gain must be greater than 0 and at most 1')
+
+        self.mps = mps
+        self.dither = float(dither)
+        self.minDither = float(minDither)
+        self.maxDither = float(maxDither)
+        self.gain = float(gain)
+        self.maxStep = float(maxStep)
+        self.settle = float(settle)
+        self.interval = float(interval)
+
+        self.freq = None
+        self.lockError = 0.
+        self.updateRate = 0.
+        self.updates = 0
+        self.errors = 0
+        self._lockErrors = collections.deque(maxlen = history)
+
+        self._stopEvent = threading.Event()
+        self._thread = None
+
+    def start(self):
+        '''Turn off the firmware lock and start the tracker thread at the current frequency
+        '''
+        if self.running():
+            return
+        self.mps.lockstatus(0)
+        self.freq = self.mps.freq()
+        self._stopEvent.clear()
+        self._thread = threading.Thread(target = self._run, name = 'MPS Frequency Tracker', daemon = True)
+        self._thread.start()
+
+    def stop(self):
+        '''Stop the tracker thread, the frequency stays at the last center frequency
+        '''
+        self._stopEvent.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def running(self):
+        '''Returns True if the tracker thread is running
+        '''
+        return self._thread is not None and self._thread.is_alive()
+
+    def lockErrorRms(self):
+        '''Returns the RMS lock error in MHz of the recent updates
+        '''
+        if not self._lockErrors:
+            return 0.
+        return float(np.sqrt(np.mean(np.square(self._lockErrors))))
+
+    def _read(self, freqs):
+        '''Return the Rx diode voltages in mV at freqs in GHz
+        '''
+        freqCommands = ['freq %0.0f'%(freq * 1.e6) for freq in freqs]
+        convertRx = functools.partial(self.mps._convert, 'rxpowermv')
+        if not self.settle:
+            commands = []
+            for freqCommand in freqCommands:
+                commands += [freqCommand, 'rxpowermv?']
+            replies = self.mps.send_commands(commands, recv = [False, True] * len(freqCommands))
+        else:
+            replies = []
+            for freqCommand in freqCommands:
+                self.mps.send_command(freqCommand)
+                time.sleep(self.settle)
+                replies.append(self.mps.send_command('rxpowermv?', recv = True))
+        return [convertRx(reply) for reply in replies]
+
+    def _update(self, rxMinus, rxPlus, rxCenter):
+        '''Return the lock error in MHz and adapt the dither
+        '''
+        dither = self.dither
+        curvature = rxMinus - 2. * rxCenter + rxPlus
+        if curvature > 0:
+            lockError = np.clip(dither * (rxMinus - rxPlus) / (2. * curvature), -2. * dither, 2. * dither)
+        else: # not at a dip, step downhill
+            lockError = dither if rxPlus < rxMinus else -dither
+
+        if abs(lockError) > dither:
+            self.dither = min(dither * 1.5, self.maxDither)
+        elif abs(lockError) < dither / 4.:
+            self.dither = max(dither * 0.8, self.minDither)
+        return float(lockError)
+
+    def _run(self):
+        lastTime = time.monotonic()
+        try:
+            while not self._stopEvent.is_set():
+                dither = self.dither / 1.e3 # GHz
+                try:
+                    rxMinus, rxPlus, rxCenter = self._read([self.freq - dither, self.freq + dither, self.freq])
+                except ValueError: # reply missing or not a number
+                    self.errors += 1
+                    continue
+
+                self.lockError = self._update(rxMinus, rxPlus, rxCenter)
+                self._lockErrors.append(self.lockError)
+                step = np.clip(self.gain * self.lockError, -self.maxStep, self.maxStep)
+                self.freq = round(self.freq + step / 1.e3, 6)
+                self.updates += 1
+
+                now = time.monotonic()
+                rate = 1. / max(now - lastTime, 1.e-9)
+                self.updateRate = rate if self.updates == 1 else 0.9 * self.updateRate + 0.1 * rate
+                lastTime = now
+
+                if self.interval:
+                    self._stopEvent.wait(self.interval)
+        finally:
+            self.mps.freq(self.freq)
+
+
+# One entry of the DriftTracker history
+driftHistoryDtype = np.dtype([
+    ('time', '<f8'), # time.monotonic() in s
+    ('center', '<f8'), # estimated resonance frequency in GHz
+    ('q', '<f4'), # estimated quality factor
+    ('depth', '<f4'), # relative dip depth
+    ('duration', '<f4'), # duration of the mini-sweep in s
+    ])
+
+
+class DriftTracker:
+    '''Follow the drift of the cavity resonance with periodic mini-sweeps
+
+    Every period a mini-sweep of a few points around the current frequency is sent to the MPS in a single write, which ends at the center frequency again, so the experiment is only interrupted for one serial round trip. A parabola fitted to the mini-sweep gives a measurement of the resonance center, the curvature together with the off-resonance baseline gives the dip width and Q.
+
+    The center is updated incrementally with a Kalman filter: each measurement is weighted against the prediction, whose uncertainty grows with driftRate over time. Q and depth are exponentially averaged. Each update is added to a compact history ring buffer.
+
+    The number of points is reduced while a mini-sweep takes longer than budget, and the time between mini-sweeps is increased so that the mini-sweeps take at most maxDutyCycle of the time.
+
+    Args:
+        mps (MPS): MPS instance
+        span (float): Width of the mini-sweep in MHz
+        points (int): Number of points of the mini-sweep, at least 3
+        period (float): Time in s between mini-sweeps
+        maxDutyCycle (float): Maximum fraction of the time spent in mini-sweeps
+        budget (float): Target duration of a mini-sweep in s
+        driftRate (float): Expected drift of the resonance in MHz/s
+        centerNoise (float): Standard deviation of a center measurement in MHz
+        follow (bool): If True, the microwave frequency is set to the estimated center after each mini-sweep
+        smoothing (float): Weight of a new measurement in the average of Q and depth
+        history (int): Number of entries kept in the history
+
+    Attributes:
+        center (float): Estimated resonance frequency in GHz
+        centerError (float): Standard deviation of the center estimate in MHz
+        q (float): Estimated quality factor, nan until measured
+        depth (float): Estimated relative dip depth, nan until measured
+        baseline (float): Off-resonance Rx diode voltage in mV
+        sweeps (int): Number of mini-sweeps
+        rejected (int): Number of mini-sweeps without a dip
+
+    Example::
+
+        drift = mps.drifttracker(span = 1., points = 5, period = 5.)
+        # ... DNP experiment
+        data = drift.history()
+        plt.plot(data['time'], data['center'])
+        drift.stop()
+
+    '''
+    def __init__(self, mps, span = 1., points = 5, period = 10., maxDutyCycle = 0.01, budget = 0.05, driftRate = 0.01, centerNoise = 0.02, follow = True, smoothing = 0.2, history = 10000):
+        if points < 3:
+            raise ValueError('Mini-sweep must have at least 3 points')
+        if span <= 0 or period <= 0:
+            raise ValueError('Span and period must be greater than 0')
+        if not 0. < maxDutyCycle <= 1.:
+            raise ValueError('Duty cycle must be greater than 0 and at most 1')
+
+        self.mps = mps
+        self.span = float(span)
+        self.maxPoints = int(points)
+        self.points = int(points)
+        self.period = float(period)
+        self.maxDutyCycle = float(maxDutyCycle)
+        self.budget = float(budget)
+        self.driftRate = float(driftRate)
+        self.centerNoise = float(centerNoise)
+        self.follow = follow
+        self.smoothing = float(smoothing)
+
+        self.center = None
+        self.centerError = None
+        self.q = np.nan
+        self.depth = np.nan
+        self.baseline = None
+        self.sweeps = 0
+        self.rejected = 0
+        self.errors = 0
+
+        self._history = np.zeros(int(history), dtype = driftHistoryDtype)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._stopEvent = threading.Event()
+        self._thread = None
+        self._lastTime = None
+
+    def start(self):
+        '''Measure the baseline and start the mini-sweeps at the current frequency
+        '''
+        if self.running():
+            return
+        if self.center is None:
+            self.center = self.mps.freq()
+            self.centerError = self.span
+        self.baseline = self._baseline()
+        self._stopEvent.clear()
+        self._thread = threading.Thread(target = self._run, name = 'MPS Drift Tracker', daemon = True)
+        self._thread.start()
+
+    def stop(self):
+        '''Stop the mini-sweeps, the estimates and history are kept
+        '''
+        self._stopEvent.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def running(self):
+        '''Returns True if the drift tracker thread is running
+        '''
+        return self._thread is not None and self._thread.is_alive()
+
+    def history(self):
+        '''Return a copy of the history in chronological order
+
+        Returns:
+            numpy.ndarray: structured array of driftHistoryDtype
+        '''
+        from .sampler import _ringSegments
+
+        with self._lock:
+            return np.concatenate(_ringSegments(self._history, self._count))
+
+    def _baseline(self):
+        '''Rx diode voltage 20 dip widths above the center, restoring the frequency afterwards
+        '''
+        offset = 20. * self.span / 1.e3 if np.isnan(self.q) else 20. * self.center / self.q
+        replies = self.mps.send_commands(['freq %0.0f'%((self.center + offset) * 1.e6), 'rxpowermv?', 'freq %0.0f'%(self.center * 1.e6)], recv = [False, True, False])
+        return self.mps._convert('rxpowermv', replies[0])
+
+    def sweep(self):
+        '''Run one mini-sweep and update the estimates
+
+        Returns:
+            bool: True if the mini-sweep contained a dip
+        '''
+        offsets = np.linspace(-self.span / 2., self.span / 2., self.points) # MHz
+        commands = []
+        for freq in self.center + offsets / 1.e3:
+            commands += ['freq %0.0f'%(freq * 1.e6), 'rxpowermv?']
+        commands.append('freq %0.0f'%(self.center * 1.e6))
+
+        startTime = time.monotonic()
+        replies = self.mps.send_commands(commands, recv = [False, True] * self.points + [False])
+        duration = time.monotonic() - startTime
+        rxVoltage = np.array([self.mps._convert('rxpowermv', reply) for reply in replies])
+        self.sweeps += 1
+        self._adapt_points(duration)
+
+        # parabola a * x**2 + b * x + c in MHz around the center
+        a, b, c = np.polyfit(offsets, rxVoltage, 2)
+        if a <= 0:
+            self.rejected += 1
+            return False
+        vertex = float(np.clip(-b / (2. * a), -self.span, self.span))
+        minimum = c - b**2 / (4. * a)
+
+        # Kalman update of the center
+        now = time.monotonic()
+        elapsed = 0. if self._lastTime is None else now - self._lastTime
+        self._lastTime = now
+        variance = self.centerError**2 + (self.driftRate * elapsed)**2
+        gain = variance / (variance + self.centerNoise**2)
+        measured = self.center + vertex / 1.e3
+        self.center = self.center + gain * (measured - self.center)
+        self.centerError = float(np.sqrt((1. - gain) * variance))
+
+        # Lorentzian dip: the curvature is baseline * depth / halfWidth**2
+        dipHeight = self.baseline - minimum
+        if dipHeight > 0 and self.baseline > 0:
+            halfWidth = np.sqrt(dipHeight / a) # MHz
+            q = self.center * 1.e3 / (2. * halfWidth)
+            depth = dipHeight / self.baseline
+            if np.isnan(self.q):
+                self.q, self.depth = q, depth
+            else:
+                self.q += self.smoothing * (q - self.q)
+                self.depth += self.smoothing * (depth - self.depth)
+
+        if self.follow:
+            self.mps.freq(round(self.center, 6))
+
+        with self._lock:
+            self._history[self._count % len(self._history)] = (now, self.center, self.q, self.depth, duration)
+            self._count += 1
+        return True
+
+    def _adapt_points(self, duration):
+        if duration > self.budget and self.points > 3:
+            self.points -= 1
+        elif duration < 0.5 * self.budget and self.points < self.maxPoints:
+            self.points += 1
+
+    def _run(self):
+        while not self._stopEvent.is_set():
+            startTime = time.monotonic()
+            try:
+                self.sweep()
+            except ValueError: # reply missing or not a number
+                self.errors += 1
+            duration = time.monotonic() - startTime
+            self._stopEvent.wait(max(self.period, duration / self.maxDutyCycle) - duration)
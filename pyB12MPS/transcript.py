@@ -0,0 +1,215 @@
+import json
+import time
+
+
+def _decode(data):
+    return bytes(data).decode('latin-1')
+
+
+class RecordingSerial:
+    '''Serial port wrapper which records the byte-level exchange with the MPS
+
+    Every write, read, readline and reset_input_buffer is recorded with the time of the call and the time it returned, from the connection to the MPS in init onwards. Save the transcript with save() and replay it with ReplaySerial.
+
+    Args:
+        ser (serial.Serial): Open serial port of the MPS, or any object with the pySerial interface such as SimulatedMPS
+
+    Example::
+
+        ser = serial.Serial('COM3', 115200, timeout = 1.)
+        recording = pyB12MPS.RecordingSerial(ser)
+        mps = pyB12MPS.MPS(ser = recording)
+
+        mps.rfsweepdosweep()
+        time.sleep(1)
+        mps.rfsweepdata()
+
+        mps.close()
+        recording.save('sweep.transcript')
+
+    '''
+    def __init__(self, ser):
+        self.ser = ser
+        self.events = []
+        self._startTime = time.perf_counter()
+        self.header = {'transcript' : 1, 'port' : getattr(ser, 'port', None), 'startTime' : time.time()}
+
+    def __getattr__(self, name): # baudrate, dtr, is_open, fileno, ... of the wrapped port
+        if name == 'ser':
+            raise AttributeError(name)
+        return getattr(self.ser, name)
+
+    @property
+    def port(self):
+        return self.ser.port
+
+    @property
+    def timeout(self):
+        return self.ser.timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self.ser.timeout = timeout
+
+    def _record(self, op, start, data = None, **info):
+        event = {'op' : op, 'start' : start - self._startTime, 'end' : time.perf_counter() - self._startTime}
+        if data is not None:
+            event['data'] = _decode(data)
+        event.update(info)
+        self.events.append(event)
+
+    def write(self, data):
+        start = time.perf_counter()
+        result = self.ser.write(data)
+        self._record('write', start, data)
+        return result
+
+    def read(self, size = 1):
+        start = time.perf_counter()
+        data = self.ser.read(size)
+        self._record('read', start, data, size = size)
+        return data
+
+    def readline(self):
+        start = time.perf_counter()
+        data = self.ser.readline()
+        self._record('readline', start, data)
+        return data
+
+    def reset_input_buffer(self):
+        start = time.perf_counter()
+        self.ser.reset_input_buffer()
+        self._record('reset_input_buffer', start)
+
+    def open(self):
+        self.ser.open()
+
+    def close(self):
+        self.ser.close()
+
+    def save(self, path):
+        '''Save the transcript as JSON lines, the header followed by one line per event
+
+        Args:
+            path (str): File name of the transcript
+        '''
+        with open(path, 'w') as f:
+            f.write(json.dumps(self.header) + '\n')
+            for event in self.events:
+                f.write(json.dumps(event) + '\n')
+
+
+class ReplaySerial:
+    '''Serial port which replays a transcript recorded with RecordingSerial
+
+    The MPS class runs on the replay like on the MPS which was recorded, without hardware. The calls of the MPS class must follow the transcript, a different sequence of calls raises ValueError.
+
+    With realtime True, each reply is returned after the device latency of the recording, measured from the preceding write, so that the host-side time of the replay adds to the recorded device time like in the recording. With realtime False, the replay runs as fast as possible, which leaves only the host-side time of a workflow.
+
+    Args:
+        transcript (str, RecordingSerial): File name of a transcript or the recording itself
+        realtime (bool): If True, replay with the recorded timing. Otherwise as fast as possible.
+        strict (bool): If True, raise ValueError if written bytes differ from the transcript
+
+    Attributes:
+        deviceTime (float): Recorded time in s which the replayed reads waited for the MPS
+
+    Example::
+
+        replay = pyB12MPS.ReplaySerial('sweep.transcript', realtime = False)
+        mps = pyB12MPS.MPS(ser = replay)
+
+        mps.rfsweepdosweep()
+        mps.rfsweepdata() # the recorded sweep
+
+    '''
+    def __init__(self, transcript, realtime = True, strict = True):
+        if isinstance(transcript, RecordingSerial):
+            header, events = transcript.header, list(transcript.events)
+        else:
+            with open(transcript) as f:
+                header = json.loads(f.readline())
+                events = [json.loads(line) for line in f if line.strip()]
+            if header.get('transcript') != 1:
+                raise ValueError('%s is not an MPS transcript'%transcript)
+
+        self.header = header
+        self.events = events
+        self.realtime = realtime
+        self.strict = strict
+        self.deviceTime = 0.
+
+        # pySerial attributes
+        self.port = header.get('port')
+        self.baudrate = 115200
+        self.timeout = 1.
+        self.dtr = True
+        self.is_open = True
+
+        self._position = 0
+        self._anchor = 0. # recorded end of the last write
+        self._replayAnchor = time.perf_counter()
+
+    def _next(self, op):
+        if self._position >= len(self.events):
+            raise ValueError('Transcript ended, %s not recorded'%op)
+        event = self.events[self._position]
+        if event['op'] != op:
+            raise ValueError('Transcript event %i is %s, got %s'%(self._position, event['op'], op))
+        self._position += 1
+        return event
+
+    def _wait(self, event):
+        '''Wait for the recorded device latency of a read and return its data
+        '''
+        latency = max(event['end'] - max(event['start'], self._anchor), 0.)
+        self.deviceTime += latency
+        if self.realtime:
+            delay = self._replayAnchor + (event['end'] - self._anchor) - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        return event['data'].encode('latin-1')
+
+    def write(self, data):
+        event = self._next('write')
+        if self.strict and event['data'] != _decode(data):
+            raise ValueError('Transcript event %i wrote %r, got %r'%(self._position - 1, event['data'], _decode(data)))
+        self._anchor = event['end']
+        self._replayAnchor = time.perf_counter()
+        return len(data)
+
+    def read(self, size = 1):
+        return self._wait(self._next('read'))
+
+    def readline(self):
+        return self._wait(self._next('readline'))
+
+    def reset_input_buffer(self):
+        self._next('reset_input_buffer')
+
+    @property
+    def in_waiting(self):
+        '''Bytes of the next recorded read which are available in the recorded timing
+        '''
+        if self._position >= len(self.events):
+            return 0
+        event = self.events[self._position]
+        if event['op'] not in ('read', 'readline'):
+            return 0
+        if self.realtime and time.perf_counter() < self._replayAnchor + (event['end'] - self._anchor):
+            return 0
+        return len(event['data'])
+
+    def remaining(self):
+        '''Returns the number of events which were not replayed
+        '''
+        return len(self.events) - self._position
+
+    def flush(self):
+        pass
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
@@ -1,15 +1,28 @@
 import unittest
 import pyB12MPS
 import numpy as np
+import time
+import os
+import socket
+import asyncio
+import threading
 
 test_power = 1
 test_freq = 9.5
 
+# Serial port of the MPS hardware to test, 'auto' to detect the port. If not set, the tests run against a simulated MPS.
+test_port = os.environ.get('PYB12MPS_TEST_PORT')
+
 class TestMPS(unittest.TestCase):
 
     @classmethod
     def setUpClass(self):
-        self.mps = pyB12MPS.MPS()
+        if test_port is None:
+            self.mps = pyB12MPS.MPS(ser = pyB12MPS.SimulatedMPS(), fastConnect = True)
+        elif test_port == 'auto':
+            self.mps = pyB12MPS.MPS()
+        else:
+            self.mps = pyB12MPS.MPS(port = test_port)
 
     def test_ampgain(self):
         self.mps.ampgain()
@@ -20,6 +33,25 @@ class TestMPS(unittest.TestCase):
     def test_amptemp(self):
         self.mps.amptemp()
 
+    def test_batch(self):
+        with self.mps.batch(verify = True):
+            self.mps.power(test_power)
+            self.mps.freq(test_freq)
+        self.assertEqual(self.mps.power(), test_power)
+        self.assertEqual(self.mps.freq(), test_freq)
+
+    def test_cache(self):
+        self.mps.cache(staleness = 5.)
+        try:
+            status = self.mps.systemstatus()
+            self.assertEqual(self.mps.wgstatus(), status['wgstatus'])
+            self.mps.freq(test_freq)
+            self.assertEqual(self.mps.freq(), test_freq)
+            self.mps.invalidate('freq')
+            self.assertEqual(self.mps.freq(), test_freq)
+        finally:
+            self.mps.cache(False)
+
     def test_firmware(self):
         self.mps.firmware()
 
@@ -37,6 +69,41 @@ class TestMPS(unittest.TestCase):
     def in_waiting(self):
         self.mps.in_waiting()
 
+    def test_instrument(self):
+        stats = self.mps.instrument()
+        events = []
+        locked = []
+        stats.postHooks.append(events.append)
+        stats.postHooks.append(lambda event: locked.append(self.mps._ioLock._is_owned()))
+        try:
+            self.mps.freq()
+            self.mps.query_many(['freq', 'power'])
+            with self.assertRaises(ValueError):
+                self.mps._convert('freq', 'not a frequency')
+            with self.assertRaises(ValueError):
+                pyB12MPS.mps._convertReply('power', 'not a power', stats)
+        finally:
+            self.mps.instrument(False)
+        summary = stats.summary()
+        self.assertEqual(summary['freq?']['count'], 2)
+        self.assertEqual(summary['freq?']['timeouts'], 0)
+        self.assertEqual(summary['freq?']['parseFailures'], 1)
+        self.assertEqual(summary['power?']['parseFailures'], 1)
+        self.assertGreater(summary['freq?']['total']['mean'], 0)
+        self.assertEqual(len(events), 2)
+        self.assertEqual(locked, [False, False])
+
+        # replies of getters which cannot be converted are counted
+        class GarbledMPS(pyB12MPS.SimulatedMPS):
+            def process(self, command):
+                return 'garbled' if command == 'power?' else pyB12MPS.SimulatedMPS.process(self, command)
+        mps = pyB12MPS.MPS(ser = GarbledMPS(), fastConnect = True)
+        stats = mps.instrument()
+        with self.assertRaises(ValueError):
+            mps.power()
+        self.assertEqual(stats.summary()['power?']['parseFailures'], 1)
+        mps.close()
+
     def test_lockstatus(self):
         self.mps.lockstatus()
 
@@ -51,11 +118,75 @@ class TestMPS(unittest.TestCase):
         power = self.mps.power()
         self.assertEqual(power, test_power)
 
+    def test_submit(self):
+        self.mps.power(test_power)
+        with self.mps.batch():
+            self.mps.power(test_power + 1)
+            future = self.mps.submit(['power?'], recv = True) # sent immediately, before the queued power
+            self.assertTrue(future.done())
+            self.assertEqual(future.result(), ['%i'%(test_power * 10)])
+        self.assertEqual(self.mps.power(), test_power + 1)
+
+        self.mps.cache(staleness = 5.)
+        try:
+            self.mps.freq(test_freq)
+            self.assertEqual(self.mps.freq(), test_freq)
+            self.mps.submit(['freq?'], recv = True).result()
+            self.assertEqual(self.mps.freq(), test_freq)
+        finally:
+            self.mps.cache(False)
+        self.mps.power(test_power)
+
+    def test_query_many(self):
+        self.mps.freq(test_freq)
+        freq, power, rx, tx = self.mps.query_many(['freq', 'power', 'rxpowermv', 'txpowermv'])
+        self.assertEqual(freq, test_freq)
+        self.assertIsInstance(rx, float)
+        with self.assertRaises(ValueError):
+            self.mps.query_many(['notacommand'])
+
+    def test_record(self):
+        import tempfile
+        path = os.path.join(tempfile.mkdtemp(), 'recording.b12')
+        with self.mps.record(path, channels = ('systemstatus', 'rxpowerdbm'), rate = 100, chunk = 4) as recorder:
+            time.sleep(0.1)
+        with self.mps.record(path, channels = ('systemstatus', 'rxpowerdbm'), rate = 100, chunk = 4):
+            time.sleep(0.1)
+        with self.assertRaises(ValueError):
+            self.mps.record(path, channels = ('rxpowermv',))
+        notRecording = os.path.join(os.path.dirname(path), 'notes.txt')
+        with open(notRecording, 'w') as f:
+            f.write('not a recording')
+        with self.assertRaises(ValueError):
+            self.mps.record(notRecording)
+        self.assertFalse(any(thread.name == 'MPS Stream' for thread in threading.enumerate()))
+
+        recording = pyB12MPS.Recording(path, indexStride = 3)
+        self.assertEqual(recording.serial, self.mps.serialNumber())
+        self.assertEqual(recording.units['freq'], 'GHz')
+        self.assertGreaterEqual(len(recording), recorder.count)
+        self.assertTrue(np.all(np.diff(recording['time']) > 0))
+        times = recording['time']
+        for ix in range(len(recording)):
+            self.assertEqual(len(recording.timeRange(times[ix])), len(recording) - ix)
+            self.assertEqual(len(recording.timeRange(stop = times[ix])), ix)
+        self.assertEqual(len(recording.timeRange(times[-1] + 1.)), 0)
+        del times
+        recording.close()
+
     def test_rfstatus(self):
         self.mps.rfstatus(0)
         rfstatus = self.mps.rfstatus()
         self.assertEqual(rfstatus, 0)
 
+    def test_rfsweepdata(self):
+        self.mps.rfsweepdosweep()
+        time.sleep(0.5)
+        data = self.mps.rfsweepdata()
+        self.assertTrue(np.issubdtype(data.dtype, np.integer))
+        freqs, data = self.mps.rfsweepdata(freqAxis = True)
+        self.assertEqual(len(freqs), len(data))
+
     def test_rxdiodesn(self):
         self.mps.rxdiodesn()
 
@@ -65,15 +196,134 @@ class TestMPS(unittest.TestCase):
     def test_rxpowermv(self):
         self.mps.rxpowermv()
 
+    def test_sampler(self):
+        sampler = self.mps.sampler(channels = ('rxpowermv', 'amptemp'), rate = 20, size = 5)
+        time.sleep(0.5)
+        sampler.stop()
+        data = sampler.snapshot()
+        self.assertEqual(len(data), 5)
+        self.assertTrue(np.all(np.diff(data['time']) > 0))
+        self.assertEqual(len(sampler.since(data['time'][-2])), 1)
+        self.assertIsNone(sampler.error)
+
+        # a serial port error stops the sampler and is kept
+        class FailingMPS(pyB12MPS.SimulatedMPS):
+            def write(self, data):
+                raise OSError('device disconnected')
+        mps = pyB12MPS.MPS(ser = pyB12MPS.SimulatedMPS(), fastConnect = True)
+        mps.ser = FailingMPS()
+        sampler = mps.sampler(channels = ('rxpowermv',), rate = 100)
+        sampler._thread.join(1.)
+        self.assertFalse(sampler.running())
+        self.assertIsInstance(sampler.error, OSError)
+        sampler.stop()
+        mps.close()
+
+    def test_sampler_full(self):
+        sampler = pyB12MPS.Sampler(self.mps, channels = ('rxpowermv',), size = 5, shared = True)
+        try:
+            reader = pyB12MPS.SampleReader(sampler.sharedName)
+            for ix in range(5): # ring buffer exactly full
+                sampler._append(float(ix), (10. * ix,))
+            self.assertTrue(np.array_equal(sampler.snapshot()['time'], np.arange(5.)))
+            self.assertTrue(np.array_equal(sampler.latest(2)['time'], [3., 4.]))
+            self.assertTrue(np.array_equal(sampler.since(2.)['time'], [3., 4.]))
+            self.assertTrue(np.array_equal(reader.latest(5)['time'], np.arange(5.)))
+            sampler._append(5., (50.,))
+            self.assertTrue(np.array_equal(sampler.snapshot()['time'], np.arange(1., 6.)))
+            reader.close()
+        finally:
+            sampler.close()
+
+    def test_shared_sampler(self):
+        sampler = self.mps.sampler(channels = ('rxpowermv', 'amptemp'), rate = 50, size = 8, shared = True)
+        try:
+            reader = pyB12MPS.SampleReader(sampler.sharedName)
+            self.assertEqual(reader.channels, ('rxpowermv', 'amptemp'))
+            sequence = reader.wait(timeout = 1.)
+            self.assertEqual(sequence % 2, 0)
+            deadline = time.monotonic() + 5.
+            while reader.count <= 8 and time.monotonic() < deadline: # wrap around the ring buffer
+                reader.wait(timeout = 0.1)
+            sampler.stop()
+            self.assertGreater(reader.count, 8)
+            self.assertEqual(reader.count, sampler.count)
+            self.assertTrue(np.array_equal(reader.latest(8), sampler.latest(8)))
+            older, newer = reader.segments()
+            self.assertTrue(np.shares_memory(newer, reader.buffer))
+            del older, newer
+            reader.close()
+        finally:
+            sampler.close()
+        self.assertEqual(len(sampler.snapshot()), 8)
+
+    def test_stream(self):
+        with self.mps.stream(channels = ('rxpowermv', 'freq'), rate = 200, chunk = 5, maxChunks = 1) as stream:
+            data = next(stream)
+            self.assertEqual(len(data), 5)
+            self.assertEqual(data.dtype.names, ('time', 'rxpowermv', 'freq'))
+            time.sleep(0.2) # acquisition waits for the consumer
+            self.assertGreater(stream.stalls, 0)
+            self.assertLessEqual(stream.count, 20)
+            self.assertTrue(np.all(np.diff(next(stream)['time']) > 0))
+        self.assertFalse(stream._thread.is_alive())
+        with self.assertRaises(StopIteration):
+            next(stream)
+
     def test_screen(self):
         self.mps.screen()
 
     def test_serialNumber(self):
         self.mps.serialNumber()
 
+    def test_sweep(self):
+        self.mps.freq(test_freq)
+        freqs = np.linspace(test_freq - 0.01, test_freq + 0.01, 5)
+        result = self.mps.sweep(freqs, settle = 0.01, power = test_power)
+        self.assertTrue(np.array_equal(result['freq'], freqs))
+        self.assertEqual(len(result['rxpowermv']), 5)
+        self.assertEqual(self.mps.freq(), test_freq)
+
+        result = self.mps.sweep(freqs, settle = 'auto', maxWait = 0.1)
+        self.assertTrue(np.all(result['settle'] > 0))
+
+        result = self.mps.sweep(freqs, settle = 0, chunk = 2)
+        self.assertEqual(len(result['rxpowermv']), 5)
+        self.assertTrue(np.all(np.diff(result['time']) > 0))
+        with self.assertRaises(ValueError):
+            self.mps.sweep(freqs, settle = 0, chunk = 0)
+
+    def test_rxsettle(self):
+        rxVoltage, settleTime = self.mps.rxsettle(tolerance = 1000.)
+        self.assertIsInstance(rxVoltage, float)
+        self.assertGreaterEqual(self.mps.freq(test_freq, settle = True), 0)
+
     def test_systemstatus(self):
         self.mps.systemstatus()
 
+    def test_systemstatus_record(self):
+        status = self.mps.systemstatus()
+        record = self.mps.systemstatus(record = True)
+        self.assertEqual(record.freq, status['freq'])
+        self.assertEqual(record.wgstatus, status['wgstatus'])
+        self.assertEqual(list(record.asdict()), list(status))
+        self.assertEqual([type(value) for value in record.asdict().values()], [type(value) for value in status.values()])
+        self.assertIsInstance(status['lockstatus'], int)
+        self.assertEqual(list(self.mps.query_many(['systemstatus'])[0]), list(status))
+        log = np.zeros(3, dtype = pyB12MPS.systemStatusDtype)
+        self.mps.systemstatus(out = log, index = 1)
+        self.assertEqual(log['freq'][1], record.freq)
+
+        reply = 'freq:9500000,power:-990,rxpowermv:3501,txpowermv:2543,rfstatus:1,wgstatus:1,ampstatus:1,amptemp:253,lockstatus:0,screen:1'
+        record = pyB12MPS.SystemStatus.parse(reply)
+        self.assertEqual(record.power, -99.)
+        self.assertEqual(pyB12MPS.SystemStatus.parse('screen:1,' + reply.rsplit(',', 1)[0]), record)
+        rows = pyB12MPS.parseSystemStatus([reply] * 2, out = log, start = 1)
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(np.allclose(log['amptemp'][1:], 25.3))
+        with self.assertRaises(ValueError):
+            pyB12MPS.parseSystemStatus([reply] * 3, out = log, start = 1)
+
     def trig(self):
         self.mps.trig()
 
@@ -98,6 +348,372 @@ class TestMPS(unittest.TestCase):
     def tearDownClass(self):
         self.mps.close()
 
+class TestSimulatedMPS(unittest.TestCase):
+
+    def test_resonance(self):
+        simulator = pyB12MPS.SimulatedMPS(resonance = 9.55, q = 1000.)
+        mps = pyB12MPS.MPS(ser = simulator, fastConnect = True)
+        mps.wgstatus(1)
+        result = mps.sweep(np.linspace(9.5, 9.6, 101), settle = 0.)
+        self.assertAlmostEqual(result['freq'][np.argmin(result['rxpowermv'])], 9.55)
+        mps.close()
+
+    def test_autotune(self):
+        recording = pyB12MPS.RecordingSerial(pyB12MPS.SimulatedMPS(resonance = 9.5731, q = 2000., noise = 1., seed = 1))
+        mps = pyB12MPS.MPS(ser = recording, fastConnect = True)
+        mps.rfsweepinitialdwelltime(1)
+        result = mps.autotune(tolerance = 0.2)
+        self.assertLess(abs(result['freq'] - 9.5731), 2.e-4)
+        self.assertEqual(mps.freq(), result['freq'])
+        self.assertLessEqual(len(result['centers']), 4)
+        self.assertEqual(mps.rfsweepsw(), 1)
+        self.assertEqual(mps.rfsweepnpts(), 100)
+        # the number of points differs from the previous sweep, stale data is not accepted
+        written = ''.join(event['data'] for event in recording.events if event['op'] == 'write')
+        npts = [int(line.split()[1]) for line in written.splitlines() if line.startswith('rfsweepnpts ')]
+        self.assertEqual(npts[:len(result['centers'])], [100, 101, 100, 101][:len(result['centers'])])
+        with self.assertRaises(ValueError):
+            mps.autotune(widths = ())
+        mps.close()
+
+        freqs = np.linspace(9.5, 9.6, 101)
+        centers = np.array([9.52, 9.5513, 9.58])
+        curves = 1. - 1. / (1. + ((freqs - centers[:, None]) / 0.0025)**2)
+        self.assertTrue(np.allclose(pyB12MPS.dipCenter(freqs, curves), centers, atol = 2.e-4))
+
+    def test_fitdips(self):
+        freqs = np.linspace(9.5, 9.6, 201)
+        centers = np.array([9.52, 9.5513, 9.58, 9.7])
+        q = np.array([2000., 3000., 1500., 2000.])
+        halfWidth = centers / (2. * q)
+        curves = 400. * (1. - 0.8 / (1. + ((freqs - centers[:, None]) / halfWidth[:, None])**2))
+        results = pyB12MPS.fitDips(freqs, curves)
+        self.assertEqual(results.dtype, pyB12MPS.dipFitDtype)
+        self.assertTrue(np.allclose(results['center'][:3], centers[:3], atol = 1.e-4))
+        self.assertTrue(np.allclose(results['q'][:3], q[:3], rtol = 0.05))
+        self.assertTrue(np.allclose(results['depth'][:3], 0.8, atol = 0.03))
+        self.assertTrue(np.allclose(results['baseline'][:3], 400., rtol = 0.02))
+        self.assertTrue(np.isnan(results['q'][3])) # dip outside of the sweep
+        pooled = pyB12MPS.fitDips(freqs, curves, processes = 2, chunk = 2)
+        for name in pyB12MPS.dipFitDtype.names:
+            self.assertTrue(np.array_equal(pooled[name], results[name], equal_nan = True))
+
+    def test_powercalibration(self):
+        import tempfile
+        directory = tempfile.mkdtemp()
+        mps = pyB12MPS.MPS(ser = pyB12MPS.SimulatedMPS(), fastConnect = True)
+        mps.wgstatus(1)
+        mps.rfstatus(1)
+        mps.freq(9.55)
+        mps.power(10)
+        with self.assertRaises(ValueError):
+            mps.powercalibration(directory = directory)
+        calibration = mps.powercalibration(freqs = np.linspace(9.45, 9.65, 11), powers = np.arange(0., 40.5, 2.), settle = 0.001, directory = directory)
+        self.assertEqual((mps.freq(), mps.power()), (9.55, 10.))
+        self.assertEqual(os.listdir(directory), [calibration.fileName()])
+        loaded = mps.powercalibration(directory = directory)
+        self.assertTrue(np.array_equal(loaded.txPower, calibration.txPower))
+        for freq in (9.45, 9.5337, 9.65):
+            mps.freq(freq)
+            mps.calibratedpower(25.)
+            self.assertAlmostEqual(mps.txpowerdbm(), 25., delta = 0.15)
+        setPowers = calibration.power(25., np.linspace(9.45, 9.65, 5))
+        self.assertTrue(np.allclose(calibration.txpower(setPowers, np.linspace(9.45, 9.65, 5)), 25.))
+        with self.assertRaises(ValueError):
+            calibration.power(25., 9.7) # outside of the calibrated frequencies
+        pipelined = pyB12MPS.PowerCalibration.measure(mps, calibration.freqs, calibration.powers, settle = 0)
+        self.assertTrue(np.allclose(pipelined.txPower, calibration.txPower, atol = 0.1))
+        mps.ampgain(3)
+        with self.assertRaises(ValueError): # calibration of another amplifier gain
+            mps.calibratedpower(25.)
+        with self.assertRaises(ValueError): # no calibration for this amplifier gain
+            mps.powercalibration(directory = directory)
+        mps.close()
+
+    def test_tracker(self):
+        simulator = pyB12MPS.SimulatedMPS(resonance = 9.55, q = 2000.)
+        mps = pyB12MPS.MPS(ser = simulator, fastConnect = True)
+        mps.wgstatus(1)
+        mps.rfstatus(1)
+        mps.freq(9.5515)
+        tracker = mps.tracker()
+        for ix in range(20): # resonance drifts by 1 MHz
+            simulator.resonance += 0.00005
+            time.sleep(0.01)
+        time.sleep(0.1)
+        tracker.stop()
+        self.assertLess(abs(tracker.freq - simulator.resonance), 1.e-4)
+        self.assertEqual(mps.freq(), tracker.freq)
+        self.assertGreater(tracker.updateRate, 0)
+        self.assertEqual(tracker.errors, 0)
+        with self.assertRaises(ValueError):
+            pyB12MPS.FrequencyTracker(mps, dither = 0.01)
+        mps.close()
+
+    def test_drifttracker(self):
+        simulator = pyB12MPS.SimulatedMPS(resonance = 9.55, q = 2000.)
+        mps = pyB12MPS.MPS(ser = simulator, fastConnect = True)
+        mps.wgstatus(1)
+        mps.rfstatus(1)
+        mps.freq(9.5503)
+        drift = mps.drifttracker(period = 0.02, maxDutyCycle = 0.5, driftRate = 0.2)
+        for ix in range(20): # resonance drifts by 0.5 MHz
+            simulator.resonance += 0.000025
+            time.sleep(0.02)
+        time.sleep(0.1)
+        drift.stop()
+        history = drift.history()
+        self.assertGreater(len(history), 5)
+        self.assertTrue(np.all(np.diff(history['time']) > 0))
+        self.assertLess(abs(drift.center - simulator.resonance), 1.e-4)
+        self.assertLess(abs(drift.q - 2000.) / 2000., 0.2)
+        self.assertAlmostEqual(mps.freq(), round(drift.center, 6))
+        self.assertEqual(drift.rejected, 0)
+        with self.assertRaises(ValueError):
+            pyB12MPS.DriftTracker(mps, points = 2)
+        mps.close()
+
+    def test_boot(self):
+        simulator = pyB12MPS.SimulatedMPS(booted = False, bootTime = 0.1)
+        mps = pyB12MPS.MPS(ser = simulator, fastConnect = True)
+        self.assertEqual(mps.id(), 'Bridge12 MPS')
+        mps.close()
+
+    def test_cache_side_effects(self):
+        simulator = pyB12MPS.SimulatedMPS()
+        mps = pyB12MPS.MPS(ser = simulator, fastConnect = True)
+        mps.cache(staleness = 60.)
+        mps.wgstatus(1)
+        mps.rfstatus(1)
+        self.assertEqual(mps.rfstatus(), 1)
+        mps.wgstatus(0) # disables the RF output
+        self.assertEqual(mps.rfstatus(), 0)
+        mps.freq(9.5)
+        self.assertEqual(mps.freq(), 9.5)
+        simulator.state['freq'] = 9551000 # moved by the lock or an RF sweep
+        mps.rfsweepdosweep()
+        self.assertEqual(mps.freq(), 9.551)
+        mps.lockstatus(0)
+        self.assertNotIn('freq', mps._cache)
+        mps.close()
+
+    def test_late_probe(self):
+        import contextlib
+        import io
+        output = io.StringIO()
+        startTime = time.monotonic()
+        with contextlib.redirect_stdout(output):
+            mps = pyB12MPS.MPS(ser = pyB12MPS.SimulatedMPS(latency = {'default' : 0., 'id' : 0.4}), fastConnect = True)
+        self.assertLess(time.monotonic() - startTime, 2.)
+        self.assertNotIn('', output.getvalue().splitlines()) # unanswered probe prints no blank line
+        self.assertEqual(mps.id(), 'Bridge12 MPS')
+        mps.close()
+
+        with self.assertRaises(RuntimeError):
+            pyB12MPS.MPS(ser = pyB12MPS.SimulatedMPS(booted = False, bootTime = 10.), fastConnect = True, bootTimeout = 0.5)
+
+    def test_latency(self):
+        mps = pyB12MPS.MPS(ser = pyB12MPS.SimulatedMPS(latency = {'default' : 0., 'systemstatus' : 0.05}), fastConnect = True)
+        startTime = time.monotonic()
+        mps.systemstatus()
+        self.assertGreaterEqual(time.monotonic() - startTime, 0.05)
+        mps.close()
+
+    @unittest.skipUnless(os.name == 'posix', 'pseudo terminals require POSIX')
+    def test_pty(self):
+        simulator = pyB12MPS.SimulatedMPS()
+        port = simulator.open_pty()
+        mps = pyB12MPS.MPS(port = port, fastConnect = True)
+        mps.freq(test_freq)
+        self.assertEqual(mps.freq(), test_freq)
+        slave = simulator._ptySlave
+        mps.close()
+        simulator.close()
+        self.assertIsNone(simulator._ptySlave)
+        with self.assertRaises(OSError): # file descriptor of the pseudo terminal is closed
+            os.fstat(slave)
+
+    def test_thread_safe(self):
+        import threading
+        mps = pyB12MPS.MPS(ser = pyB12MPS.SimulatedMPS(latency = 0.001), fastConnect = True, threadSafe = True)
+        mps.freq(test_freq)
+        errors = []
+        def worker():
+            try:
+                for ix in range(20):
+                    self.assertEqual(mps.freq(), test_freq)
+                    self.assertEqual(mps.query_many(['freq', 'wgstatus']), [test_freq, 0])
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target = worker) for ix in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(mps.submit(['freq?'], recv = True).result(), ['9500000'])
+        mps.close()
+
+    def test_priority(self):
+        mps = pyB12MPS.MPS(ser = pyB12MPS.SimulatedMPS(latency = 0.01), fastConnect = True, threadSafe = True)
+        with mps.priority(pyB12MPS.PRIORITY_BACKGROUND):
+            background = [mps.submit(['rxpowermv?'], recv = True) for ix in range(30)]
+        self.assertFalse(mps.foreground_busy())
+        start = time.monotonic()
+        mps.rfstatus(0) # safety command overtakes the queued background polls
+        self.assertLess(time.monotonic() - start, 0.15)
+        self.assertFalse(all(future.done() for future in background))
+        self.assertTrue(mps.foreground_busy(1.))
+        for future in background:
+            self.assertEqual(len(future.result()), 1)
+        with self.assertRaises(ValueError):
+            mps.priority(5)
+        mps.close()
+
+    def test_server(self):
+        import threading
+        mps = pyB12MPS.MPS(ser = pyB12MPS.SimulatedMPS(latency = {'default' : 0., 'systemstatus' : 0.05}), fastConnect = True, threadSafe = True)
+        server = pyB12MPS.MPSServer(mps, address = ('localhost', 0), channels = ('rxpowermv', 'amptemp'), rate = 50)
+        address = server.start()
+        client = pyB12MPS.MPSClient(address)
+        client.freq(test_freq)
+        self.assertEqual(client.freq(), test_freq)
+        self.assertEqual(client.query_many(['freq', 'wgstatus']), [test_freq, 0])
+        stats = client.instrument()
+        try:
+            client.freq()
+            client.query_many(['freq', 'power'])
+        finally:
+            client.instrument(False)
+        summary = stats.summary()
+        self.assertEqual(summary['freq?']['count'], 2)
+        self.assertEqual(summary['power?']['timeouts'], 0)
+        self.assertGreater(summary['freq?']['total']['mean'], 0)
+
+        # identical queries in flight are sent to the MPS once
+        clients = [pyB12MPS.MPSClient(address) for ix in range(4)]
+        statuses = []
+        threads = [threading.Thread(target = lambda other = other: statuses.append(other.systemstatus())) for other in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(statuses), 4)
+        self.assertGreater(server.coalesced, 0)
+
+        samples = client.subscribe()
+        sample = next(samples)
+        self.assertEqual(set(sample), {'time', 'rxpowermv', 'amptemp'})
+        samples.close()
+
+        # the telemetry sampler stops after the last subscriber disconnected and restarts for the next one
+        for ix in range(100):
+            if not any(thread.name == 'MPS Sampler' for thread in threading.enumerate()):
+                break
+            time.sleep(0.05)
+        self.assertFalse(any(thread.name == 'MPS Sampler' for thread in threading.enumerate()))
+        samples = client.subscribe()
+        self.assertEqual(set(next(samples)), {'time', 'rxpowermv', 'amptemp'})
+        samples.close()
+
+        client.send_command('_stop_')
+        server._thread.join(5.)
+        self.assertFalse(server._thread.is_alive())
+        for other in clients + [client]:
+            other.close()
+        mps.close()
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'Unix sockets are not supported')
+    def test_server_unix(self):
+        import tempfile
+        mps = pyB12MPS.MPS(ser = pyB12MPS.SimulatedMPS(), fastConnect = True, threadSafe = True)
+        path = os.path.join(tempfile.mkdtemp(), 'mps.sock')
+        with open(path, 'w') as f:
+            f.write('not a socket')
+        with self.assertRaises(FileExistsError):
+            pyB12MPS.MPSServer(mps, address = path)
+        self.assertTrue(os.path.exists(path))
+        os.remove(path)
+
+        server = pyB12MPS.MPSServer(mps, address = path)
+        server.start()
+        client = pyB12MPS.MPSClient(path)
+        client.freq(test_freq)
+        self.assertEqual(client.freq(), test_freq)
+        server.shutdown()
+        client.close()
+        self.assertFalse(os.path.exists(path))
+        mps.close()
+
+    def test_stream_pipelined(self):
+        mps = pyB12MPS.MPS(ser = pyB12MPS.SimulatedMPS(latency = 0.001), fastConnect = True, threadSafe = True)
+        stream = mps.stream(channels = ('rxpowermv', 'amptemp'), chunk = 20)
+        chunks = [next(stream) for ix in range(3)]
+        stream.close()
+        self.assertTrue(np.all(chunks[2]['amptemp'] == 25.))
+        mps.close()
+
+    def test_transcript(self):
+        import tempfile
+        def workflow(mps):
+            mps.freq(9.55)
+            mps.wgstatus(1)
+            mps.rfsweepdosweep()
+            return mps.freq(), mps.systemstatus(), mps.rfsweepdata()
+
+        recording = pyB12MPS.RecordingSerial(pyB12MPS.SimulatedMPS(latency = 0.01))
+        mps = pyB12MPS.MPS(ser = recording, fastConnect = True)
+        recorded = workflow(mps)
+        mps.close()
+        path = os.path.join(tempfile.mkdtemp(), 'workflow.transcript')
+        recording.save(path)
+
+        for realtime in (False, True):
+            replay = pyB12MPS.ReplaySerial(path, realtime = realtime)
+            startTime = time.monotonic()
+            mps = pyB12MPS.MPS(ser = replay, fastConnect = True)
+            replayed = workflow(mps)
+            duration = time.monotonic() - startTime
+            mps.close()
+            self.assertEqual(replayed[:2], recorded[:2])
+            self.assertTrue(np.array_equal(replayed[2], recorded[2]))
+            self.assertEqual(replay.remaining(), 0)
+            self.assertGreaterEqual(replay.deviceTime, 0.04)
+            if realtime:
+                self.assertGreaterEqual(duration, 0.04)
+            else:
+                self.assertLess(duration, 0.04)
+
+        mps = pyB12MPS.MPS(ser = pyB12MPS.ReplaySerial(recording), fastConnect = True)
+        with self.assertRaises(ValueError):
+            mps.freq(9.6)
+        mps.ser.close()
+
+    def test_async(self):
+        async def run():
+            mps = await pyB12MPS.AsyncMPS.connect(ser = pyB12MPS.SimulatedMPS(), fastConnect = True)
+            await mps.freq(test_freq)
+            freq, power = await mps.query_many(['freq', 'power'])
+            self.assertEqual(freq, test_freq)
+            self.assertEqual(await mps.rfsweepnpts(), 100)
+            with self.assertRaises(ValueError):
+                await mps.freq(200)
+
+            # functions with several commands
+            await mps.wgstatus(1)
+            await mps.rfstatus(1)
+            settleTime = await mps.freq(9.55, settle = True)
+            self.assertGreaterEqual(settleTime, 0)
+            self.assertEqual(await mps.freq(), 9.55)
+            await mps.rfsweepdosweep()
+            freqs, data = await mps.rfsweepdata(freqAxis = True)
+            self.assertEqual(len(freqs), len(data))
+            result = await mps.sweep(np.linspace(9.54, 9.56, 5), settle = 0)
+            self.assertEqual(len(result['rxpowermv']), 5)
+            mps.close()
+
+        asyncio.run(run())
+
 if __name__ == "__main__":
     pass
 